@@ -1,351 +1,724 @@
-import pandas as pd
+import time
+_started = time.perf_counter()  # cold-start breakdown (see startup below)
+
 import json
-import re
-from flask import Flask, render_template, jsonify, request, Response
-from urllib.parse import unquote
+import hashlib
+import math
+from bisect import bisect_right
+from flask import Flask, render_template, jsonify, request, Response, g, has_request_context
+from urllib.parse import unquote, urlencode
+from functools import wraps
+from itertools import islice
+import hmac
 import os
-from datetime import datetime
+import signal
+import sys
+import tempfile
+import threading
+from datetime import datetime, timezone
+from store import RestaurantStore, RECORD_FIELDS
+from snapshot import load_snapshot, save_snapshot, SnapshotError
+from markupsafe import Markup
+from page_cache import CachedPage, PageCache, VersionedCache
+from fragments import page_links
+from facets import RATING_STEPS, REVIEW_STEPS, parse_filters, filter_query
+from dataset import Dataset, posting_indexes
+from slugs import slugify
+from spatial import haversine_km
+from reloader import Reloader
+import instrument
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Seconds spent in each part of startup; pandas is only imported by the
+# Excel fallback, so a snapshot or JSON start never pays for it
+startup = {'imports': time.perf_counter() - _started}
 
 app = Flask(__name__)
 
-# Global variables to store processed data
+# Per-request phase timings (METRICS_ENABLED=1); a no-op wrapper otherwise
+render_template = instrument.timed('render')(render_template)
+
+# The data being served. Requests read it through current_data(), which pins
+# the dataset a request started with; reloading swaps this one reference.
+dataset = None
+
+# The serving dataset's fields, kept for scripts (convert_to_json.py, freeze.py,
+# bench.py). restaurants_data is a RestaurantStore; score_order, cuisine_index,
+# neighbourhood_index and neighbourhood_cuisine_index (served by __getattr__,
+# so they are only built when read) map a slug to an array of positions in
+# restaurants_data, highest score first.
 restaurants_data = None
 cuisines_dict = None
 neighbourhoods_dict = None
+_INDEX_NAMES = ('score_order', 'cuisine_index', 'neighbourhood_index', 'neighbourhood_cuisine_index')
 
-def slugify(text):
-    """Convert text to URL-friendly slug"""
-    if pd.isna(text) or not text:
-        return ""
-    text = str(text).lower()
-    text = re.sub(r'[^\w\s-]', '', text)
-    text = re.sub(r'[-\s]+', '-', text)
-    return text.strip('-')
+# Identifies the loaded data; changes whenever a different snapshot is loaded
+data_version = None
+data_updated_at = None
 
-def extract_cuisines(subtypes_str):
-    """Extract cuisine types from subtypes string"""
-    if pd.isna(subtypes_str):
-        return ['Restaurant']
-    
-    subtypes_str = str(subtypes_str)
-    parts = [p.strip() for p in subtypes_str.split(',')]
-    
-    cuisines = []
-    skip_terms = {'restaurant', 'bar', 'cafe', 'café', 'food', 'dining', 'establishment', 'grill'}
+# Where the processed data files are read from (see load_dataset)
+DATA_DIR = os.environ.get('DATA_DIR') or os.path.dirname(os.path.abspath(__file__))
+
+# With SHARED_DATA=1, data found only as JSON or Excel is written once as a
+# binary snapshot under SHARED_DATA_DIR, and every worker process maps that
+# file instead of holding its own parsed copy (see load_shared_dataset)
+SHARED_DATA = os.environ.get('SHARED_DATA', '').lower() in ('1', 'true', 'yes')
+SHARED_DATA_DIR = os.environ.get('SHARED_DATA_DIR') or os.path.join(tempfile.gettempdir(), 'londonfoodfinds')
+
+def __getattr__(name):
+    if name in _INDEX_NAMES and dataset is not None:
+        return getattr(dataset, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def build_indexes(store, order=None):
+    """Build the score ordering and posting lists of store into the module globals"""
+    global score_order, cuisine_index, neighbourhood_index, neighbourhood_cuisine_index
+    score_order, cuisine_index, neighbourhood_index, neighbourhood_cuisine_index = posting_indexes(store, order)
+
+def _file_version(path):
+    """Version string and modification time identifying a data file's contents"""
+    stat = os.stat(path)
+    key = f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16], datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+
+def _sources_version(paths):
+    """Version string and latest modification time of several data files together"""
+    versions = [_file_version(path) for path in paths]
+    key = ':'.join(version for version, _ in versions)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16], max(updated for _, updated in versions)
+
+def snapshot_dataset(path):
+    """Dataset over a memory-mapped binary snapshot"""
+    snapshot = load_snapshot(path)
+    return Dataset(snapshot['restaurants'], snapshot['cuisines'], snapshot['neighbourhoods'],
+                   snapshot['version'], datetime.fromisoformat(snapshot['created_at']),
+                   indexes=(snapshot['score_order'], snapshot['cuisine_index'],
+                            snapshot['neighbourhood_index'], snapshot['neighbourhood_cuisine_index']),
+                   search=snapshot['search'], spatial=snapshot['spatial'], facets=snapshot['facets'],
+                   similar=snapshot['similar'])
+
+def save_dataset(path, data):
+    """Write a Dataset and all of its derived indexes as a binary snapshot"""
+    return save_snapshot(path, data.restaurants, data.score_order, {
+        'cuisine_index': data.cuisine_index,
+        'neighbourhood_index': data.neighbourhood_index,
+        'neighbourhood_cuisine_index': data.neighbourhood_cuisine_index,
+    }, data.cuisines, data.neighbourhoods, data.search, data.spatial, data.facets, data.updated_at,
+        data.similar)
+
+def load_shared_dataset(source, data_dir=None):
+    """Map the shared snapshot of a JSON or Excel data file, writing it first if needed
     
-    for part in parts:
-        part_lower = part.lower()
-        
-        # Skip generic terms
-        if part_lower in skip_terms:
-            continue
-        
-        # Remove common suffixes
-        cuisine = part
-        cuisine = re.sub(r'\s+restaurant\s*$', '', cuisine, flags=re.IGNORECASE)
-        cuisine = re.sub(r'\s+takeaway\s*$', '', cuisine, flags=re.IGNORECASE)
-        cuisine = re.sub(r'\s+cafe\s*$', '', cuisine, flags=re.IGNORECASE)
-        cuisine = re.sub(r'\s+café\s*$', '', cuisine, flags=re.IGNORECASE)
-        cuisine = cuisine.strip()
-        
-        # Skip if it's just a generic term or too short
-        if not cuisine or len(cuisine) < 3 or cuisine.lower() in skip_terms:
-            continue
-        
-        # Capitalize properly
-        if cuisine:
-            # Handle multi-word cuisines
-            words = cuisine.split()
-            if len(words) > 1:
-                cuisine = ' '.join([w.capitalize() for w in words])
-            else:
-                cuisine = cuisine.capitalize()
-            
-            cuisines.append(cuisine)
-    
-    # If no cuisines found, default to Restaurant
-    if not cuisines:
-        cuisines = ['Restaurant']
-    
-    # Return unique cuisines (preserving order)
-    seen = set()
-    result = []
-    for c in cuisines:
-        c_lower = c.lower()
-        if c_lower not in seen:
-            seen.add(c_lower)
-            result.append(c)
-    
-    return result
-
-def load_and_process_data():
-    """Load and process restaurant data from Excel or JSON"""
-    global restaurants_data, cuisines_dict, neighbourhoods_dict
+    The first worker to ask processes the file and writes the snapshot while
+    holding a lock; the others wait for it and map the same file, so the
+    operating system keeps one copy of the data however many workers run.
+    """
+    version, _ = _file_version(source)
+    os.makedirs(SHARED_DATA_DIR, exist_ok=True)
+    path = os.path.join(SHARED_DATA_DIR, f'shared-{version}.bin')
+    if not os.path.exists(path):
+        with open(f'{path}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # released when the file closes
+            if not os.path.exists(path):
+                data = load_dataset(data_dir=data_dir, shared=False)
+                if data.version == 'empty':
+                    return data
+                print(f"Writing shared snapshot {path}...")
+                save_dataset(path, data)
+                # Workers still mapping an older snapshot keep it until they reload
+                for name in os.listdir(SHARED_DATA_DIR):
+                    if name.startswith('shared-') and name.endswith('.bin') and name != os.path.basename(path):
+                        os.remove(os.path.join(SHARED_DATA_DIR, name))
+    print(f"Loading shared snapshot {path}...")
+    return snapshot_dataset(path)
+
+@instrument.timed_gauge('data_load_seconds', 'Seconds the latest data load took.')
+def load_dataset(source_path=None, data_dir=None, shared=None):
+    """Load and process restaurant data from a binary snapshot, JSON or Excel into a Dataset
     
+    Passing source_path skips the processed files and always processes that
+    export (.xlsx, .csv or .parquet), or each of a list of exports, processed
+    in parallel and merged (see ingest.process_files). data_dir is where
+    processed_data.bin and processed_data.json are looked for (default:
+    DATA_DIR). shared (default: SHARED_DATA) maps JSON or Excel data through
+    a shared snapshot.
+    """
     # Get the base directory (works for both local and Vercel)
-    base_dir = os.path.dirname(os.path.abspath(__file__))
+    base_dir = data_dir or DATA_DIR
+    snapshot_path = os.path.join(base_dir, 'processed_data.bin')
     json_path = os.path.join(base_dir, 'processed_data.json')
     excel_path = os.path.join(base_dir, 'OS-20251124200014m1e_restaurant.xlsx')
     
+    # Several exports, e.g. one per region, are processed side by side and merged
+    if isinstance(source_path, (list, tuple)) and len(source_path) > 1:
+        print(f"Loading {len(source_path)} exports...")
+        return process_dataset(source_path)
+    if isinstance(source_path, (list, tuple)):
+        source_path = source_path[0] if source_path else None
+    
+    # Prefer the memory-mapped binary snapshot: no parsing, rows decode on access
+    if source_path is None and os.path.exists(snapshot_path):
+        print("Loading from processed_data.bin...")
+        try:
+            data = snapshot_dataset(snapshot_path)
+            print(f"Loaded {len(data.restaurants)} restaurants from snapshot {data.version}")
+            print(f"Found {len(data.cuisines)} unique cuisines")
+            print(f"Found {len(data.neighbourhoods)} neighbourhoods")
+            return data
+        except (OSError, SnapshotError) as e:
+            print(f"Error loading binary snapshot: {e}")
+            # Continue to try the JSON file
+    
+    # Workers share one mapped snapshot of the JSON or Excel data
+    if shared is None:
+        shared = SHARED_DATA
+    if shared and source_path is None and fcntl is not None:
+        source = json_path if os.path.exists(json_path) else excel_path
+        if os.path.exists(source):
+            try:
+                data = load_shared_dataset(source, base_dir)
+                print(f"Loaded {len(data.restaurants)} restaurants from shared snapshot {data.version}")
+                return data
+            except (OSError, SnapshotError) as e:
+                print(f"Error sharing data through a snapshot: {e}")
+                # Continue with a private copy
+    
     # Try to load from JSON first (for Vercel/production)
-    if os.path.exists(json_path):
+    if source_path is None and os.path.exists(json_path):
         print("Loading from processed_data.json...")
         try:
             import json
             with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                restaurants_data = data.get('restaurants', [])
-                cuisines_dict = data.get('cuisines', {})
-                neighbourhoods_dict = data.get('neighbourhoods', {})
-            print(f"Loaded {len(restaurants_data)} restaurants from JSON")
-            print(f"Found {len(cuisines_dict)} unique cuisines")
-            print(f"Found {len(neighbourhoods_dict)} neighbourhoods")
-            return
+                raw = json.load(f)
+            version, updated_at = _file_version(json_path)
+            data = Dataset(RestaurantStore.from_records(raw.get('restaurants', [])),
+                           raw.get('cuisines', {}), raw.get('neighbourhoods', {}),
+                           version, updated_at, order=raw.get('score_order'))
+            print(f"Loaded {len(data.restaurants)} restaurants from JSON")
+            print(f"Found {len(data.cuisines)} unique cuisines")
+            print(f"Found {len(data.neighbourhoods)} neighbourhoods")
+            return data
         except Exception as e:
             print(f"Error loading JSON: {e}")
             # Continue to try Excel file
     
-    # Fallback to Excel file (for local development)
+    # Fallback to Excel file (for local development), or the export asked for
+    if source_path is not None:
+        excel_path = source_path
     if os.path.exists(excel_path):
-        print("Loading Excel file...")
+        print(f"Loading {os.path.basename(excel_path)}...")
     elif not os.path.exists(json_path):
         print("ERROR: Neither processed_data.json nor OS-20251124200014m1e_restaurant.xlsx found!")
         print(f"Looked in: {base_dir}")
         print("Please run: python convert_to_json.py to create processed_data.json")
-        restaurants_data = []
-        cuisines_dict = {}
-        neighbourhoods_dict = {}
-        return
+        return Dataset.empty()
     else:
         # JSON exists but failed to load, Excel doesn't exist
         print("ERROR: Failed to load processed_data.json and Excel file not found!")
-        restaurants_data = []
-        cuisines_dict = {}
-        neighbourhoods_dict = {}
-        return
-    
-    # Load Excel file
-    df = pd.read_excel(excel_path)
-    
-    print(f"Loaded {len(df)} restaurants")
+        return Dataset.empty()
     
     # Filter for Greater London area (you can adjust this)
     # For now, we'll use all data
     
-    # Process each restaurant
-    restaurants = []
-    cuisines_count = {}
-    neighbourhoods_count = {}
-    
-    for idx, row in df.iterrows():
-        # Extract cuisine from subtypes
-        subtypes = row.get('subtypes', '')
-        cuisines = extract_cuisines(subtypes)
-        if not cuisines:
-            cuisines = ['Restaurant']
-        
-        primary_cuisine = cuisines[0] if cuisines else 'Restaurant'
-        
-        # Get city (neighbourhood)
-        city = str(row.get('city', 'London')).strip()
-        if not city or city == 'nan':
-            city = 'London'
-        
-        # Get rating and reviews
-        rating = row.get('rating', 0)
-        reviews = row.get('reviews', 0)
-        
-        # Convert to numeric, handling NaN
-        try:
-            rating = float(rating) if pd.notna(rating) else 0
-            reviews = int(float(reviews)) if pd.notna(reviews) else 0
-        except:
-            rating = 0
-            reviews = 0
-        
-        # Calculate score for sorting (rating * reviews weight)
-        score = rating * (1 + reviews / 100)
-        
-        restaurant = {
-            'id': idx,
-            'name': str(row.get('name', 'Unknown')),
-            'cuisines': cuisines,
-            'primary_cuisine': primary_cuisine,
-            'city': city,
-            'rating': rating,
-            'reviews': reviews,
-            'score': score,
-            'address': str(row.get('full_address', '')) or str(row.get('street', '')),
-            'phone': str(row.get('phone', '')) or str(row.get('phone_1', '')),
-            'website': str(row.get('site', '')) if pd.notna(row.get('site')) else '',
-            'photo': str(row.get('photo', '')) if pd.notna(row.get('photo')) else '',
-            'latitude': row.get('latitude'),
-            'longitude': row.get('longitude'),
-            'julans_pick': False  # We'll mark some manually or based on criteria
-        }
-        
-        restaurants.append(restaurant)
-        
-        # Count cuisines
-        for cuisine in cuisines:
-            cuisine_slug = slugify(cuisine)
-            if cuisine_slug:
-                if cuisine_slug not in cuisines_count:
-                    cuisines_count[cuisine_slug] = {'name': cuisine, 'count': 0}
-                cuisines_count[cuisine_slug]['count'] += 1
-        
-        # Count neighbourhoods
-        city_slug = slugify(city)
-        if city_slug:
-            if city_slug not in neighbourhoods_count:
-                neighbourhoods_count[city_slug] = {'name': city, 'count': 0}
-            neighbourhoods_count[city_slug]['count'] += 1
-    
-    # Mark top restaurants as "Julan's Pick" (top 5% by score)
-    restaurants.sort(key=lambda x: x['score'], reverse=True)
-    top_count = max(1, len(restaurants) // 20)  # Top 5%
-    for i in range(min(top_count, 500)):  # Max 500 picks
-        restaurants[i]['julans_pick'] = True
-    
-    restaurants_data = restaurants
-    cuisines_dict = cuisines_count
-    neighbourhoods_dict = neighbourhoods_count
-    
-    print(f"Processed {len(restaurants)} restaurants")
-    print(f"Found {len(cuisines_dict)} unique cuisines")
-    print(f"Found {len(neighbourhoods_dict)} neighbourhoods")
+    return process_dataset([excel_path])
+
+def process_dataset(paths):
+    """Process exports into a Dataset, merging several and dropping duplicates (see ingest.py)"""
+    # Imported here so only processing an export loads pandas
+    from ingest import process_exports
+    store, cuisines, neighbourhoods, duplicates = process_exports(paths)
+    version, updated_at = _sources_version(paths) if len(paths) > 1 else _file_version(paths[0])
+    data = Dataset(store, cuisines, neighbourhoods, version, updated_at, duplicates=duplicates)
+    
+    print(f"Processed {len(data.restaurants)} restaurants")
+    if duplicates is not None:
+        print(f"Dropped {duplicates['dropped']} duplicate restaurants in {len(duplicates['groups'])} groups")
+    print(f"Found {len(data.cuisines)} unique cuisines")
+    print(f"Found {len(data.neighbourhoods)} neighbourhoods")
+    return data
+
+def install_dataset(data):
+    """Start serving data: one reference swap, then the script-facing globals"""
+    global dataset, restaurants_data, cuisines_dict, neighbourhoods_dict
+    global data_version, data_updated_at
+    dataset = data
+    restaurants_data = data.restaurants
+    cuisines_dict = data.cuisines
+    neighbourhoods_dict = data.neighbourhoods
+    # Drop indexes set by build_indexes, so __getattr__ serves the new data's
+    for name in _INDEX_NAMES:
+        globals().pop(name, None)
+    data_version = data.version
+    data_updated_at = data.updated_at
+    page_cache.set_version(data.version)
+    card_cache.set_version(data.version)
+
+def load_and_process_data(source_path=None, data_dir=None):
+    """Load restaurant data (see load_dataset) and serve it
+    
+    Data without a precomputed similar-restaurant index (JSON or Excel) gets
+    one before it is served, so no restaurant page has to build it.
+    """
+    data = load_dataset(source_path, data_dir)
+    data.warm(('similar',))
+    install_dataset(data)
+
+def current_data():
+    """The dataset this request started with, or the serving one outside a request"""
+    if has_request_context():
+        data = g.get('dataset')
+        if data is None:
+            data = g.dataset = dataset
+        return data
+    return dataset
+
+# Only one reload builds at a time
+_reload_lock = threading.Lock()
+
+def reload_data(data_dir=None):
+    """Load the processed data again off to the side and swap it in if it changed
+    
+    Every derived index is built before the swap, so requests never wait for
+    one. Returns True when a new dataset was installed.
+    """
+    with _reload_lock:
+        data = load_dataset(data_dir=data_dir)
+        if data.version == dataset.version:
+            print(f"Data unchanged (version {data.version})")
+            return False
+        if data.version == 'empty':
+            print("Reload found no data; still serving version", dataset.version)
+            return False
+        data.warm()
+        install_dataset(data)
+        print(f"Now serving data version {data.version} ({len(data.restaurants)} restaurants)")
+        return True
+
+# Rendered pages are cached per snapshot, up to PAGE_CACHE_MAX_BYTES of HTML
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# How long the Vercel edge (and other shared caches) may serve a page without asking us
+EDGE_CACHE_SECONDS = int(os.environ.get('EDGE_CACHE_SECONDS', 3600))
+
+page_cache = PageCache(PAGE_CACHE_MAX_BYTES)
+
+# Rendered restaurant cards are cached per snapshot too (see fragments.py)
+CARD_CACHE_MAX_BYTES = int(os.environ.get('CARD_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+card_cache = VersionedCache(CARD_CACHE_MAX_BYTES)
 
 # Load data on startup (with error handling for Vercel)
+_load_started = time.perf_counter()
 try:
     load_and_process_data()
 except Exception as e:
     print(f"Error loading data: {e}")
     import traceback
     traceback.print_exc()
-    # Set empty defaults to prevent app from crashing
-    if restaurants_data is None:
-        restaurants_data = []
-    if cuisines_dict is None:
-        cuisines_dict = {}
-    if neighbourhoods_dict is None:
-        neighbourhoods_dict = {}
+    # Serve an empty dataset rather than crash
+    if dataset is None:
+        install_dataset(Dataset.empty())
+startup['data_load'] = time.perf_counter() - _load_started
+
+# Background reloading, all off by default: poll the data files every
+# RELOAD_POLL_SECONDS, reload on RELOAD_SIGNAL (e.g. SIGHUP), or accept
+# POST /admin/reload with a bearer RELOAD_TOKEN
+RELOAD_POLL_SECONDS = float(os.environ.get('RELOAD_POLL_SECONDS', 0) or 0)
+RELOAD_SIGNAL = os.environ.get('RELOAD_SIGNAL', '')
+RELOAD_TOKEN = os.environ.get('RELOAD_TOKEN', '')
+
+reloader = Reloader(reload_data, [os.path.join(DATA_DIR, 'processed_data.bin'),
+                                  os.path.join(DATA_DIR, 'processed_data.json')], RELOAD_POLL_SECONDS)
+if RELOAD_POLL_SECONDS or RELOAD_SIGNAL or RELOAD_TOKEN:
+    reloader.start()
+if RELOAD_SIGNAL:
+    try:
+        signal.signal(getattr(signal, RELOAD_SIGNAL), lambda signum, frame: reloader.trigger())
+    except (AttributeError, ValueError) as e:
+        print(f"Cannot reload on {RELOAD_SIGNAL}: {e}")
+
+def get_catalog():
+    """Ranked lists and name lookups for the served data"""
+    return current_data().catalog
+
+@app.template_global()
+def restaurant_card(restaurant, schema=False):
+    """Card HTML of a restaurant, with its JSON-LD if schema is set, rendered once per snapshot"""
+    version = current_data().version
+    key = (restaurant.position, bool(schema))
+    html = card_cache.get(version, key)
+    if html is None:
+        template = app.jinja_env.get_template('_restaurant_card.html')
+        html = card_cache.put(version, key, Markup(template.render(restaurant=restaurant, schema=schema)))
+    return html
+
+app.add_template_global(page_links)
+
+# Set by freeze.py while pre-rendering static pages: they leave out the search
+# box, typeahead, near-me link and filter pills, which need the app behind them
+app.jinja_env.globals['static_site'] = False
 
 @app.context_processor
 def inject_globals():
     """Inject global variables into all templates"""
-    # Sort dictionaries by count for footer
-    cuisines = cuisines_dict or {}
-    neighbourhoods = neighbourhoods_dict or {}
-    
-    sorted_cuisines = []
-    sorted_neighbourhoods = []
-    
-    if cuisines:
-        sorted_cuisines = sorted(cuisines.items(), key=lambda x: x[1]['count'], reverse=True)[:10]
-    if neighbourhoods:
-        sorted_neighbourhoods = sorted(neighbourhoods.items(), key=lambda x: x[1]['count'], reverse=True)[:10]
-    
+    data = current_data()
     return {
-        'cuisines_dict': cuisines,
-        'neighbourhoods_dict': neighbourhoods,
-        'footer_cuisines': sorted_cuisines,
-        'footer_neighbourhoods': sorted_neighbourhoods
+        'cuisines_dict': data.cuisines,
+        'neighbourhoods_dict': data.neighbourhoods,
+        'footer_cuisines': data.catalog.cuisines.top(10),
+        'footer_neighbourhoods': data.catalog.neighbourhoods.top(10)
     }
 
-def get_restaurants_for_cuisine(cuisine_slug, page=1, per_page=12):
-    """Get restaurants filtered by cuisine"""
-    cuisine_name = None
-    for slug, data in cuisines_dict.items():
-        if slug == cuisine_slug:
-            cuisine_name = data['name']
-            break
+def _page_of(ids, page, per_page, key=None, filters=None):
+    """Resolve one page of a posting list into restaurant records
     
-    if not cuisine_name:
+    With filters (see facets.py), only restaurants passing them are paged;
+    key names the posting list so its facet counts and checkpoints can be cached.
+    """
+    data = current_data()
+    start = (page - 1) * per_page
+    if filters:
+        positions = data.facets.page(ids, filters, start, per_page, key)
+        return [data.restaurants[i] for i in positions], data.facets.count(key, ids, filters)
+    end = start + per_page
+    return [data.restaurants[i] for i in ids[start:end]], len(ids)
+
+def _cuisine_listing(cuisine_slug):
+    """Facet key and posting list of a cuisine page"""
+    return ('cuisine', cuisine_slug), current_data().cuisine_index.get(cuisine_slug, [])
+
+def _neighbourhood_listing(neighbourhood_slug, cuisine_slug=None):
+    """Facet key and posting list of a neighbourhood page, optionally narrowed to a cuisine"""
+    data = current_data()
+    # Unknown cuisine slugs fall back to the unfiltered neighbourhood listing
+    if cuisine_slug and cuisine_slug in data.cuisines:
+        key = ('pair', neighbourhood_slug, cuisine_slug)
+        return key, data.neighbourhood_cuisine_index.get((neighbourhood_slug, cuisine_slug), [])
+    return ('neighbourhood', neighbourhood_slug), data.neighbourhood_index.get(neighbourhood_slug, [])
+
+@instrument.timed('data')
+def get_restaurants_for_cuisine(cuisine_slug, page=1, per_page=12, filters=None):
+    """Get restaurants filtered by cuisine, and optionally rating, reviews and pick"""
+    if cuisine_slug not in current_data().cuisines:
         return [], 0
     
-    # Find restaurants with this cuisine
-    filtered = [r for r in restaurants_data if cuisine_name.lower() in [c.lower() for c in r['cuisines']]]
+    key, ids = _cuisine_listing(cuisine_slug)
+    return _page_of(ids, page, per_page, key, filters)
+
+@instrument.timed('data')
+def get_restaurants_for_neighbourhood(neighbourhood_slug, cuisine_slug=None, page=1, per_page=12, filters=None):
+    """Get restaurants filtered by neighbourhood and optionally cuisine, rating, reviews and pick"""
+    if neighbourhood_slug not in current_data().neighbourhoods:
+        return [], 0
     
-    # Sort by score
-    filtered.sort(key=lambda x: x['score'], reverse=True)
+    key, ids = _neighbourhood_listing(neighbourhood_slug, cuisine_slug)
+    return _page_of(ids, page, per_page, key, filters)
+
+def get_facets():
+    """Facet index over the served data"""
+    return current_data().facets
+
+@instrument.timed('facets')
+def get_neighbourhood_cuisines(neighbourhood_slug):
+    """Cuisines found in a neighbourhood as (slug, count), most common first"""
+    return current_data().neighbourhood_cuisines.get(neighbourhood_slug, [])
+
+@instrument.timed('facets')
+def facet_pills(base_url, key, ids, filters):
+    """Filter toggles for a listing, each with the number of restaurants it would leave"""
+    facets = get_facets()
+    options = ([('rating', step, f"{step:.1f}+ ★") for step in RATING_STEPS] +
+               [('reviews', step, f"{step}+ reviews") for step in REVIEW_STEPS] +
+               [('pick', True, "Julan's Picks")])
+    pills = []
+    for name, value, label in options:
+        active = filters.get(name) == value
+        toggled = dict(filters)
+        if active:
+            del toggled[name]
+        else:
+            toggled[name] = value
+        count = facets.count(key, ids, filters if active else toggled)
+        if count or active:
+            pills.append({'label': label, 'count': count, 'active': active,
+                          'url': base_url + filter_query(toggled)})
+    return pills
+
+@instrument.timed('data')
+def get_all_restaurants(page=1, per_page=12):
+    """Get all restaurants sorted by score"""
+    return _page_of(current_data().score_order, page, per_page)
+
+def encode_cursor(position):
+    """Keyset cursor for the restaurant at a position in restaurants_data"""
+    return f"{current_data().restaurants.score[position]!r}_{position}"
+
+def decode_cursor(cursor):
+    """Parse a keyset cursor into its (score, position) key, or None if malformed"""
+    try:
+        score, position = cursor.rsplit('_', 1)
+        score, position = float(score), int(position)
+    except (AttributeError, ValueError):
+        return None
+    # float() also takes nan and inf, which no restaurant scores and nan breaks the seek
+    return (score, position) if math.isfinite(score) else None
+
+def _seek(ids, key):
+    """Index of the first restaurant after a decoded cursor in a score-ordered posting list
     
-    total = len(filtered)
-    start = (page - 1) * per_page
-    end = start + per_page
+    Posting lists keep score_order's order (score descending, then position),
+    so the same binary search works for the homepage and every listing.
+    """
+    if key is None:
+        return 0
+    score, position = key
+    scores = current_data().restaurants.score
+    return bisect_right(ids, (-score, position), key=lambda i: (-scores[i], i))
+
+@instrument.timed('data')
+def get_restaurants_after(cursor, per_page=12):
+    """Get the restaurants following a cursor in score order
     
-    return filtered[start:end], total
+    Returns (restaurants, start, next_cursor). Seeking is a binary search over
+    score_order, so deep pages cost the same as the first one.
+    """
+    data = current_data()
+    start = _seek(data.score_order, decode_cursor(cursor))
+    ids = data.score_order[start:start + per_page]
+    next_cursor = encode_cursor(ids[-1]) if start + per_page < len(data.score_order) else None
+    return [data.restaurants[i] for i in ids], start, next_cursor
 
-def get_restaurants_for_neighbourhood(neighbourhood_slug, cuisine_slug=None, page=1, per_page=12):
-    """Get restaurants filtered by neighbourhood and optionally cuisine"""
-    neighbourhood_name = None
-    for slug, data in neighbourhoods_dict.items():
-        if slug == neighbourhood_slug:
-            neighbourhood_name = data['name']
-            break
+# Page sizes of the listing API, and rows per chunk of the bulk export
+API_DEFAULT_LIMIT = 50
+API_MAX_LIMIT = 500
+EXPORT_CHUNK_ROWS = 500
+
+def parse_api_query(args):
+    """Read fields, limit and after (a cursor) from listing API query args
     
-    if not neighbourhood_name:
-        return [], 0
+    Returns (fields, limit, cursor key); fields defaults to every record
+    field. Raises ValueError with a message suitable for the user on bad input.
+    """
+    fields = RECORD_FIELDS
+    if args.get('fields'):
+        fields = tuple(dict.fromkeys(f.strip() for f in args['fields'].split(',') if f.strip()))
+        unknown = [f for f in fields if f not in RECORD_FIELDS]
+        if unknown or not fields:
+            raise ValueError(f"fields must be a comma-separated list of {', '.join(RECORD_FIELDS)}"
+                             + (f"; unknown: {', '.join(unknown)}" if unknown else ''))
+    try:
+        limit = int(args.get('limit', API_DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be a whole number")
+    key = None
+    if args.get('after'):
+        key = decode_cursor(args['after'])
+        if key is None:
+            raise ValueError("after must be a next_cursor from a previous response")
+    return fields, max(1, min(limit, API_MAX_LIMIT)), key
+
+def project(restaurant, fields):
+    """A restaurant as a dict of just the requested record fields"""
+    return {field: getattr(restaurant, field) for field in fields}
+
+@instrument.timed('data')
+def get_listing_after(key, ids, cursor_key, limit, filters=None):
+    """One page of a listing for the API, seeking past a decoded cursor
     
-    # Find restaurants in this neighbourhood
-    filtered = [r for r in restaurants_data if slugify(r['city']) == neighbourhood_slug]
+    Returns (restaurants, total, next_cursor); total counts the whole
+    filtered listing and next_cursor is None on the last page.
+    """
+    data = current_data()
+    start = _seek(ids, cursor_key)
+    if filters:
+        positions = list(islice(data.facets.iter_matches(ids, filters, start), limit + 1))
+    else:
+        positions = ids[start:start + limit + 1]
+    next_cursor = encode_cursor(positions[limit - 1]) if len(positions) > limit else None
+    restaurants = [data.restaurants[i] for i in positions[:limit]]
+    return restaurants, data.facets.count(key, ids, filters), next_cursor
+
+# Limits of nearby queries
+NEAR_MAX_RADIUS_KM = 25
+NEAR_MAX_RESULTS = 100
+
+def get_spatial_index():
+    """Grid index over restaurant coordinates of the served data, built on first use"""
+    return current_data().spatial
+
+def parse_near_query(args):
+    """Read lat, lon, optional radius (km) and limit from query args
     
-    # Filter by cuisine if provided
-    if cuisine_slug:
-        cuisine_name = None
-        for slug, data in cuisines_dict.items():
-            if slug == cuisine_slug:
-                cuisine_name = data['name']
-                break
-        if cuisine_name:
-            filtered = [r for r in filtered if cuisine_name.lower() in [c.lower() for c in r['cuisines']]]
+    Raises ValueError with a message suitable for the user on bad input.
+    """
+    try:
+        lat = float(args['lat'])
+        lon = float(args['lon'])
+    except (KeyError, ValueError):
+        raise ValueError("lat and lon are required and must be numbers")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("lat/lon out of range")
     
-    # Sort by score
-    filtered.sort(key=lambda x: x['score'], reverse=True)
+    radius = args.get('radius')
+    if radius is not None:
+        try:
+            radius = float(radius)
+        except ValueError:
+            raise ValueError("radius must be a number of kilometres")
+        if not 0 < radius <= NEAR_MAX_RADIUS_KM:
+            raise ValueError(f"radius must be between 0 and {NEAR_MAX_RADIUS_KM} km")
     
-    total = len(filtered)
-    start = (page - 1) * per_page
-    end = start + per_page
+    try:
+        limit = int(args.get('limit', 12))
+    except ValueError:
+        raise ValueError("limit must be a whole number")
+    return lat, lon, radius, max(1, min(limit, NEAR_MAX_RESULTS))
+
+@instrument.timed('spatial')
+def get_restaurants_near(lat, lon, radius_km=None, limit=12):
+    """Restaurants near a point, as (restaurant, distance_km) pairs
     
-    return filtered[start:end], total
+    With a radius, the best-scored restaurants within it; without one, the
+    closest restaurants (up to NEAR_MAX_RADIUS_KM away), nearest first.
+    """
+    data = current_data()
+    if radius_km is None:
+        hits = data.spatial.nearest(lat, lon, limit, max_km=NEAR_MAX_RADIUS_KM)
+    else:
+        hits = data.spatial.within(lat, lon, radius_km, limit)
+    return [(data.restaurants[position], distance) for position, distance in hits]
 
-def get_all_restaurants(page=1, per_page=12):
-    """Get all restaurants sorted by score"""
-    filtered = restaurants_data.copy()
-    filtered.sort(key=lambda x: x['score'], reverse=True)
+@instrument.timed('data')
+def get_restaurant(restaurant_id):
+    """The restaurant with an id, or None"""
+    data = current_data()
+    position = data.position_of(restaurant_id)
+    return None if position is None else data.restaurants[position]
+
+@instrument.timed('data')
+def get_similar_restaurants(restaurant, limit=None):
+    """Restaurants to recommend alongside one, most similar first, as (restaurant, distance_km) pairs
     
-    total = len(filtered)
-    start = (page - 1) * per_page
-    end = start + per_page
+    The recommendations are precomputed (see similar.py), so this is a slice
+    of one row of the index.
+    """
+    data = current_data()
+    results = []
+    for position in data.similar.get(restaurant.position, limit):
+        other = data.restaurants[position]
+        results.append((other, haversine_km(restaurant.latitude, restaurant.longitude,
+                                            other.latitude, other.longitude)))
+    return results
+
+# Search results shown per page, and how deep search results go
+SEARCH_PER_PAGE = 12
+SEARCH_MAX_RESULTS = 120
+SUGGEST_MAX_RESULTS = 20
+# Restaurants examined per keystroke; typeahead trades depth for latency
+SUGGEST_BUDGET = 300
+
+def get_search_index():
+    """Search index for the served data, built here if the snapshot had none"""
+    return current_data().search
+
+def get_label_indexes():
+    """Typeahead over cuisine and neighbourhood names"""
+    return current_data().labels
+
+def uncached():
+    """Mark the page being rendered as not worth caching (an unknown slug or a page past the end)"""
+    g.uncached_page = True
+
+def _listing_query(args):
+    """Cache key part of a filterable listing: its filters in canonical form"""
+    return filter_query(parse_filters(args))
+
+def _homepage_query(args):
+    """Cache key part of the homepage: where its ?after= cursor lands in score order"""
+    after = args.get('after')
+    return str(_seek(current_data().score_order, decode_cursor(after))) if after else ''
+
+def cached_page(view=None, query=None):
+    """Serve a page view from the page cache, with ETag/304 and edge caching headers
+    
+    Pages are keyed by path (route, slug and page number) plus query(request.args),
+    the normalised query parameters the view reads; views that read none key on
+    the path alone. A query of None, or a view calling uncached(), serves the page
+    without storing it, so arbitrary query strings and unknown slugs can't evict
+    the real pages. Cached pages only change when a new data snapshot is loaded.
+    """
+    if view is None:
+        return lambda view: cached_page(view, query)
     
-    return filtered[start:end], total
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        data = current_data()
+        version = data.version
+        key = (request.path, query(request.args) if query else '')
+        if key[1] is None:
+            key = None
+        page = page_cache.get(version, key) if key else None
+        instrument.note('cache', 'miss' if page is None else 'hit')
+        if page is None:
+            g.uncached_page = key is None
+            html = view(*args, **kwargs)
+            if not isinstance(html, str):
+                return html
+            body = html.encode('utf-8')
+            page = CachedPage(body, version) if g.uncached_page else page_cache.put(version, key, body)
+        
+        response = Response(page.body, mimetype='text/html')
+        response.set_etag(page.etag)
+        response.last_modified = data.updated_at
+        # Browsers revalidate every time; the edge may reuse the page for EDGE_CACHE_SECONDS
+        response.headers['Cache-Control'] = (
+            f'public, max-age=0, s-maxage={EDGE_CACHE_SECONDS}, '
+            f'stale-while-revalidate={EDGE_CACHE_SECONDS}')
+        return response.make_conditional(request)
+    return wrapper
 
 @app.route('/')
+@cached_page(query=_homepage_query)
 def homepage():
     """Homepage route"""
-    # Get top restaurants for homepage
-    top_restaurants, total = get_all_restaurants(page=1, per_page=12)
-    
-    # Get top cuisines for filter pills
-    top_cuisines = sorted(cuisines_dict.items(), key=lambda x: x[1]['count'], reverse=True)[:20]
+    # Get top restaurants for homepage, or the ones following ?after=<cursor>
+    current_page = 1
+    after = request.args.get('after')
+    if after:
+        top_restaurants, start, _ = get_restaurants_after(after, per_page=12)
+        current_page = start // 12 + 1
+        if not top_restaurants:
+            uncached()
+    else:
+        top_restaurants, total = get_all_restaurants(page=1, per_page=12)
     
-    # Get top neighbourhoods
-    top_neighbourhoods = sorted(neighbourhoods_dict.items(), key=lambda x: x[1]['count'], reverse=True)[:12]
+    # Top cuisines for filter pills and top neighbourhoods
+    catalog = get_catalog()
+    top_cuisines = catalog.cuisines.top(20)
+    top_neighbourhoods = catalog.neighbourhoods.top(12)
     
     return render_template('index.html',
                          restaurants=top_restaurants,
-                         total_restaurants=len(restaurants_data),
+                         total_restaurants=len(current_data().restaurants),
                          cuisines=top_cuisines,
                          neighbourhoods=top_neighbourhoods,
-                         current_page=1,
-                         total_pages=(len(restaurants_data) + 11) // 12)
+                         current_page=current_page,
+                         total_pages=(len(current_data().restaurants) + 11) // 12)
 
 @app.route('/page/<int:page>')
+@cached_page
 def homepage_paginated(page):
     """Paginated homepage"""
     restaurants, total = get_all_restaurants(page=page, per_page=12)
+    if not 1 <= page <= max(1, (total + 11) // 12):
+        uncached()
     
-    top_cuisines = sorted(cuisines_dict.items(), key=lambda x: x[1]['count'], reverse=True)[:20]
-    top_neighbourhoods = sorted(neighbourhoods_dict.items(), key=lambda x: x[1]['count'], reverse=True)[:12]
+    catalog = get_catalog()
+    top_cuisines = catalog.cuisines.top(20)
+    top_neighbourhoods = catalog.neighbourhoods.top(12)
     
     return render_template('index.html',
                          restaurants=restaurants,
@@ -357,26 +730,29 @@ def homepage_paginated(page):
 
 @app.route('/cuisine/<slug>')
 @app.route('/cuisine/<slug>/page/<int:page>')
+@cached_page(query=_listing_query)
 def cuisine_page(slug, page=1):
-    """Cuisine page route"""
-    restaurants, total = get_restaurants_for_cuisine(slug, page=page, per_page=12)
+    """Cuisine page route, filterable by ?rating=, ?reviews= and ?pick=1"""
+    filters = parse_filters(request.args)
+    restaurants, total = get_restaurants_for_cuisine(slug, page=page, per_page=12, filters=filters)
     
-    # Get cuisine name
-    cuisine_name = 'Restaurant'
-    for s, data in cuisines_dict.items():
-        if s == slug:
-            cuisine_name = data['name']
-            break
+    catalog = get_catalog()
+    cuisine_name = catalog.cuisines.name(slug, 'Restaurant')
+    if slug not in catalog.cuisines or not 1 <= page <= max(1, (total + 11) // 12):
+        uncached()
     
-    # Get all cuisines for filter
-    all_cuisines = sorted(cuisines_dict.items(), key=lambda x: x[1]['count'], reverse=True)
+    pills = []
+    if slug in catalog.cuisines:
+        pills = facet_pills(f'/cuisine/{slug}', *_cuisine_listing(slug), filters)
     
     return render_template('cuisine.html',
                          cuisine_name=cuisine_name,
                          cuisine_slug=slug,
                          restaurants=restaurants,
                          total_restaurants=total,
-                         all_cuisines=all_cuisines,
+                         all_cuisines=catalog.cuisines.ranked,
+                         facet_pills=pills,
+                         filter_query=filter_query(filters),
                          current_page=page,
                          total_pages=(total + 11) // 12)
 
@@ -384,40 +760,32 @@ def cuisine_page(slug, page=1):
 @app.route('/neighbourhood/<slug>/page/<int:page>')
 @app.route('/neighbourhood/<slug>/cuisine/<cuisine_slug>')
 @app.route('/neighbourhood/<slug>/cuisine/<cuisine_slug>/page/<int:page>')
+@cached_page(query=_listing_query)
 def neighbourhood_page(slug, page=1, cuisine_slug=None):
-    """Neighbourhood page route"""
-    restaurants, total = get_restaurants_for_neighbourhood(slug, cuisine_slug=cuisine_slug, page=page, per_page=12)
+    """Neighbourhood page route, filterable by ?rating=, ?reviews= and ?pick=1"""
+    filters = parse_filters(request.args)
+    restaurants, total = get_restaurants_for_neighbourhood(slug, cuisine_slug=cuisine_slug, page=page,
+                                                           per_page=12, filters=filters)
     
-    # Get neighbourhood name
-    neighbourhood_name = 'London'
-    for s, data in neighbourhoods_dict.items():
-        if s == slug:
-            neighbourhood_name = data['name']
-            break
+    catalog = get_catalog()
+    neighbourhood_name = catalog.neighbourhoods.name(slug, 'London')
+    if (slug not in catalog.neighbourhoods or (cuisine_slug and cuisine_slug not in catalog.cuisines)
+            or not 1 <= page <= max(1, (total + 11) // 12)):
+        uncached()
     
     # Get top cuisines for this neighbourhood
-    cuisine_counts = {}
-    for r in restaurants_data:
-        if slugify(r['city']) == slug:
-            for cuisine in r['cuisines']:
-                cuisine_slug_local = slugify(cuisine)
-                if cuisine_slug_local:
-                    if cuisine_slug_local not in cuisine_counts:
-                        cuisine_counts[cuisine_slug_local] = {'name': cuisine, 'count': 0}
-                    cuisine_counts[cuisine_slug_local]['count'] += 1
-    
-    top_cuisines = sorted(cuisine_counts.items(), key=lambda x: x[1]['count'], reverse=True)[:20]
-    
-    # Get all cuisines
-    all_cuisines = sorted(cuisines_dict.items(), key=lambda x: x[1]['count'], reverse=True)
+    top_cuisines = [(c_slug, {'name': catalog.cuisines.name(c_slug, c_slug), 'count': count})
+                    for c_slug, count in get_neighbourhood_cuisines(slug)[:20]]
     
     # Get active cuisine name if filtering
-    active_cuisine_name = None
-    if cuisine_slug:
-        for s, data in cuisines_dict.items():
-            if s == cuisine_slug:
-                active_cuisine_name = data['name']
-                break
+    active_cuisine_name = catalog.cuisines.name(cuisine_slug) if cuisine_slug else None
+    
+    pills = []
+    if slug in catalog.neighbourhoods:
+        base_url = f'/neighbourhood/{slug}'
+        if cuisine_slug and cuisine_slug in catalog.cuisines:
+            base_url += f'/cuisine/{cuisine_slug}'
+        pills = facet_pills(base_url, *_neighbourhood_listing(slug, cuisine_slug), filters)
     
     return render_template('neighbourhood.html',
                          neighbourhood_name=neighbourhood_name,
@@ -425,113 +793,306 @@ def neighbourhood_page(slug, page=1, cuisine_slug=None):
                          restaurants=restaurants,
                          total_restaurants=total,
                          cuisines=top_cuisines,
-                         all_cuisines=all_cuisines,
+                         facet_pills=pills,
+                         filter_query=filter_query(filters),
+                         all_cuisines=catalog.cuisines.ranked,
                          active_cuisine_slug=cuisine_slug,
                          active_cuisine_name=active_cuisine_name,
                          current_page=page,
                          total_pages=(total + 11) // 12)
 
 @app.route('/neighbourhoods')
+@cached_page
 def all_neighbourhoods():
     """All neighbourhoods page"""
-    all_neighbourhoods_list = sorted(neighbourhoods_dict.items(), key=lambda x: x[1]['count'], reverse=True)
-    return render_template('neighbourhoods.html', neighbourhoods=all_neighbourhoods_list)
+    return render_template('neighbourhoods.html', neighbourhoods=get_catalog().neighbourhoods.ranked)
 
 @app.route('/cuisines')
+@cached_page
 def all_cuisines():
     """All cuisines page"""
-    all_cuisines_list = sorted(cuisines_dict.items(), key=lambda x: x[1]['count'], reverse=True)
-    return render_template('cuisines.html', cuisines=all_cuisines_list)
+    return render_template('cuisines.html', cuisines=get_catalog().cuisines.ranked)
 
 @app.route('/about')
+@cached_page
 def about():
     """About page"""
     return render_template('about.html')
 
-@app.route('/sitemap.xml')
-def sitemap():
-    """Generate sitemap.xml dynamically"""
-    base_url = 'https://www.londonfoodfindsuk.co.uk'
-    urls = []
-    
-    # Static pages
-    urls.append({
-        'loc': f'{base_url}/',
-        'changefreq': 'daily',
-        'priority': '1.0'
-    })
+@app.route('/restaurant/<int:restaurant_id>')
+@cached_page
+def restaurant_page(restaurant_id):
+    """A restaurant's page, with a strip of similar restaurants nearby"""
+    restaurant = get_restaurant(restaurant_id)
+    if restaurant is None:
+        return Response('Restaurant not found', status=404, mimetype='text/plain')
     
-    urls.append({
-        'loc': f'{base_url}/about',
-        'changefreq': 'monthly',
-        'priority': '0.7'
-    })
+    data = current_data()
+    neighbourhood_slug = slugify(restaurant.city)
+    cuisines = [(slugify(name), name) for name in restaurant.cuisines]
+    return render_template('restaurant.html',
+                         restaurant=restaurant,
+                         neighbourhood_slug=neighbourhood_slug if neighbourhood_slug in data.neighbourhoods else None,
+                         cuisines=[(slug if slug in data.cuisines else None, name) for slug, name in cuisines],
+                         similar=get_similar_restaurants(restaurant))
+
+@app.route('/near')
+def near_page():
+    """Restaurants near the visitor's location (?lat=&lon=[&radius=])"""
+    lat = lon = radius = error = None
+    results = []
+    if 'lat' in request.args or 'lon' in request.args:
+        try:
+            lat, lon, radius, limit = parse_near_query(request.args)
+        except ValueError as e:
+            error = str(e)
+        else:
+            results = get_restaurants_near(lat, lon, radius, limit)
+    return render_template('near.html', results=results, error=error, lat=lat, lon=lon, radius=radius)
+
+@app.route('/api/near')
+def api_near():
+    """JSON: top restaurants within ?radius= km of ?lat=&lon=, or the nearest ones"""
+    try:
+        lat, lon, radius, limit = parse_near_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    restaurants = []
+    for restaurant, distance in get_restaurants_near(lat, lon, radius, limit):
+        item = restaurant.to_dict()
+        item['distance_km'] = round(distance, 3)
+        restaurants.append(item)
+    return jsonify({'lat': lat, 'lon': lon, 'radius_km': radius, 'count': len(restaurants),
+                    'restaurants': restaurants})
+
+@app.route('/search')
+@cached_page(query=lambda args: None)
+def search_page():
+    """Search results for ?q=, ranked by text relevance and review score"""
+    query = request.args.get('q', '').strip()
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        page = 1
+    
+    hits = get_search_index().search(query, limit=SEARCH_MAX_RESULTS) if query else []
+    start = (page - 1) * SEARCH_PER_PAGE
+    restaurants = [current_data().restaurants[position] for position, _ in hits[start:start + SEARCH_PER_PAGE]]
+    cuisine_labels, neighbourhood_labels = get_label_indexes()
     
-    urls.append({
-        'loc': f'{base_url}/cuisines',
-        'changefreq': 'weekly',
-        'priority': '0.8'
+    return render_template('search.html',
+                         query=query,
+                         restaurants=restaurants,
+                         total_results=len(hits),
+                         max_results=SEARCH_MAX_RESULTS,
+                         cuisines=cuisine_labels.match(query, 10),
+                         neighbourhoods=neighbourhood_labels.match(query, 10),
+                         current_page=page,
+                         total_pages=(len(hits) + SEARCH_PER_PAGE - 1) // SEARCH_PER_PAGE)
+
+@app.route('/api/suggest')
+def api_suggest():
+    """JSON typeahead for ?q=: matching restaurants, cuisines and neighbourhoods"""
+    query = request.args.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.args.get('limit', 8)), SUGGEST_MAX_RESULTS))
+    except ValueError:
+        return jsonify({'error': "limit must be a whole number"}), 400
+    
+    restaurants = []
+    if query:
+        data = current_data()
+        for position, _ in data.search.search(query, limit=limit, budget=SUGGEST_BUDGET):
+            r = data.restaurants[position]
+            restaurants.append({'id': r.id, 'name': r.name, 'city': r.city,
+                                'primary_cuisine': r.primary_cuisine, 'rating': r.rating})
+    cuisine_labels, neighbourhood_labels = get_label_indexes()
+    response = jsonify({
+        'query': query,
+        'restaurants': restaurants,
+        'cuisines': [{'slug': slug, 'name': name, 'url': f'/cuisine/{slug}'}
+                     for slug, name in cuisine_labels.match(query)],
+        'neighbourhoods': [{'slug': slug, 'name': name, 'url': f'/neighbourhood/{slug}'}
+                           for slug, name in neighbourhood_labels.match(query)],
     })
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response
+
+def _listing_response(key, ids):
+    """JSON page of a listing for the current request's fields, limit, cursor and filters"""
+    try:
+        fields, limit, cursor_key = parse_api_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    urls.append({
-        'loc': f'{base_url}/neighbourhoods',
-        'changefreq': 'weekly',
-        'priority': '0.8'
+    filters = parse_filters(request.args)
+    restaurants, total, next_cursor = get_listing_after(key, ids, cursor_key, limit, filters)
+    next_url = None
+    if next_cursor:
+        args = request.args.to_dict()
+        args['after'] = next_cursor
+        next_url = f'{request.path}?{urlencode(args)}'
+    response = jsonify({
+        'count': total,
+        'restaurants': [project(r, fields) for r in restaurants],
+        'next_cursor': next_cursor,
+        'next': next_url,
     })
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response
+
+@app.route('/api/restaurants')
+def api_restaurants():
+    """JSON: all restaurants by score, ?limit= at a time from cursor ?after=, with ?fields="""
+    return _listing_response(('all',), current_data().score_order)
+
+@app.route('/api/cuisine/<slug>')
+def api_cuisine(slug):
+    """JSON: restaurants of a cuisine, paged and projected like /api/restaurants"""
+    if slug not in current_data().cuisines:
+        return jsonify({'error': f"unknown cuisine {slug!r}"}), 404
+    return _listing_response(*_cuisine_listing(slug))
+
+@app.route('/api/neighbourhood/<slug>')
+@app.route('/api/neighbourhood/<slug>/cuisine/<cuisine_slug>')
+def api_neighbourhood(slug, cuisine_slug=None):
+    """JSON: restaurants of a neighbourhood, optionally of one cuisine, paged like /api/restaurants"""
+    data = current_data()
+    if slug not in data.neighbourhoods:
+        return jsonify({'error': f"unknown neighbourhood {slug!r}"}), 404
+    if cuisine_slug is not None and cuisine_slug not in data.cuisines:
+        return jsonify({'error': f"unknown cuisine {cuisine_slug!r}"}), 404
+    return _listing_response(*_neighbourhood_listing(slug, cuisine_slug))
+
+@app.route('/api/restaurants/<int:restaurant_id>/similar')
+def api_similar(restaurant_id):
+    """JSON: restaurants similar to one, most similar first, with ?fields= and ?limit="""
+    try:
+        fields, limit, _ = parse_api_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    restaurant = get_restaurant(restaurant_id)
+    if restaurant is None:
+        return jsonify({'error': f"unknown restaurant {restaurant_id}"}), 404
     
-    # All neighbourhood pages
-    if neighbourhoods_dict:
-        for slug, data in sorted(neighbourhoods_dict.items()):
-            urls.append({
-                'loc': f'{base_url}/neighbourhood/{slug}',
-                'changefreq': 'weekly',
-                'priority': '0.8'
-            })
-    
-    # All cuisine pages
-    if cuisines_dict:
-        for slug, data in sorted(cuisines_dict.items()):
-            urls.append({
-                'loc': f'{base_url}/cuisine/{slug}',
-                'changefreq': 'weekly',
-                'priority': '0.8'
-            })
-    
-    # Neighbourhood + cuisine combination pages
-    if neighbourhoods_dict and cuisines_dict:
-        for n_slug, n_data in sorted(neighbourhoods_dict.items()):
-            # Get cuisines available in this neighbourhood
-            neighbourhood_cuisines = {}
-            for restaurant in restaurants_data:
-                if slugify(restaurant['city']) == n_slug:
-                    for cuisine in restaurant['cuisines']:
-                        cuisine_slug = slugify(cuisine)
-                        if cuisine_slug and cuisine_slug in cuisines_dict:
-                            if cuisine_slug not in neighbourhood_cuisines:
-                                neighbourhood_cuisines[cuisine_slug] = True
-            
-            # Add URLs for each cuisine in this neighbourhood
-            for c_slug in sorted(neighbourhood_cuisines.keys()):
-                urls.append({
-                    'loc': f'{base_url}/neighbourhood/{n_slug}/cuisine/{c_slug}',
-                    'changefreq': 'weekly',
-                    'priority': '0.7'
-                })
-    
-    # Generate XML
-    xml = '<?xml version="1.0" encoding="UTF-8"?>\n'
-    xml += '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
-    
-    for url_data in urls:
-        xml += '    <url>\n'
-        xml += f'        <loc>{url_data["loc"]}</loc>\n'
-        xml += f'        <changefreq>{url_data["changefreq"]}</changefreq>\n'
-        xml += f'        <priority>{url_data["priority"]}</priority>\n'
-        xml += '    </url>\n'
-    
-    xml += '</urlset>'
-    
-    return Response(xml, mimetype='application/xml')
+    restaurants = []
+    for other, distance in get_similar_restaurants(restaurant, limit):
+        item = project(other, fields)
+        item['distance_km'] = round(distance, 3)
+        restaurants.append(item)
+    response = jsonify({'id': restaurant_id, 'count': len(restaurants), 'restaurants': restaurants})
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response
+
+@app.route('/api/export.ndjson')
+def api_export():
+    """Every restaurant by score as newline-delimited JSON, streamed with ?fields= and filters"""
+    try:
+        fields = parse_api_query(request.args)[0]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Pin the dataset now: the body is generated after this view returns,
+    # and a reload mid-export must not mix rows from two snapshots.
+    data = current_data()
+    filters = parse_filters(request.args)
+    
+    def generate():
+        restaurants = data.restaurants
+        lines = []
+        for position in data.facets.iter_matches(data.score_order, filters):
+            lines.append(json.dumps(project(restaurants[position], fields),
+                                    ensure_ascii=False, separators=(',', ':')))
+            if len(lines) == EXPORT_CHUNK_ROWS:
+                lines.append('')
+                yield '\n'.join(lines)
+                lines = []
+        if lines:
+            lines.append('')
+            yield '\n'.join(lines)
+    
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename="restaurants-{data.version}.ndjson"'
+    response.headers['X-Total-Count'] = str(data.facets.count(('all',), data.score_order, filters))
+    return response
+
+def get_sitemap():
+    """Sitemap URLs for the served data, built on first use"""
+    return current_data().sitemap
+
+def _sitemap_response(sitemap, body, name):
+    """Streamed XML response with validators so crawlers can revalidate cheaply"""
+    response = Response(body, mimetype='application/xml')
+    response.set_etag(f'{sitemap.version}-{name}')
+    response.last_modified = sitemap.updated_at
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response.make_conditional(request)
+
+@app.route('/sitemap.xml')
+def sitemap():
+    """Sitemap index pointing at the sitemap shards"""
+    current = get_sitemap()
+    return _sitemap_response(current, current.iter_index(), 'index')
+
+@app.route('/sitemap-<int:n>.xml')
+def sitemap_shard(n):
+    """One shard of the sitemap, at most MAX_URLS_PER_SHARD URLs"""
+    current = get_sitemap()
+    if not 1 <= n <= current.shard_count:
+        return Response('Sitemap not found', status=404, mimetype='text/plain')
+    return _sitemap_response(current, current.iter_shard(n), f'shard-{n}')
+
+# Opt-in timing, metrics and slow-request profiling (see instrument.py)
+if instrument.ENABLED or instrument.profiler is not None:
+    app.before_request(instrument.start_request)
+    app.after_request(instrument.finish_request)
+    app.teardown_request(instrument.abandon_request)
+
+if instrument.ENABLED:
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus metrics for this process"""
+        lookups = page_cache.hits + page_cache.misses
+        body = instrument.metrics.render([
+            ('page_cache_hits_total', 'Pages served from the page cache.', page_cache.hits),
+            ('page_cache_misses_total', 'Pages rendered because they were not cached.', page_cache.misses),
+            ('page_cache_hit_ratio', 'Share of page lookups served from the cache.',
+             f'{page_cache.hits / lookups:.4f}' if lookups else 0),
+            ('page_cache_bytes', 'Size of the cached page bodies.', page_cache.size),
+            ('page_cache_entries', 'Pages in the page cache.', len(page_cache)),
+            ('card_cache_hits_total', 'Restaurant cards served from the card cache.', card_cache.hits),
+            ('card_cache_misses_total', 'Restaurant cards rendered because they were not cached.',
+             card_cache.misses),
+            ('card_cache_bytes', 'Size of the cached restaurant cards.', card_cache.size),
+            ('restaurants_loaded', 'Restaurants in the served snapshot.', len(dataset.restaurants)),
+            ('startup_imports_seconds', 'Seconds spent importing modules at startup.',
+             f"{startup['imports']:.6f}"),
+            ('startup_data_load_seconds', 'Seconds spent loading data at startup.',
+             f"{startup['data_load']:.6f}"),
+            ('startup_seconds', 'Seconds from the start of the app import to serving.',
+             f"{startup['total']:.6f}"),
+        ])
+        return Response(body, mimetype='text/plain; version=0.0.4')
+
+if RELOAD_TOKEN:
+    @app.route('/admin/reload', methods=['POST'])
+    def admin_reload():
+        """Reload the data in the background; needs Authorization: Bearer RELOAD_TOKEN"""
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied.encode('utf-8'), RELOAD_TOKEN.encode('utf-8')):
+            return jsonify({'error': 'forbidden'}), 403
+        reloader.trigger()
+        return jsonify({'status': 'reloading', 'version': dataset.version}), 202
+
+startup['total'] = time.perf_counter() - _started
+print(f"Started in {startup['total'] * 1000:.0f}ms (imports {startup['imports'] * 1000:.0f}ms, "
+      f"data load {startup['data_load'] * 1000:.0f}ms"
+      f"{', pandas imported' if 'pandas' in sys.modules else ''})")
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
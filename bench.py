@@ -0,0 +1,738 @@
+"""
+Benchmarks on synthetic restaurant data
+Generates exports in the same schema as the real one (deterministic for a
+given size and seed), then measures ingest, snapshot and JSON load times,
+peak memory, and per-route latency and throughput through the Flask test
+client (rendered without any cache, with cached restaurant cards, and from
+the page cache). Each stage runs in a fresh interpreter so its peak memory
+is its own.
+The opt-in workers stage starts several app processes over the same data at
+once and reports each one's private and proportional memory (Linux only), and
+the startup stage breaks down a cold start: module imports, the data load and
+the first request to each route. The shards stage times ingesting an export
+split into several files across worker processes.
+Results are written as JSON so runs on different commits can be compared:
+
+    python bench.py --sizes 10000,100000 --out before.json
+    python bench.py --sizes 10000,100000 --out after.json
+    python bench.py --compare before.json after.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import accumulate
+from multiprocessing import get_context
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+SEED = 42
+DATA_DIR = 'bench-data'
+RESULTS_DIR = 'bench-results'
+EXPORT_FORMATS = ('xlsx', 'csv', 'parquet')
+
+# Requests timed per route, after one untimed request
+REQUESTS_PER_ROUTE = 200
+
+# Worker process counts the workers stage measures, and how those workers load
+# the data: 'snapshot' maps processed_data.bin, 'shared' is SHARED_DATA=1 over
+# processed_data.json, 'json' gives every worker its own parsed copy
+WORKER_COUNTS = (1, 2, 4)
+WORKER_MODES = ('snapshot', 'shared', 'json')
+
+# The shards stage splits each export into SHARD_COUNT regional files and
+# ingests them with each number of worker processes in SHARD_WORKERS
+SHARD_COUNT = 4
+SHARD_WORKERS = (1, 2, 4)
+
+# Relative change in a metric that --compare reports as a regression
+REGRESSION_THRESHOLD = 0.10
+
+# Vocabulary of the generated exports. Earlier entries are more common
+# (Zipf-like), as cuisines and neighbourhoods are in the real export.
+SUBTYPES = [
+    'Restaurant', 'Cafe', 'Indian restaurant', 'Italian restaurant', 'Pizza takeaway',
+    'Coffee shop', 'Bar', 'Chinese restaurant', 'Fast food restaurant', 'Pub',
+    'Thai restaurant', 'Modern British restaurant', 'Café', 'Fish & chips takeaway',
+    'Japanese restaurant', 'Turkish restaurant', 'Sushi restaurant', 'Vegan restaurant',
+    'Mediterranean restaurant', 'Bakery', 'Lebanese restaurant', 'Greek restaurant',
+    'Vietnamese restaurant', 'Mexican restaurant', 'Korean restaurant', 'French restaurant',
+    'Spanish restaurant', 'Gastropub', 'Grill', 'Brunch restaurant', 'Burger restaurant',
+    'Steak house', 'Seafood restaurant', 'Caribbean restaurant', 'Nepalese restaurant',
+    'Persian restaurant', 'Ethiopian restaurant', 'Peruvian restaurant', 'Sri Lankan restaurant',
+    'Malaysian restaurant', 'Polish restaurant', 'Dessert shop', 'Ramen restaurant',
+]
+NEIGHBOURHOODS = [
+    'London', 'Camden', 'Soho', 'Hackney', 'Islington', 'Brixton', 'Shoreditch', 'Croydon',
+    'Richmond', 'Wembley', "King's Cross", 'Notting Hill', 'Stratford', 'Clapham', 'Peckham',
+    'Greenwich', 'Hammersmith', 'Fulham', 'Chelsea', 'Kensington', 'Marylebone', 'Mayfair',
+    'Covent Garden', 'Dalston', 'Bermondsey', 'Walthamstow', 'Ealing', 'Chiswick', 'Battersea',
+    'Wimbledon', 'Putney', 'Tooting', 'Balham', 'Stoke Newington', 'Kentish Town', 'Hampstead',
+    'Highgate', 'Finsbury Park', 'Bethnal Green', 'Whitechapel', 'Canary Wharf', 'Deptford',
+    'Lewisham', 'Ilford', 'Harrow', 'Kingston upon Thames', 'Southall', 'Hounslow', 'Bromley',
+    'Sutton', 'Enfield', 'Barnet', 'Tottenham', 'Leyton', 'Forest Gate', 'Acton', 'Shepherd\'s Bush',
+]
+NAME_WORDS = [
+    'Kitchen', 'Grill', 'House', 'Bistro', 'Cafe', 'Canteen', 'Dining', 'Table', 'Garden',
+    'Corner', 'Express', 'Palace', 'Lounge', 'Tavern', 'Deli', 'Social', 'Brasserie', 'Bar',
+]
+NAME_STEMS = [
+    'Golden', 'Royal', 'Little', 'Old', 'New', 'Blue', 'Red', 'Green', 'Silver', 'Spice',
+    'Olive', 'Bamboo', 'Lotus', 'Saffron', 'Harbour', 'Market', 'Station', 'Crown', 'Oak',
+    'Rose', 'Dragon', 'Tiger', 'Mango', 'Pepper', 'Basil', 'Cedar', 'Fig', 'Lemon', 'Maple',
+]
+STREETS = ['High St', 'Church St', 'Station Rd', 'Market Pl', 'Broadway', 'King St', 'Queen St',
+           'Mill Ln', 'Park Rd', 'London Rd', 'Victoria St', 'Green Ln']
+# Restaurants cluster around a few centres, the rest spread over Greater London
+CENTRES = [(51.513, -0.131), (51.539, -0.142), (51.524, -0.078), (51.462, -0.115),
+           (51.505, -0.023), (51.492, -0.224), (51.556, -0.280)]
+
+
+def _weighted(rnd, population):
+    """Sampler favouring earlier entries of population (weights 1, 1/2, 1/3, ...)"""
+    cumulative = list(accumulate(1 / (rank + 1) for rank in range(len(population))))
+    return lambda k=1: rnd.choices(population, cum_weights=cumulative, k=k)
+
+
+def generate_export(count, seed=SEED):
+    """A DataFrame of count restaurants in the export's schema, the same for a given seed"""
+    import pandas as pd
+
+    rnd = random.Random(seed)
+    subtypes = _weighted(rnd, SUBTYPES)
+    cities = _weighted(rnd, NEIGHBOURHOODS)
+    nan = float('nan')
+
+    columns = {name: [] for name in ('name', 'subtypes', 'city', 'rating', 'reviews', 'full_address',
+                                     'street', 'phone', 'phone_1', 'site', 'photo', 'latitude',
+                                     'longitude', 'place_id')}
+    for i in range(count):
+        name = f"{rnd.choice(NAME_STEMS)} {rnd.choice(NAME_WORDS)}"
+        if rnd.random() < 0.3:
+            name = f"The {name}"
+        columns['name'].append(name)
+
+        k = rnd.choice((0, 1, 1, 2, 2, 2, 3, 4))
+        columns['subtypes'].append(', '.join(dict.fromkeys(subtypes(k))) if k else nan)
+
+        columns['city'].append(nan if rnd.random() < 0.02 else cities()[0])
+
+        if rnd.random() < 0.1:
+            columns['rating'].append(nan)
+            columns['reviews'].append(nan)
+        else:
+            columns['rating'].append(round(min(5.0, max(1.0, rnd.gauss(4.2, 0.5))), 1))
+            columns['reviews'].append(int(rnd.paretovariate(1.2) * 10))
+
+        street = rnd.choice(STREETS)
+        columns['street'].append(street)
+        columns['full_address'].append(f"{rnd.randint(1, 400)} {street}, London "
+                                       f"{rnd.choice('ENSW')}{rnd.randint(1, 20)} {rnd.randint(1, 9)}"
+                                       f"{rnd.choice('ABDEFGHJ')}{rnd.choice('LNPQRSTU')}")
+        columns['phone'].append(f"+44 20 {rnd.randint(7000, 8999)} {rnd.randint(1000, 9999)}"
+                                if rnd.random() < 0.8 else nan)
+        columns['phone_1'].append(nan)
+        columns['site'].append(f"https://www.example-{i}.co.uk/" if rnd.random() < 0.6 else nan)
+        columns['photo'].append(f"https://images.example.com/places/{i}.jpg" if rnd.random() < 0.7 else nan)
+
+        if rnd.random() < 0.7:
+            lat, lon = rnd.choice(CENTRES)
+            columns['latitude'].append(rnd.gauss(lat, 0.02))
+            columns['longitude'].append(rnd.gauss(lon, 0.03))
+        else:
+            columns['latitude'].append(51.3 + rnd.random() * 0.4)
+            columns['longitude'].append(-0.5 + rnd.random() * 0.6)
+        columns['place_id'].append(f"ChIJ{seed:04d}{i:010d}")
+
+    return pd.DataFrame(columns)
+
+def write_export(df, path):
+    """Write a generated export as .xlsx, .csv or .parquet"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        df.to_csv(path, index=False)
+    elif ext == '.parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_excel(path, index=False)
+
+
+def _reset_peak_rss():
+    """Start a new peak memory measurement where the platform allows it (Linux)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def _peak_rss_mb():
+    """Peak resident memory since the last _reset_peak_rss, or of the whole process"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, round(time.perf_counter() - started, 6)
+
+def _quiet_import_app():
+    """Import app with its startup load of the bundled data kept out of the output"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+    _reset_peak_rss()
+    return app
+
+
+def stage_ingest(export_path, work_dir):
+    """Process an export as load_and_process_data does, then write the processed files"""
+    from dedup import find_duplicates
+    from facets import FacetIndex
+    from snapshot import save_snapshot
+    from search import SearchIndex
+    from similar import SimilarIndex
+    from spatial import SpatialIndex
+
+    site = _quiet_import_app()
+    result = {'rss_baseline_mb': _peak_rss_mb()}
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, result['ingest_s'] = _timed(site.load_and_process_data, export_path)
+    result['restaurants'] = len(site.restaurants_data)
+    result['cuisines'] = len(site.cuisines_dict)
+    result['neighbourhoods'] = len(site.neighbourhoods_dict)
+
+    search, result['search_index_s'] = _timed(SearchIndex.build, site.restaurants_data, site.score_order)
+    spatial, result['spatial_index_s'] = _timed(SpatialIndex, site.restaurants_data.latitude,
+                                                site.restaurants_data.longitude, site.score_order)
+    facets, result['facet_index_s'] = _timed(FacetIndex, site.restaurants_data)
+    similar, result['similar_index_s'] = _timed(SimilarIndex.build, site.restaurants_data, site.score_order)
+    (groups, _), result['dedup_s'] = _timed(find_duplicates, site.restaurants_data)
+    result['duplicates'] = sum(len(dropped) for dropped in groups.values())
+
+    json_dir = os.path.join(work_dir, 'json')
+    snapshot_dir = os.path.join(work_dir, 'snapshot')
+    os.makedirs(json_dir, exist_ok=True)
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    def write_json():
+        # Same layout convert_to_json.py writes
+        with open(os.path.join(json_dir, 'processed_data.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'restaurants': site.restaurants_data.to_records(),
+                'cuisines': site.cuisines_dict,
+                'neighbourhoods': site.neighbourhoods_dict,
+                'score_order': list(site.score_order),
+            }, f, ensure_ascii=False, indent=2)
+
+    _, result['save_json_s'] = _timed(write_json)
+    _, result['save_snapshot_s'] = _timed(
+        save_snapshot, os.path.join(snapshot_dir, 'processed_data.bin'), site.restaurants_data,
+        site.score_order, {
+            'cuisine_index': site.cuisine_index,
+            'neighbourhood_index': site.neighbourhood_index,
+            'neighbourhood_cuisine_index': site.neighbourhood_cuisine_index,
+        }, site.cuisines_dict, site.neighbourhoods_dict, search, spatial, facets, similar=similar)
+    result['json_mb'] = round(os.path.getsize(os.path.join(json_dir, 'processed_data.json')) / 2**20, 1)
+    result['snapshot_mb'] = round(os.path.getsize(os.path.join(snapshot_dir, 'processed_data.bin')) / 2**20, 1)
+    result['rss_peak_mb'] = _peak_rss_mb()
+    return result
+
+def write_shards(df, paths):
+    """Split a generated export into consecutive parts, one per path"""
+    bounds = [len(df) * n // len(paths) for n in range(len(paths) + 1)]
+    for path, start, end in zip(paths, bounds, bounds[1:]):
+        write_export(df.iloc[start:end], path)
+
+def _same_output(a, b):
+    """Whether two ingest results hold the same rows, dictionaries and counts"""
+    store_a, store_b = a[0], b[0]
+    for name in ('ids', 'rating', 'reviews', 'score', 'latitude', 'longitude', 'julans_pick',
+                 'city_codes', 'cities', 'cuisine_codes', 'cuisine_offsets', 'cuisine_names'):
+        if list(getattr(store_a, name)) != list(getattr(store_b, name)):
+            return False
+    for name in ('names', 'addresses', 'phones', 'websites', 'photos'):
+        table_a, table_b = getattr(store_a, name), getattr(store_b, name)
+        if bytes(table_a.blob) != bytes(table_b.blob) or list(table_a.offsets) != list(table_b.offsets):
+            return False
+    return all(list(x.items()) == list(y.items()) for x, y in zip(a[1:], b[1:]))
+
+def stage_shards(export_path, shard_paths, worker_counts=SHARD_WORKERS):
+    """Ingest an export whole, then split into shards with 1, 2, 4... worker processes"""
+    import ingest
+
+    result = {'shards': len(shard_paths)}
+    expected, result['single_s'] = _timed(ingest.process_file, export_path)
+    identical = True
+    for workers in worker_counts:
+        merged, elapsed = _timed(ingest.process_files, shard_paths, None, workers)
+        result[f'workers_{workers}'] = {'ingest_s': elapsed,
+                                        'speedup': round(result['single_s'] / elapsed, 2)}
+        identical = identical and _same_output(merged, expected)
+    shards = [ingest.process_file(path) for path in shard_paths]
+    _, result['merge_s'] = _timed(ingest.merge_shards, shards)
+    result['identical'] = identical
+    return result
+
+def stage_load(data_dir):
+    """Load processed data from data_dir and read every row once"""
+    site = _quiet_import_app()
+    result = {'rss_baseline_mb': _peak_rss_mb()}
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, result['load_s'] = _timed(site.load_and_process_data, None, data_dir)
+    result['restaurants'] = len(site.restaurants_data)
+
+    def first_page():
+        return [site.restaurants_data[i].to_dict() for i in site.score_order[:12]]
+
+    _, result['first_page_s'] = _timed(first_page)
+    _, result['catalog_s'] = _timed(site.get_catalog)
+
+    def scan():
+        # Touches every row, so a lazily mapped snapshot is counted in full
+        return sum(len(site.restaurants_data[i].name) for i in range(len(site.restaurants_data)))
+
+    _, result['full_scan_s'] = _timed(scan)
+    result['rss_peak_mb'] = _peak_rss_mb()
+    return result
+
+
+def _routes(site):
+    """Representative URLs for the loaded data, keyed by a stable route name"""
+    catalog = site.get_catalog()
+    cuisine = catalog.cuisines.ranked[0][0] if len(catalog.cuisines) else 'none'
+    neighbourhood = catalog.neighbourhoods.ranked[0][0] if len(catalog.neighbourhoods) else 'none'
+    pairs = sorted(site.neighbourhood_cuisine_index.items(), key=lambda item: len(item[1]), reverse=True)
+    pair = pairs[0][0] if pairs else (neighbourhood, cuisine)
+    middle = max(1, (len(site.restaurants_data) + 11) // 12 // 2)
+    middle_cursor = site.encode_cursor(site.score_order[len(site.score_order) // 2]) if len(site.score_order) else ''
+    # A mid-ranked restaurant, so its page is not one the homepage warmed
+    restaurant = site.restaurants_data[site.score_order[len(site.score_order) // 2]].id if len(site.score_order) else 0
+    lat, lon = CENTRES[0]
+    return {
+        'home': '/',
+        'home_page_middle': f'/page/{middle}',
+        'cuisines': '/cuisines',
+        'neighbourhoods': '/neighbourhoods',
+        'about': '/about',
+        'cuisine': f'/cuisine/{cuisine}',
+        'cuisine_page_5': f'/cuisine/{cuisine}/page/5',
+        'cuisine_filtered': f'/cuisine/{cuisine}?rating=4.5&reviews=100',
+        'neighbourhood': f'/neighbourhood/{neighbourhood}',
+        'neighbourhood_cuisine': f'/neighbourhood/{pair[0]}/cuisine/{pair[1]}',
+        'near': f'/near?lat={lat}&lon={lon}',
+        'api_near': f'/api/near?lat={lat}&lon={lon}&radius=2',
+        'search': '/search?q=golden+kitchen',
+        'search_fuzzy': '/search?q=saffon',
+        'api_suggest': '/api/suggest?q=sp',
+        'api_restaurants': '/api/restaurants?fields=id,name,rating',
+        'api_restaurants_middle': f'/api/restaurants?after={middle_cursor}',
+        'api_cuisine_filtered': f'/api/cuisine/{cuisine}?rating=4.5&fields=id,name,latitude,longitude',
+        'api_neighbourhood_cuisine': f'/api/neighbourhood/{pair[0]}/cuisine/{pair[1]}',
+        'restaurant': f'/restaurant/{restaurant}',
+        'api_similar': f'/api/restaurants/{restaurant}/similar?fields=id,name,rating',
+        'sitemap_index': '/sitemap.xml',
+        'sitemap_shard': '/sitemap-1.xml',
+    }
+
+def _percentile(sorted_values, share):
+    index = min(len(sorted_values) - 1, int(round(share * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def _time_requests(client, url, count):
+    started = time.perf_counter()
+    response = client.get(url)
+    first_ms = (time.perf_counter() - started) * 1000
+    latencies = []
+    total_started = time.perf_counter()
+    for _ in range(count):
+        started = time.perf_counter()
+        client.get(url)
+        latencies.append((time.perf_counter() - started) * 1000)
+    total = time.perf_counter() - total_started
+    latencies.sort()
+    return {
+        'status': response.status_code,
+        'bytes': len(response.data),
+        'first_ms': round(first_ms, 3),
+        'p50_ms': round(_percentile(latencies, 0.50), 3),
+        'p95_ms': round(_percentile(latencies, 0.95), 3),
+        'p99_ms': round(_percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'rps': round(count / total, 1),
+    }
+
+def _time_export(client):
+    """Time to first byte, total time and memory growth of streaming the full NDJSON export once"""
+    # Reading the rows pages in the mapped snapshot, which counts as private
+    # memory while one process maps it; only dirty pages are the export's own
+    dirty_before = _memory_mb()['dirty_mb']
+    started = time.perf_counter()
+    response = client.get('/api/export.ndjson', buffered=False)
+    ttfb = None
+    rows = size = 0
+    for chunk in response.response:
+        if ttfb is None:
+            ttfb = time.perf_counter() - started
+        rows += chunk.count(b'\n' if isinstance(chunk, bytes) else '\n')
+        size += len(chunk)
+    response.close()
+    return {
+        'status': response.status_code,
+        'rows': rows,
+        'bytes': size,
+        'ttfb_ms': round((ttfb or 0) * 1000, 3),
+        'total_s': round(time.perf_counter() - started, 3),
+        'dirty_growth_mb': round(_memory_mb()['dirty_mb'] - dirty_before, 1),
+    }
+
+def stage_routes(data_dir, requests_per_route):
+    """Latency and throughput of every route, rendered fresh and from the page cache"""
+    site = _quiet_import_app()
+    result = {'rss_baseline_mb': _peak_rss_mb()}
+    with contextlib.redirect_stdout(io.StringIO()):
+        site.load_and_process_data(None, data_dir)
+    client = site.app.test_client()
+    cache_bytes = site.page_cache.max_bytes
+    card_bytes = site.card_cache.max_bytes
+
+    for name, url in _routes(site).items():
+        # Uncached: every request renders (lazily built indexes land in first_ms),
+        # first rendering every restaurant card too, then reusing cached cards
+        site.page_cache.max_bytes = 0
+        site.card_cache.max_bytes = 0
+        site.card_cache.clear()
+        no_cards = _time_requests(client, url, requests_per_route)
+        site.card_cache.max_bytes = card_bytes
+        uncached = _time_requests(client, url, requests_per_route)
+        site.page_cache.max_bytes = cache_bytes
+        cached = _time_requests(client, url, requests_per_route)
+        result[name] = {'url': url, 'uncached_no_cards': no_cards, 'uncached': uncached, 'cached': cached}
+    result['export'] = _time_export(client)
+    result['rss_peak_mb'] = _peak_rss_mb()
+    return result
+
+
+def _memory_mb():
+    """Resident, private (unique to this process), private dirty (heap, not mapped files)
+    and proportional memory, from smaps_rollup"""
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss_mb': round(fields['Rss'] / 1024, 1),
+        'uss_mb': round((fields['Private_Clean'] + fields['Private_Dirty']) / 1024, 1),
+        'dirty_mb': round(fields['Private_Dirty'] / 1024, 1),
+        'pss_mb': round(fields['Pss'] / 1024, 1),
+    }
+
+def _worker(env, loaded, measured, results):
+    """One app worker: load at import, request every route, then report memory"""
+    os.environ.update(env)
+    started = time.perf_counter()
+    site = _quiet_import_app()
+    load_s = time.perf_counter() - started
+    client = site.app.test_client()
+    for url in _routes(site).values():
+        client.get(url)
+    # Measure with every worker alive, so shared pages are split between them
+    loaded.wait()
+    results.put(dict(_memory_mb(), load_s=round(load_s, 3)))
+    measured.wait()
+
+def stage_workers(work_dir, mode, counts=WORKER_COUNTS):
+    """Memory of N app worker processes serving the same data at once, for each N in counts"""
+    env = {'DATA_DIR': os.path.join(work_dir, 'snapshot' if mode == 'snapshot' else 'json'),
+           'PAGE_CACHE_MAX_BYTES': '0'}
+    if mode == 'shared':
+        env['SHARED_DATA'] = '1'
+        env['SHARED_DATA_DIR'] = os.path.join(work_dir, 'shared')
+    context = get_context('spawn')
+    result = {}
+    for count in counts:
+        loaded, measured = context.Barrier(count), context.Barrier(count + 1)
+        results = context.Queue()
+        workers = [context.Process(target=_worker, args=(env, loaded, measured, results))
+                   for _ in range(count)]
+        for worker in workers:
+            worker.start()
+        samples = [results.get() for _ in workers]
+        measured.wait()
+        for worker in workers:
+            worker.join()
+        result[str(count)] = {
+            'load_s': max(sample['load_s'] for sample in samples),
+            'rss_mb': round(sum(sample['rss_mb'] for sample in samples) / count, 1),
+            'uss_mb': round(sum(sample['uss_mb'] for sample in samples) / count, 1),
+            'uss_max_mb': max(sample['uss_mb'] for sample in samples),
+            'pss_mb': round(sum(sample['pss_mb'] for sample in samples) / count, 1),
+            'pss_total_mb': round(sum(sample['pss_mb'] for sample in samples), 1),
+        }
+    return result
+
+
+# Run in a fresh `python -X importtime` by stage_startup; prints its results as JSON
+_STARTUP_SCRIPT = """
+import contextlib, io, json, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import app
+imported = time.perf_counter() - started
+import bench
+started = time.perf_counter()
+app.dataset.score_order  # posting lists are built on first use
+posting_indexes_s = time.perf_counter() - started
+client = app.app.test_client()
+first_request_s = {{}}
+for name, url in bench._routes(app).items():
+    started = time.perf_counter()
+    client.get(url)
+    first_request_s[name] = round(time.perf_counter() - started, 6)
+print(json.dumps({{
+    'import_app_s': round(imported, 6),
+    'startup_imports_s': round(app.startup['imports'], 6),
+    'startup_data_load_s': round(app.startup['data_load'], 6),
+    'posting_indexes_s': round(posting_indexes_s, 6),
+    'first_request_s': first_request_s,
+    'heavy_modules': sorted(name for name in ('pandas', 'numpy', 'openpyxl') if name in sys.modules),
+}}))
+"""
+
+def _import_breakdown(importtime_log, top=10):
+    """Cumulative milliseconds of the modules app imports directly, slowest first"""
+    children = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        name = name.strip()
+        if depth == 0:
+            if name == 'app':
+                break
+            children = {}
+        elif depth == 1:
+            children[name] = round(int(cumulative) / 1000, 3)
+    return dict(sorted(children.items(), key=lambda item: item[1], reverse=True)[:top])
+
+def stage_startup(data_dir):
+    """Cold start of the app over data_dir: imports, data load and each route's first request"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, DATA_DIR=data_dir)
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', _STARTUP_SCRIPT.format(root=root)],
+                               capture_output=True, text=True, env=env, cwd=root, check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['import_breakdown_ms'] = _import_breakdown(completed.stderr)
+    return result
+
+
+def _run_isolated(fn, *args):
+    """Run a stage in a fresh interpreter and return its result"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(fn, *args).result()
+
+def _git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def run(sizes, export_format='xlsx', seed=SEED, data_dir=DATA_DIR, requests_per_route=REQUESTS_PER_ROUTE,
+        stages=('ingest', 'load', 'routes'), worker_modes=('snapshot', 'shared')):
+    """Benchmark every size and return the results document"""
+    from ingest import INGEST_MODE
+
+    commit, dirty = _git_commit()
+    results = {
+        'commit': commit,
+        'dirty': dirty,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': seed,
+        'export_format': export_format,
+        'ingest_mode': INGEST_MODE,
+        'requests_per_route': requests_per_route,
+        'sizes': {},
+    }
+    for count in sizes:
+        work_dir = os.path.abspath(os.path.join(data_dir, f'{count}-{seed}'))
+        os.makedirs(work_dir, exist_ok=True)
+        export_path = os.path.join(work_dir, f'export.{export_format}')
+        size = results['sizes'][str(count)] = {}
+
+        # Generated exports are reused: generation is not what is measured
+        if not os.path.exists(export_path):
+            print(f"[{count}] generating {export_path}...")
+            started = time.perf_counter()
+            write_export(generate_export(count, seed), export_path)
+            print(f"[{count}] generated in {time.perf_counter() - started:.1f}s")
+
+        snapshot_ready = os.path.exists(os.path.join(work_dir, 'snapshot', 'processed_data.bin'))
+        if 'ingest' in stages or not snapshot_ready:
+            print(f"[{count}] ingest...")
+            size['ingest'] = _run_isolated(stage_ingest, export_path, work_dir)
+            print(f"[{count}] ingest {size['ingest']['ingest_s']}s, peak {size['ingest']['rss_peak_mb']} MB")
+        if 'shards' in stages:
+            shard_paths = [os.path.join(work_dir, f'shard-{n}-of-{SHARD_COUNT}.{export_format}')
+                           for n in range(1, SHARD_COUNT + 1)]
+            if not all(os.path.exists(path) for path in shard_paths):
+                print(f"[{count}] splitting the export into {SHARD_COUNT} shards...")
+                write_shards(generate_export(count, seed), shard_paths)
+            shards = size['shards'] = _run_isolated(stage_shards, export_path, shard_paths)
+            timings = ', '.join(f"{workers} workers {shards[f'workers_{workers}']['ingest_s']:.2f}s"
+                                for workers in SHARD_WORKERS)
+            print(f"[{count}] shards: whole export {shards['single_s']:.2f}s, {timings} "
+                  f"(merge {shards['merge_s']:.2f}s, {results['cpus']} CPUs), "
+                  f"{'identical' if shards['identical'] else 'DIFFERENT'} output")
+        if 'load' in stages:
+            size['load'] = {}
+            for kind in ('snapshot', 'json'):
+                size['load'][kind] = _run_isolated(stage_load, os.path.join(work_dir, kind))
+                print(f"[{count}] load {kind} {size['load'][kind]['load_s']}s, "
+                      f"peak {size['load'][kind]['rss_peak_mb']} MB")
+        if 'routes' in stages:
+            print(f"[{count}] routes...")
+            size['routes'] = _run_isolated(stage_routes, os.path.join(work_dir, 'snapshot'), requests_per_route)
+            for name, route in size['routes'].items():
+                if isinstance(route, dict) and 'url' in route:
+                    print(f"[{count}]   {name:<22} uncached p50 {route['uncached_no_cards']['p50_ms']:8.3f} ms"
+                          f"   cached cards {route['uncached']['p50_ms']:8.3f} ms"
+                          f"   cached page {route['cached']['p50_ms']:7.3f} ms")
+            export = size['routes']['export']
+            print(f"[{count}]   export {export['rows']} rows, first byte {export['ttfb_ms']:.1f} ms, "
+                  f"total {export['total_s']}s, dirty memory +{export['dirty_growth_mb']} MB")
+        if 'startup' in stages:
+            size['startup'] = {}
+            for kind in ('snapshot', 'json'):
+                startup = size['startup'][kind] = stage_startup(os.path.join(work_dir, kind))
+                print(f"[{count}] startup {kind:<8} import {startup['import_app_s'] * 1000:7.1f} ms "
+                      f"(modules {startup['startup_imports_s'] * 1000:.1f} ms, "
+                      f"data load {startup['startup_data_load_s'] * 1000:.1f} ms), "
+                      f"first / {startup['first_request_s']['home'] * 1000:.1f} ms, "
+                      f"heavy modules: {', '.join(startup['heavy_modules']) or 'none'}")
+        if 'workers' in stages:
+            size['workers'] = {}
+            for mode in worker_modes:
+                shared_dir = os.path.join(work_dir, 'shared')
+                if os.path.isdir(shared_dir):
+                    shutil.rmtree(shared_dir)
+                size['workers'][mode] = stage_workers(work_dir, mode)
+                for workers, memory in size['workers'][mode].items():
+                    print(f"[{count}] workers {mode:<8} x{workers}: private {memory['uss_mb']:7.1f} MB, "
+                          f"proportional {memory['pss_mb']:7.1f} MB per worker, "
+                          f"{memory['pss_total_mb']:7.1f} MB in all")
+    return results
+
+
+def _flatten(value, prefix=''):
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f'{prefix}.{key}' if prefix else key))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+def _higher_is_better(metric):
+    return metric.endswith('rps')
+
+# Metrics worth comparing; first_ms and p99_ms are single samples and too noisy
+COMPARED_METRICS = ('_s', 'p50_ms', 'ttfb_ms', 'p95_ms', 'mean_ms', 'rps', 'rss_peak_mb', 'uss_mb', 'pss_mb')
+
+def _is_measurement(metric):
+    return metric.endswith(COMPARED_METRICS)
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    """(metric, old, new, relative change, regressed) for every metric in both runs"""
+    old_flat, new_flat = _flatten(old.get('sizes', {})), _flatten(new.get('sizes', {}))
+    rows = []
+    for metric in sorted(old_flat.keys() & new_flat.keys()):
+        if not _is_measurement(metric):
+            continue
+        before, after = old_flat[metric], new_flat[metric]
+        change = (after - before) / before if before else 0.0
+        worse = -change if _higher_is_better(metric) else change
+        rows.append((metric, before, after, change, worse > threshold))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark ingest, loading and routes on synthetic data")
+    parser.add_argument('--sizes', default=','.join(str(n) for n in DEFAULT_SIZES),
+                        help="comma-separated row counts (default: %(default)s)")
+    parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='xlsx',
+                        help="generated export format (default: xlsx; csv is much faster at 1M rows)")
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--stages', default='ingest,load,routes',
+                        help="comma-separated stages to run: ingest, shards, load, routes, startup, workers "
+                             "(default: %(default)s)")
+    parser.add_argument('--worker-modes', default='snapshot,shared',
+                        help=f"how the workers stage loads data, from {', '.join(WORKER_MODES)} "
+                             "(default: %(default)s)")
+    parser.add_argument('--requests', type=int, default=REQUESTS_PER_ROUTE,
+                        help="timed requests per route (default: %(default)s)")
+    parser.add_argument('--data-dir', default=DATA_DIR, help="where generated data is kept (default: %(default)s)")
+    parser.add_argument('--out', help=f"results file (default: {RESULTS_DIR}/<commit>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help="compare two results files instead of running")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="relative change reported as a regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.compare:
+        documents = []
+        for path in args.compare:
+            with open(path, 'r', encoding='utf-8') as f:
+                documents.append(json.load(f))
+        rows = compare(*documents, threshold=args.threshold)
+        regressions = 0
+        for metric, before, after, change, regressed in rows:
+            regressions += regressed
+            print(f"{'!' if regressed else ' '} {metric:<60} {before:>12g} {after:>12g} {change:>+8.1%}")
+        print(f"{regressions} of {len(rows)} metrics regressed by more than {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    sizes = [int(n) for n in args.sizes.split(',') if n]
+    stages = tuple(s for s in args.stages.split(',') if s)
+    worker_modes = tuple(m for m in args.worker_modes.split(',') if m)
+    results = run(sizes, args.export_format, args.seed, args.data_dir, args.requests, stages, worker_modes)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{(results['commit'] or 'unknown')[:10]}"
+                                                f"{'-dirty' if results['dirty'] else ''}.json")
+    if os.path.dirname(out):
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {out}")
@@ -0,0 +1,44 @@
+"""
+Ranked, read-only views of the cuisine and neighbourhood lists
+Built once per data snapshot so templates and routes read ranked lists,
+top-N slices and slug -> name lookups instead of sorting the count dicts on
+every request.
+"""
+from types import MappingProxyType
+
+
+class Ranking:
+    """A {slug: {'name', 'count'}} dict ranked by count, most common first"""
+    __slots__ = ('ranked', 'names', '_tops')
+
+    def __init__(self, counts):
+        ranked = sorted(counts.items(), key=lambda x: x[1]['count'], reverse=True)
+        self.ranked = tuple((slug, MappingProxyType(dict(data))) for slug, data in ranked)
+        self.names = MappingProxyType({slug: data['name'] for slug, data in ranked})
+        self._tops = {}
+
+    def top(self, n):
+        """The n most common entries as (slug, data) pairs"""
+        top = self._tops.get(n)
+        if top is None:
+            top = self._tops[n] = self.ranked[:n]
+        return top
+
+    def name(self, slug, default=None):
+        return self.names.get(slug, default)
+
+    def __contains__(self, slug):
+        return slug in self.names
+
+    def __len__(self):
+        return len(self.ranked)
+
+
+class Catalog:
+    """Ranked cuisines and neighbourhoods of one data snapshot"""
+    __slots__ = ('version', 'cuisines', 'neighbourhoods')
+
+    def __init__(self, version, cuisines, neighbourhoods):
+        self.version = version
+        self.cuisines = Ranking(cuisines)
+        self.neighbourhoods = Ranking(neighbourhoods)
@@ -1,25 +1,128 @@
 """
 Script to convert Excel data to JSON for faster loading on Vercel
 Run this locally before deploying to create the processed_data.json file
+and the memory-mappable processed_data.bin snapshot
+
+Usage: python convert_to_json.py [--incremental] [export.xlsx|export.csv|export.parquet]
+       python convert_to_json.py [--workers N] 'exports/*.csv' north.xlsx ...
+Several exports (files or glob patterns) are processed in parallel, one per
+worker process, and merged into one dataset; restaurants listed in more than
+one are dropped as duplicates (--dedup) and reported in processed_duplicates.json.
+Set INGEST_MODE=streaming to process very large exports in bounded memory.
 """
-import pandas as pd
+import argparse
+import glob
 import json
-from app import load_and_process_data
+import os
+import app
+import ingest
+from app import load_and_process_data, build_indexes
+from snapshot import load_snapshot, save_snapshot, SnapshotError
+from facets import FacetIndex
+from search import SearchIndex
+from similar import SimilarIndex
+from spatial import SpatialIndex
+from store import RestaurantStore
+import incremental
+
+DEFAULT_SOURCE = 'OS-20251124200014m1e_restaurant.xlsx'
+DUPLICATES_FILE = 'processed_duplicates.json'
+
+parser = argparse.ArgumentParser(description="Process a restaurant export into processed_data.json/.bin")
+parser.add_argument('sources', nargs='*', metavar='source',
+                    help=f"exports or glob patterns to process (default: {DEFAULT_SOURCE} if present)")
+parser.add_argument('--incremental', action='store_true',
+                    help="reprocess only rows that changed since the last build")
+parser.add_argument('--workers', type=int,
+                    help="processes for several exports (default: INGEST_WORKERS or one per CPU)")
+parser.add_argument('--dedup', choices=('auto', 'on', 'off'),
+                    help="drop duplicate restaurants; auto does so when merging several exports "
+                         "(default: INGEST_DEDUP or auto)")
+args = parser.parse_args()
+
+# Expand patterns in argument order; a file matched twice is only read once
+sources = []
+for pattern in args.sources:
+    matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+    if not matches:
+        parser.error(f"no exports match {pattern!r}")
+    sources.extend(matches)
+sources = list(dict.fromkeys(sources))
+if args.incremental and len(sources) > 1:
+    parser.error("--incremental works with a single export")
+if args.workers:
+    ingest.INGEST_WORKERS = args.workers
+if args.dedup:
+    ingest.INGEST_DEDUP = args.dedup
+
+source = None
+if len(sources) > 1:
+    source = sources
+elif sources:
+    source = sources[0]
+elif os.path.exists(DEFAULT_SOURCE):
+    source = DEFAULT_SOURCE
 
 print("Converting Excel data to JSON...")
 print("This may take a minute...")
 
-# Load and process data (this uses the same function from app.py)
-load_and_process_data()
+previous = None
+state = None
+if args.incremental and source:
+    state = incremental.load_state(incremental.STATE_FILE)
+    if state is not None and os.path.exists('processed_data.json'):
+        with open('processed_data.json', 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    else:
+        print("No previous build state found, doing a full rebuild")
 
-# Import the global variables after processing
-from app import restaurants_data, cuisines_dict, neighbourhoods_dict
+changes = None
+patched_facets = None
+if previous is not None:
+    # Patch the last build with only the rows that changed
+    # Rows are saved in ingest order (streamed exports keep arrival order); score_order ranks them
+    previous_records = previous['restaurants']
+    if 'score_order' in previous:
+        previous_records = [previous_records[i] for i in previous['score_order']]
+    records, cuisines, neighbourhoods, state, changes = incremental.incremental_rebuild(
+        source, previous_records, previous['cuisines'], previous['neighbourhoods'], state)
+    app.restaurants_data = RestaurantStore.from_records(records)
+    app.cuisines_dict = cuisines
+    app.neighbourhoods_dict = neighbourhoods
+    # Posting lists and facet codes are patched from the last snapshot when it matches the JSON
+    snapshot = None
+    if os.path.exists('processed_data.bin'):
+        try:
+            snapshot = load_snapshot('processed_data.bin')
+        except (OSError, SnapshotError) as e:
+            print(f"Not patching indexes, the last snapshot can't be read: {e}")
+    if snapshot is not None and list(snapshot['restaurants'].ids) == [r['id'] for r in previous['restaurants']]:
+        indexes, patched_facets = incremental.patch_indexes(snapshot, app.restaurants_data, changes)
+        app.score_order, app.cuisine_index, app.neighbourhood_index, app.neighbourhood_cuisine_index = indexes
+    else:
+        build_indexes(app.restaurants_data)
+    print(f"Incremental update: {len(changes['added'])} added, {len(changes['changed'])} changed, "
+          f"{len(changes['removed'])} removed, {changes['unchanged']} unchanged")
+else:
+    # Load and process data (this uses the same function from app.py)
+    load_and_process_data(source)
+    # Incremental state tracks rows of a single export
+    state = None
+    if source and not isinstance(source, list):
+        state = incremental.build_state(source, app.dataset.duplicates)
+
+# Read the globals after processing
+restaurants_data = app.restaurants_data
+cuisines_dict = app.cuisines_dict
+neighbourhoods_dict = app.neighbourhoods_dict
+score_order = app.score_order
 
 # Save to JSON
 data_to_save = {
-    'restaurants': restaurants_data,
+    'restaurants': restaurants_data.to_records(),
     'cuisines': cuisines_dict,
-    'neighbourhoods': neighbourhoods_dict
+    'neighbourhoods': neighbourhoods_dict,
+    'score_order': list(score_order)
 }
 
 print(f"\nSaving processed data...")
@@ -27,9 +130,49 @@ print(f"  - {len(restaurants_data)} restaurants")
 print(f"  - {len(cuisines_dict)} cuisines")
 print(f"  - {len(neighbourhoods_dict)} neighbourhoods")
 
-with open('processed_data.json', 'w', encoding='utf-8') as f:
+# Written aside and renamed into place, so a running app never reads a partial file
+with open('processed_data.json.tmp', 'w', encoding='utf-8') as f:
     json.dump(data_to_save, f, ensure_ascii=False, indent=2)
+os.replace('processed_data.json.tmp', 'processed_data.json')
 
-print("\nSuccess! processed_data.json created.")
-print("You can now deploy to Vercel. The JSON file will be loaded instead of Excel.")
+# Save the binary snapshot the app prefers at startup (JSON stays as the fallback),
+# with the search, spatial, facet and similar-restaurant indexes so workers
+# map them rather than each rebuilding them
+print("Building search, spatial, facet and similar-restaurant indexes...")
+search_index = SearchIndex.build(restaurants_data, score_order)
+spatial_index = SpatialIndex(restaurants_data.latitude, restaurants_data.longitude, score_order)
+facet_index = patched_facets or FacetIndex(restaurants_data)
+# A full build already has the index, built when the data was loaded
+similar_index = app.dataset.similar if previous is None else SimilarIndex.build(restaurants_data, score_order)
+meta = save_snapshot('processed_data.bin', restaurants_data, score_order, {
+    'cuisine_index': app.cuisine_index,
+    'neighbourhood_index': app.neighbourhood_index,
+    'neighbourhood_cuisine_index': app.neighbourhood_cuisine_index,
+}, cuisines_dict, neighbourhoods_dict, search_index, spatial_index, facet_index, similar=similar_index)
+
+# Which restaurants were dropped as duplicates, and why
+duplicates = app.dataset.duplicates if previous is None else None
+if duplicates is not None:
+    with open(DUPLICATES_FILE, 'w', encoding='utf-8') as f:
+        json.dump(duplicates, f, ensure_ascii=False, indent=2)
+    print(f"Dropped {duplicates['dropped']} duplicates, report written to {DUPLICATES_FILE}")
+elif previous is None and os.path.exists(DUPLICATES_FILE):
+    # A report from an earlier build would describe data this one doesn't have;
+    # an incremental run keeps it, and lists its own drops in the change manifest
+    os.remove(DUPLICATES_FILE)
 
+# Fingerprints for the next --incremental run, and what this run touched
+if state is not None:
+    incremental.save_state(incremental.STATE_FILE, state)
+elif os.path.exists(incremental.STATE_FILE):
+    # State from an earlier single-export build would map rows to ids this data doesn't have
+    os.remove(incremental.STATE_FILE)
+if changes is not None:
+    changes['snapshot_version'] = meta['version']
+    with open(incremental.CHANGES_FILE, 'w', encoding='utf-8') as f:
+        json.dump(changes, f, ensure_ascii=False, indent=2)
+    print(f"Change manifest written to {incremental.CHANGES_FILE}")
+
+print("\nSuccess! processed_data.json and processed_data.bin created.")
+print(f"Snapshot version: {meta['version']}")
+print("You can now deploy to Vercel. The JSON file will be loaded instead of Excel.")
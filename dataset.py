@@ -0,0 +1,223 @@
+"""
+One loaded copy of the restaurant data and everything derived from it
+A Dataset is never changed once the app serves it. Reloading builds a new one
+off to the side (warm() builds the lazily derived indexes, including the
+posting lists of data loaded from JSON or Excel, up front) and the app swaps
+a single reference to it, so a request that started on the old data finishes
+on the old data.
+"""
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+from catalog import Catalog
+from facets import FacetIndex
+from search import SearchIndex, LabelIndex
+from similar import SimilarIndex
+from slugs import slugify
+from sitemap import Sitemap, build_urls as build_sitemap_urls
+from spatial import SpatialIndex
+from store import RestaurantStore
+
+
+def compute_score_order(store):
+    """Positions of restaurants sorted by score, highest first (ties keep data order)"""
+    score = store.score
+    return array('i', sorted(range(len(store)), key=score.__getitem__, reverse=True))
+
+def posting_indexes(store, order=None):
+    """Score ordering and cuisine, neighbourhood and neighbourhood+cuisine posting lists
+
+    Returns (order, by_cuisine, by_neighbourhood, by_pair); every posting list
+    is an array of positions in store, highest score first.
+    """
+    # Reuse an ordering stored with the snapshot when it matches the data
+    if order is None or len(order) != len(store):
+        order = compute_score_order(store)
+    elif isinstance(order, list):
+        order = array('i', order)
+
+    # Slugs are computed once per dictionary entry rather than once per restaurant
+    city_slugs = [slugify(city) for city in store.cities]
+    cuisine_slugs = [slugify(cuisine) for cuisine in store.cuisine_names]
+    city_codes = store.city_codes
+
+    by_cuisine = {}
+    by_neighbourhood = {}
+    by_pair = {}
+
+    # Visit restaurants best-first so every posting list comes out sorted by score
+    for i in order:
+        city_slug = city_slugs[city_codes[i]]
+        if city_slug:
+            by_neighbourhood.setdefault(city_slug, array('i')).append(i)
+
+        seen = set()
+        for code in store.cuisine_codes_at(i):
+            cuisine_slug = cuisine_slugs[code]
+            if not cuisine_slug or cuisine_slug in seen:
+                continue
+            seen.add(cuisine_slug)
+            by_cuisine.setdefault(cuisine_slug, array('i')).append(i)
+            if city_slug:
+                by_pair.setdefault((city_slug, cuisine_slug), array('i')).append(i)
+
+    return order, by_cuisine, by_neighbourhood, by_pair
+
+
+class Dataset:
+    """Restaurants, counts and indexes of one data snapshot
+
+    indexes, when given, is (order, by_cuisine, by_neighbourhood, by_pair) as
+    loaded from a snapshot; otherwise they are built from the store (reusing
+    order, if given) the first time one is read. search, spatial, facets and
+    similar are indexes loaded with the snapshot, or None to build them on
+    first use.
+    duplicates is the report of duplicates dropped while processing an
+    export (see ingest.drop_duplicates), if that ran.
+    """
+
+    def __init__(self, restaurants, cuisines, neighbourhoods, version, updated_at,
+                 order=None, indexes=None, search=None, spatial=None, facets=None,
+                 similar=None, duplicates=None):
+        self.restaurants = restaurants
+        self.cuisines = cuisines
+        self.neighbourhoods = neighbourhoods
+        self.version = version
+        self.updated_at = updated_at
+        self.duplicates = duplicates
+        self._order = order
+        self._indexes = indexes
+        self.catalog = Catalog(version, cuisines, neighbourhoods)
+        self._search = search
+        self._facets = facets
+        self._spatial = spatial
+        self._similar = similar
+        self._labels = None
+        self._neighbourhood_cuisines = None
+        self._sitemap = None
+        self._by_id = None
+
+    @classmethod
+    def empty(cls):
+        return cls(RestaurantStore.from_records([]), {}, {}, 'empty', datetime.now(timezone.utc))
+
+    def _posting_indexes(self):
+        if self._indexes is None:
+            self._indexes = posting_indexes(self.restaurants, self._order)
+            self._order = None
+        return self._indexes
+
+    @property
+    def score_order(self):
+        """Positions of every restaurant, highest score first"""
+        return self._posting_indexes()[0]
+
+    @property
+    def cuisine_index(self):
+        """Cuisine slug -> positions, highest score first"""
+        return self._posting_indexes()[1]
+
+    @property
+    def neighbourhood_index(self):
+        """Neighbourhood slug -> positions, highest score first"""
+        return self._posting_indexes()[2]
+
+    @property
+    def neighbourhood_cuisine_index(self):
+        """(neighbourhood slug, cuisine slug) -> positions, highest score first"""
+        return self._posting_indexes()[3]
+
+    @property
+    def by_id(self):
+        """Positions of every restaurant in ascending id order"""
+        if self._by_id is None:
+            if self._similar is not None:
+                # The similar-restaurant index keeps the same ordering, mapped with the snapshot
+                self._by_id = self._similar.by_id
+            else:
+                ids = self.restaurants.ids
+                self._by_id = array('i', sorted(range(len(ids)), key=ids.__getitem__))
+        return self._by_id
+
+    def position_of(self, restaurant_id):
+        """Store position of the restaurant with an id, or None"""
+        ids = self.restaurants.ids
+        by_id = self.by_id
+        n = bisect_left(by_id, restaurant_id, key=ids.__getitem__)
+        if n < len(by_id) and ids[by_id[n]] == restaurant_id:
+            return by_id[n]
+        return None
+
+    @property
+    def search(self):
+        """Full-text search index, built here if the snapshot had none"""
+        if self._search is None:
+            self._search = SearchIndex.build(self.restaurants, self.score_order)
+        return self._search
+
+    @property
+    def facets(self):
+        """Facet level codes of every restaurant"""
+        if self._facets is None:
+            self._facets = FacetIndex(self.restaurants)
+        return self._facets
+
+    @property
+    def spatial(self):
+        """Grid index over restaurant coordinates"""
+        if self._spatial is None:
+            self._spatial = SpatialIndex(self.restaurants.latitude, self.restaurants.longitude,
+                                         self.score_order)
+        return self._spatial
+
+    @property
+    def similar(self):
+        """Every restaurant's most similar restaurants, computed here if the snapshot had none"""
+        if self._similar is None:
+            self._similar = SimilarIndex.build(self.restaurants, self.score_order)
+        return self._similar
+
+    @property
+    def labels(self):
+        """Typeahead over cuisine and neighbourhood names"""
+        if self._labels is None:
+            self._labels = (LabelIndex(self.catalog.cuisines.ranked),
+                            LabelIndex(self.catalog.neighbourhoods.ranked))
+        return self._labels
+
+    @property
+    def neighbourhood_cuisines(self):
+        """Neighbourhood slug -> cuisines found there as (slug, count), most common first"""
+        if self._neighbourhood_cuisines is None:
+            # Counts are the lengths of the neighbourhood+cuisine posting lists
+            by_neighbourhood = {}
+            pairs = self.neighbourhood_cuisine_index
+            for n_slug, c_slug in pairs.keys():
+                by_neighbourhood.setdefault(n_slug, []).append((c_slug, len(pairs.get((n_slug, c_slug)))))
+            for counts in by_neighbourhood.values():
+                counts.sort(key=lambda x: x[1], reverse=True)
+            self._neighbourhood_cuisines = by_neighbourhood
+        return self._neighbourhood_cuisines
+
+    @property
+    def sitemap(self):
+        """Sitemap URLs, split into shards"""
+        if self._sitemap is None:
+            urls = build_sitemap_urls(self.neighbourhoods, self.cuisines, self.neighbourhood_cuisine_index)
+            self._sitemap = Sitemap(self.version, self.updated_at, urls)
+        return self._sitemap
+
+    def warm(self, names=None):
+        """Build lazily derived indexes now, so no request has to wait for one
+
+        names picks some of the properties below; by default every index
+        is built, including the posting lists.
+        """
+        if names is None:
+            self._posting_indexes()
+            names = ('search', 'facets', 'spatial', 'similar', 'by_id', 'labels', 'neighbourhood_cuisines',
+                     'sitemap')
+        # Each of these properties builds and caches its index on first read
+        for name in names:
+            getattr(self, name)
@@ -0,0 +1,365 @@
+"""
+Finding duplicate restaurants
+Overlapping exports list the same venue more than once, usually under a
+slightly different name or address. Rather than comparing every pair, only
+restaurants in blocks are compared: those in the same or a neighbouring grid
+cell (cells are MATCH_RADIUS_M across), and those sharing a phone number.
+Candidate pairs are generated and filtered by distance with numpy a batch at
+a time, and names are first compared by MinHash estimates of their trigram
+overlap; only pairs near the threshold get an exact comparison. The work
+therefore grows with the number of restaurants rather than its square.
+
+Two restaurants are duplicates when their names are at least NAME_SIMILARITY
+alike and they are within MATCH_RADIUS_M of each other, unless both list a
+phone number and the numbers differ. They are also duplicates when they share
+a phone number, are within PHONE_RADIUS_M (or either has no coordinates) and
+their names are at least PHONE_NAME_SIMILARITY alike. Either way, two
+addresses that are less than ADDRESS_SIMILARITY alike rule a match out.
+Duplicates are grouped transitively, and each group keeps its best-scored
+restaurant.
+
+Usage: python dedup.py [N]   (benchmark on synthetic data with planted duplicates)
+"""
+import math
+import re
+import zlib
+
+import numpy as np
+
+# How close two listings must be to count as the same place
+MATCH_RADIUS_M = 50.0
+# Listings sharing a phone number may be further apart (geocoding differs)
+PHONE_RADIUS_M = 250.0
+
+# Trigram Jaccard similarity of normalised names needed for a match
+NAME_SIMILARITY = 0.65
+PHONE_NAME_SIMILARITY = 0.4
+# Listings whose addresses are less alike than this are different places
+ADDRESS_SIMILARITY = 0.3
+
+# Words that don't tell two restaurants apart
+STOP_WORDS = {'the', 'restaurant', 'cafe', 'café', 'ltd', 'limited', 'and'}
+
+# A phone number shared by more listings than this is a booking line or call
+# centre rather than one venue, and is not used for blocking
+MAX_PHONE_BLOCK = 20
+
+# MinHash signature length, and how far below the threshold an estimate may
+# fall and still get an exact comparison
+MINHASH_SIZE = 16
+MINHASH_SLACK = 0.25
+
+# Candidate pairs generated per numpy batch
+BATCH_PAIRS = 1 << 21
+
+METRES_PER_DEGREE = math.pi * 6371008.8 / 180
+
+_NAME_NOISE = re.compile(r'[^\w\s]')
+_PHONE_NOISE = re.compile(r'\D')
+_MERSENNE = (1 << 31) - 1
+
+
+def normalise_name(name):
+    """Lower-case words of a name without punctuation or stop words"""
+    words = _NAME_NOISE.sub(' ', name.lower()).split()
+    return ' '.join(word for word in words if word not in STOP_WORDS) or ' '.join(words)
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def name_similarity(a, b):
+    """Jaccard similarity of the trigrams of two normalised names"""
+    a, b = trigrams(a), trigrams(b)
+    return len(a & b) / len(a | b)
+
+def address_similarity(a, b):
+    """Jaccard similarity of the trigrams of two addresses, ignoring case and punctuation"""
+    return name_similarity(' '.join(_NAME_NOISE.sub(' ', a.lower()).split()),
+                           ' '.join(_NAME_NOISE.sub(' ', b.lower()).split()))
+
+def phone_key(phone):
+    """A phone number as an integer that ignores formatting and the +44 prefix (0 if none)"""
+    digits = _PHONE_NOISE.sub('', phone or '')
+    if digits.startswith('44'):
+        digits = '0' + digits[2:]
+    return int(digits[-10:]) if len(digits) >= 9 else 0
+
+
+def _minhash(names):
+    """MINHASH_SIZE x len(names) signatures of the trigram sets of names"""
+    hashes, lengths = [], []
+    for name in names:
+        grams = trigrams(name)
+        hashes.extend(zlib.crc32(gram.encode('utf-8')) for gram in grams)
+        lengths.append(len(grams))
+    hashes = np.array(hashes, dtype='int64')
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype('int64')
+    rnd = np.random.default_rng(0)
+    multipliers = rnd.integers(1, _MERSENNE, MINHASH_SIZE)
+    increments = rnd.integers(0, _MERSENNE, MINHASH_SIZE)
+    signatures = np.empty((MINHASH_SIZE, len(names)), dtype='int64')
+    for k in range(MINHASH_SIZE):
+        signatures[k] = np.minimum.reduceat((hashes * multipliers[k] + increments[k]) % _MERSENNE, starts)
+    return signatures
+
+def _cross(first, first_len, second, second_len, same):
+    """Every (i, j) pair across pairs of index ranges; i < j when the ranges are the same"""
+    sizes = first_len * second_len
+    block = np.repeat(np.arange(len(sizes)), sizes)
+    k = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    i = first[block] + k // second_len[block]
+    j = second[block] + k % second_len[block]
+    if same:
+        keep = i < j
+        i, j = i[keep], j[keep]
+    return i, j
+
+def _batches(first, first_len, second, second_len):
+    """Split block pairs into runs of about BATCH_PAIRS candidate pairs"""
+    sizes = np.cumsum(first_len * second_len)
+    start = 0
+    while start < len(sizes):
+        done = sizes[start - 1] if start else 0
+        end = max(start + 1, int(np.searchsorted(sizes, done + BATCH_PAIRS, side='right')))
+        yield slice(start, end)
+        start = end
+
+def _blocks(keys):
+    """Positions sorted by a block key, with each block's key, start and length"""
+    order = np.argsort(keys, kind='stable')
+    unique, starts, lengths = np.unique(keys[order], return_index=True, return_counts=True)
+    return order, unique, starts, lengths
+
+
+class _Matcher:
+    """Pair checks shared by the grid and phone blocks"""
+
+    def __init__(self, store):
+        n = len(store)
+        self.addresses = store.addresses
+        self.latitude = np.asarray(store.latitude, dtype='float64')
+        self.longitude = np.asarray(store.longitude, dtype='float64')
+        self.located = np.isfinite(self.latitude) & np.isfinite(self.longitude)
+        mean_latitude = float(np.mean(self.latitude[self.located])) if self.located.any() else 0.0
+        self.y = self.latitude * METRES_PER_DEGREE
+        self.x = self.longitude * METRES_PER_DEGREE * math.cos(math.radians(mean_latitude))
+        self.phones = np.array([phone_key(store.phones[i]) for i in range(n)], dtype='int64')
+        _, inverse, sizes = np.unique(self.phones, return_inverse=True, return_counts=True)
+        self.phone_blocked = (self.phones != 0) & (sizes[inverse] <= MAX_PHONE_BLOCK)
+
+        normalised = {}
+        self.name_ids = np.array([normalised.setdefault(normalise_name(store.names[i]), len(normalised))
+                                  for i in range(n)], dtype='int64')
+        self.names = list(normalised)
+        self.signatures = _minhash(self.names) if n else np.zeros((MINHASH_SIZE, 0), dtype='int64')
+        self._similarities = {}
+        self.matches = []
+
+    def distance_m(self, i, j):
+        return np.hypot(self.x[i] - self.x[j], self.y[i] - self.y[j])
+
+    def similarity(self, a, b):
+        key = (a, b) if a < b else (b, a)
+        value = self._similarities.get(key)
+        if value is None:
+            value = self._similarities[key] = name_similarity(self.names[a], self.names[b])
+        return value
+
+    def check(self, i, j, threshold, rule):
+        """Record pairs (i, j) whose names are at least threshold alike"""
+        a, b = self.name_ids[i], self.name_ids[j]
+        agree = np.zeros(len(a), dtype='int16')
+        for signature in self.signatures:
+            agree += signature[a] == signature[b]
+        candidates = np.flatnonzero((a == b) | (agree >= (threshold - MINHASH_SLACK) * MINHASH_SIZE))
+        distance = self.distance_m(i[candidates], j[candidates])
+        for n, d in zip(candidates.tolist(), distance.tolist()):
+            similarity = 1.0 if a[n] == b[n] else self.similarity(int(a[n]), int(b[n]))
+            if similarity < threshold:
+                continue
+            address, other = self.addresses[i[n]], self.addresses[j[n]]
+            if not address or not other or address_similarity(address, other) >= ADDRESS_SIMILARITY:
+                self.matches.append((int(i[n]), int(j[n]), None if d != d else round(d, 1),
+                                     round(similarity, 3), rule))
+
+    def nearby(self):
+        """Pairs within MATCH_RADIUS_M, blocked by grid cell"""
+        located = np.flatnonzero(self.located)
+        if not len(located):
+            return
+        cx = np.floor(self.x[located] / MATCH_RADIUS_M).astype('int64')
+        cy = np.floor(self.y[located] / MATCH_RADIUS_M).astype('int64')
+        width = int(cx.max() - cx.min()) + 3
+        keys = (cy - cy.min()) * width + (cx - cx.min() + 1)
+        order, cells, starts, lengths = _blocks(keys)
+        positions = located[order]
+        # Each cell meets itself and the neighbours after it, so every pair is seen once
+        for dx, dy in ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+            slots = np.searchsorted(cells, cells + dy * width + dx)
+            found = slots < len(cells)
+            found[found] &= cells[slots[found]] == cells[found] + dy * width + dx
+            first, first_len = starts[found], lengths[found]
+            second, second_len = starts[slots[found]], lengths[slots[found]]
+            for batch in _batches(first, first_len, second, second_len):
+                i, j = _cross(first[batch], first_len[batch], second[batch], second_len[batch],
+                              dx == 0 and dy == 0)
+                i, j = positions[i], positions[j]
+                close = self.distance_m(i, j) <= MATCH_RADIUS_M
+                # Different phone numbers mean different places; a shared one
+                # is judged by the phone rule unless it's a booking line
+                pi, pj = self.phones[i], self.phones[j]
+                close &= (pi == 0) | (pj == 0) | ((pi == pj) & ~self.phone_blocked[i])
+                self.check(i[close], j[close], NAME_SIMILARITY, 'nearby')
+
+    def same_phone(self):
+        """Pairs sharing a phone number, within PHONE_RADIUS_M when both have coordinates"""
+        listed = np.flatnonzero(self.phone_blocked)
+        order, _, starts, lengths = _blocks(self.phones[listed])
+        shared = lengths > 1
+        starts, lengths = starts[shared], lengths[shared]
+        positions = listed[order]
+        for batch in _batches(starts, lengths, starts, lengths):
+            i, j = _cross(starts[batch], lengths[batch], starts[batch], lengths[batch], True)
+            i, j = positions[i], positions[j]
+            both = self.located[i] & self.located[j]
+            keep = ~both | (self.distance_m(i, j) <= PHONE_RADIUS_M)
+            self.check(i[keep], j[keep], PHONE_NAME_SIMILARITY, 'phone')
+
+
+def find_matches(store):
+    """Likely duplicate pairs in a store as (i, j, distance_m, similarity, rule)
+
+    distance_m is None when either restaurant has no coordinates; rule is
+    'nearby' or 'phone'.
+    """
+    matcher = _Matcher(store)
+    matcher.nearby()
+    matcher.same_phone()
+    return matcher.matches
+
+def group_duplicates(store, matches):
+    """{kept position: [duplicate positions]}, keeping the best-scored restaurant of each group
+
+    Ties on score keep the earlier position.
+    """
+    parent = {}
+
+    def root(p):
+        while parent.get(p, p) != p:
+            parent[p] = parent.get(parent[p], parent[p])
+            p = parent[p]
+        return p
+
+    for i, j, _, _, _ in matches:
+        a, b = root(i), root(j)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+    members = {}
+    for p in parent:
+        members.setdefault(root(p), set()).update((p, root(p)))
+
+    score = store.score
+    groups = {}
+    for group in members.values():
+        kept = min(group, key=lambda p: (-score[p], p))
+        groups[kept] = sorted(group - {kept})
+    return dict(sorted(groups.items()))
+
+def find_duplicates(store):
+    """Duplicate groups of a store (see group_duplicates) and the matches behind them"""
+    matches = find_matches(store)
+    return group_duplicates(store, matches), matches
+
+
+def _synthetic_store(count, duplicates, seed=42):
+    """A store of mostly distinct restaurants with planted near-duplicates
+
+    Returns (store, planted) where planted maps each copy's position to the
+    position of its original.
+    """
+    import random
+    from store import RestaurantStoreBuilder
+
+    rnd = random.Random(seed)
+    syllables = ['ka', 'lo', 'mi', 'ra', 'to', 'ne', 'su', 'ba', 'di', 'fe', 'go', 'hu', 'ji', 'pa',
+                 'ze', 'vo', 'ri', 'sha', 'quin', 'mar', 'tel', 'dor']
+    kinds = ['Kitchen', 'Grill', 'House', 'Bistro', 'Canteen', 'Dining', 'Table', 'Deli', 'Bar']
+    centres = [(51.513, -0.131), (51.539, -0.142), (51.524, -0.078), (51.462, -0.115)]
+    builder = RestaurantStoreBuilder()
+    originals = []
+
+    def add(name, lat, lon, phone, address, score):
+        builder.append({'id': len(builder), 'name': name, 'cuisines': ['Restaurant'], 'city': 'London',
+                        'rating': 4.0, 'reviews': 10, 'score': score, 'latitude': lat,
+                        'longitude': lon, 'phone': phone, 'address': address})
+
+    streets = ['High Street', 'Church Street', 'Station Road', 'Market Place', 'King Street',
+               'Mill Lane', 'Park Road', 'Victoria Street', 'Green Lane', 'Broadway']
+    for _ in range(count - duplicates):
+        name = ''.join(rnd.choice(syllables) for _ in range(rnd.randint(2, 4))).capitalize()
+        name = f"{name} {rnd.choice(kinds)}"
+        lat, lon = rnd.choice(centres)
+        lat, lon = rnd.gauss(lat, 0.02), rnd.gauss(lon, 0.03)
+        phone = f"+44 20 {rnd.randint(7000, 8999)} {rnd.randint(1000, 9999)}" if rnd.random() < 0.8 else ''
+        address = (f"{rnd.randint(1, 400)} {rnd.choice(streets)}, London "
+                   f"{rnd.choice('ENSW')}{rnd.randint(1, 20)} {rnd.randint(1, 9)}{rnd.choice('ABDEFGHJ')}"
+                   f"{rnd.choice('LNPQRSTU')}") if rnd.random() < 0.9 else ''
+        originals.append((name, lat, lon, phone, address))
+        add(name, lat, lon, phone, address, rnd.random())
+
+    planted = {}
+    for _ in range(duplicates):
+        original = rnd.randrange(len(originals))
+        name, lat, lon, phone, address = originals[original]
+        variant = rnd.random()
+        if variant < 0.3:
+            name = f"The {name}"
+        elif variant < 0.6:
+            at = rnd.randrange(len(name))
+            name = name[:at] + name[at + 1:]
+        elif variant < 0.8:
+            name = f"{name} Restaurant"
+        # Geocoded a few metres apart, with the phone written differently or missing
+        lat += rnd.gauss(0, 0.0001)
+        lon += rnd.gauss(0, 0.00015)
+        phone = phone.replace(' ', '').replace('+44', '0') if rnd.random() < 0.7 else ''
+        # ...and the address abbreviated, without its postcode, or missing
+        variant = rnd.random()
+        if variant < 0.3:
+            address = address.replace('Street', 'St').replace('Road', 'Rd').replace('Lane', 'Ln')
+        elif variant < 0.5:
+            address = address.rsplit(' ', 2)[0]
+        elif variant < 0.6:
+            address = ''
+        planted[len(builder)] = original
+        add(name, lat, lon, phone, address, rnd.random())
+    return builder.build(), planted
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    duplicates = count // 50
+    started = time.perf_counter()
+    store, planted = _synthetic_store(count, duplicates)
+    print(f"{count} restaurants with {duplicates} planted duplicates, "
+          f"generated in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    groups, matches = find_duplicates(store)
+    elapsed = time.perf_counter() - started
+    found = {p for dropped in groups.values() for p in dropped}
+    rules = {}
+    for *_, rule in matches:
+        rules[rule] = rules.get(rule, 0) + 1
+
+    # A dropped restaurant is right when it and the one kept in its place are
+    # the same planted venue
+    truth = {p: planted.get(p, p) for p in found | set(groups)}
+    correct = sum(1 for kept, dropped in groups.items() for p in dropped if truth[p] == truth[kept])
+    print(f"found {len(matches)} matching pairs ({rules}) in {len(groups)} groups in {elapsed:.1f}s")
+    print(f"dropped {len(found)}: recall {correct / max(1, len(planted)):.1%}, "
+          f"precision {correct / max(1, len(found)):.1%}")
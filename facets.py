@@ -0,0 +1,164 @@
+"""
+Faceted filtering of restaurant listings
+Cuisine, neighbourhood and neighbourhood+cuisine facets are the score-ordered
+posting lists from build_indexes, so combining them never needs an
+intersection. The numeric facets (minimum rating, minimum review count,
+Julan's Pick) are folded into one small level code per restaurant: a filtered
+listing walks the most specific posting list checking one table lookup per
+restaurant, and facet counts come from a histogram of a list's codes that is
+computed once per list and cached. The same pass keeps running per-code
+counts every BLOCK entries, so a deep filtered page is found by binary
+search and a walk of at most one block. The codes can be stored in a
+snapshot and used straight from the mapped file.
+"""
+from array import array
+from bisect import bisect_right
+from itertools import islice
+
+# Thresholds offered as filters; every combination is countable from a histogram
+RATING_STEPS = (4.0, 4.5)
+REVIEW_STEPS = (100, 500, 1000)
+
+_RATING_LEVELS = len(RATING_STEPS) + 1
+_REVIEW_LEVELS = len(REVIEW_STEPS) + 1
+_CODES = _RATING_LEVELS * _REVIEW_LEVELS * 2
+
+# Posting list entries between checkpoints of running per-code counts
+BLOCK = 256
+
+
+def _code(rating_level, review_level, pick):
+    return rating_level + _RATING_LEVELS * (review_level + _REVIEW_LEVELS * pick)
+
+
+def level_code(rating, reviews, pick):
+    """Level code of a restaurant's rating, review count and Julan's Pick flag"""
+    return _code(bisect_right(RATING_STEPS, rating), bisect_right(REVIEW_STEPS, reviews), int(pick))
+
+
+def parse_filters(args):
+    """Recognised filters from query args, e.g. {'rating': 4.5, 'pick': True}
+
+    Values that are not one of the offered steps are ignored, so every
+    filtered page is one whose counts are precomputable.
+    """
+    filters = {}
+    try:
+        rating = float(args.get('rating', ''))
+        if rating in RATING_STEPS:
+            filters['rating'] = rating
+    except ValueError:
+        pass
+    try:
+        reviews = int(args.get('reviews', ''))
+        if reviews in REVIEW_STEPS:
+            filters['reviews'] = reviews
+    except ValueError:
+        pass
+    if args.get('pick') in ('1', 'true', 'yes'):
+        filters['pick'] = True
+    return filters
+
+def filter_query(filters):
+    """Canonical query string for a set of filters ('' when there are none)"""
+    parts = []
+    if 'pick' in filters:
+        parts.append('pick=1')
+    if 'rating' in filters:
+        parts.append(f"rating={filters['rating']:g}")
+    if 'reviews' in filters:
+        parts.append(f"reviews={filters['reviews']}")
+    return '?' + '&'.join(parts) if parts else ''
+
+
+class FacetIndex:
+    """Level codes for the numeric facets of every restaurant in a store"""
+
+    def __init__(self, store, codes=None):
+        if codes is None:
+            codes = array('B', (level_code(rating, reviews, pick)
+                                for rating, reviews, pick in zip(store.rating, store.reviews, store.julans_pick)))
+        self.codes = codes
+        self._histograms = {}
+
+    def sections(self):
+        """(name, typecode, data) sections for a binary snapshot"""
+        return [('facets.codes', 'B', self.codes)]
+
+    @classmethod
+    def from_sections(cls, store, sections):
+        return cls(store, sections['facets.codes'])
+
+    @staticmethod
+    def allowed(filters):
+        """Which level codes satisfy the filters, as a lookup table"""
+        min_rating = bisect_right(RATING_STEPS, filters['rating']) if 'rating' in filters else 0
+        min_reviews = bisect_right(REVIEW_STEPS, filters['reviews']) if 'reviews' in filters else 0
+        table = bytearray(_CODES)
+        for pick in ((1,) if filters.get('pick') else (0, 1)):
+            for review_level in range(min_reviews, _REVIEW_LEVELS):
+                for rating_level in range(min_rating, _RATING_LEVELS):
+                    table[_code(rating_level, review_level, pick)] = 1
+        return table
+
+    def iter_matches(self, ids, filters, begin=0):
+        """Positions from a posting list that pass the filters, in list order
+
+        begin skips that many list entries without copying the list.
+        """
+        if begin:
+            ids = memoryview(ids)[begin:]
+        if not filters:
+            return iter(ids)
+        table = self.allowed(filters)
+        codes = self.codes
+        return (i for i in ids if table[codes[i]])
+
+    def page(self, ids, filters, start, count, key=None):
+        """count positions from start of a filtered posting list
+
+        With key (see count()), the list's checkpoints locate the block that
+        holds the start-th match instead of walking every entry before it.
+        """
+        begin = 0
+        if filters and key is not None and start:
+            begin, start = self._locate(key, ids, self.allowed(filters), start)
+        return list(islice(self.iter_matches(ids, filters, begin), start, start + count))
+
+    def _summary(self, key, ids):
+        """(histogram, checkpoints) of a posting list's codes, computed once per list
+
+        checkpoints holds the running per-code counts before every BLOCK-th
+        entry, _CODES values per checkpoint.
+        """
+        summary = self._histograms.get(key)
+        if summary is None:
+            histogram = array('q', bytes(8 * _CODES))
+            checkpoints = array('q')
+            codes = self.codes
+            for n, i in enumerate(ids):
+                if n % BLOCK == 0:
+                    checkpoints.extend(histogram)
+                histogram[codes[i]] += 1
+            summary = self._histograms[key] = (histogram, checkpoints)
+        return summary
+
+    def _locate(self, key, ids, table, start):
+        """(list index, matches left to skip) of the block holding the start-th match"""
+        checkpoints = self._summary(key, ids)[1]
+        allowed = [code for code in range(_CODES) if table[code]]
+
+        def matches_before(block):
+            base = block * _CODES
+            return sum(checkpoints[base + code] for code in allowed)
+
+        block = bisect_right(range(len(checkpoints) // _CODES), start, key=matches_before) - 1
+        return block * BLOCK, start - matches_before(block)
+
+    def count(self, key, ids, filters):
+        """Size of a filtered posting list; key identifies the list for caching"""
+        if not filters:
+            return len(ids)
+        histogram = self._summary(key, ids)[0]
+        table = self.allowed(filters)
+        return sum(n for code, n in enumerate(histogram) if table[code])
@@ -0,0 +1,65 @@
+"""
+Rendering helpers for listing pages
+A restaurant card (its markup, plus JSON-LD for the first cards of the
+homepage) only depends on the restaurant and the data snapshot, so the app
+renders each card once per snapshot into a VersionedCache and assembles
+listing pages from those fragments. The pagination bar's page links are
+worked out here, visiting only the handful of pages it shows rather than
+looping over every page number in the template.
+
+Usage: python fragments.py   (check page_links against the full scan it replaced)
+"""
+
+
+def page_links(current_page, total_pages, base_url, query=''):
+    """Entries of a pagination bar as (kind, page number, url) tuples
+
+    kind is 'active' for the current page, 'link' or 'ellipsis'. The bar
+    shows the first and last three pages and the pages next to the current
+    one, with an ellipsis for a gap at either end. Page 1 is base_url itself
+    ('/' when base_url is empty); page n is base_url/page/n. query is
+    appended to every url.
+    """
+    candidates = {1, 2, 3, 4, current_page - 1, current_page, current_page + 1,
+                  total_pages - 3, total_pages - 2, total_pages - 1, total_pages}
+    links = []
+    for n in sorted(candidates):
+        if n < 1 or n > total_pages:
+            continue
+        if n == current_page:
+            links.append(('active', n, None))
+        elif n == 1:
+            links.append(('link', n, (base_url or '/') + query))
+        elif n <= 3 or n > total_pages - 3 or current_page - 1 <= n <= current_page + 1:
+            links.append(('link', n, f'{base_url}/page/{n}{query}'))
+        elif (n == 4 and current_page > 5) or (n == total_pages - 3 and current_page < total_pages - 4):
+            links.append(('ellipsis', n, None))
+    return links
+
+
+def _scan_page_links(current_page, total_pages, base_url, query=''):
+    """The template loop page_links replaced, over every page number"""
+    links = []
+    for n in range(1, total_pages + 1):
+        if n == 1:
+            if current_page == 1:
+                links.append(('active', n, None))
+            else:
+                links.append(('link', n, (base_url or '/') + query))
+        elif n == current_page:
+            links.append(('active', n, None))
+        elif n <= 3 or n > total_pages - 3 or (current_page - 1 <= n <= current_page + 1):
+            links.append(('link', n, f'{base_url}/page/{n}{query}'))
+        elif n == 4 and current_page > 5:
+            links.append(('ellipsis', n, None))
+        elif n == total_pages - 3 and current_page < total_pages - 4:
+            links.append(('ellipsis', n, None))
+    return links
+
+
+if __name__ == '__main__':
+    for total in range(0, 40):
+        for current in range(0, total + 3):
+            assert page_links(current, total, '/cuisine/thai', '?pick=1') == \
+                _scan_page_links(current, total, '/cuisine/thai', '?pick=1'), (current, total)
+    print("page_links matches the full scan for every page of up to 40 pages")
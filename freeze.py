@@ -0,0 +1,235 @@
+"""
+Pre-render ("freeze") every page of the site to static HTML files
+
+Usage: python freeze.py [--out build] [--workers N] [--force] [--hybrid]
+
+Pages are rendered through the Flask app in a process pool, one worker per
+core by default. A manifest of per-page input digests is kept in the output
+directory, so a rebuild after a data refresh only re-renders the pages whose
+inputs changed and deletes pages that no longer exist.
+
+The output directory mirrors the URL structure (/cuisine/indian ->
+cuisine/indian/index.html) and includes static/, so it can be served by any
+static host or CDN without running Python. Pages rendered that way leave out
+the search box, typeahead, near-me link and filter pills, which need the app.
+With --hybrid they are kept, for a deploy that still routes /search, /near,
+/api/* and filtered (?rating=, ?reviews=, ?pick=) URLs to the Flask app.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import app as site
+
+PER_PAGE = 12
+MANIFEST_FILE = '.freeze-manifest.json'
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# Paths rendered per task sent to a worker
+BATCH_SIZE = 200
+
+
+def _pages(total):
+    return max(1, (total + PER_PAGE - 1) // PER_PAGE)
+
+def _paginated(base, total):
+    """A listing's first page and its /page/<n> continuations"""
+    yield base or '/', 0
+    for page in range(2, _pages(total) + 1):
+        yield f'{base}/page/{page}', (page - 1) * PER_PAGE
+
+def _top(ranking, n=None):
+    ranked = ranking.top(n) if n else ranking.ranked
+    return [(slug, dict(data)) for slug, data in ranked]
+
+
+class PageInputs:
+    """Computes, for every route, a digest of the data the page is rendered from"""
+
+    def __init__(self, hybrid=False):
+        self._rows = {}
+        self.templates = self._templates_digest()
+        catalog = site.get_catalog()
+        # Every page carries the footer's top-10 lists, and the app's controls only when hybrid
+        self.chrome = self._digest(self.templates, hybrid,
+                                   [(s, d['name']) for s, d in _top(catalog.cuisines, 10)],
+                                   [(s, d['name']) for s, d in _top(catalog.neighbourhoods, 10)])
+        self.neighbourhood_pills = {
+            slug: [(c_slug, site.cuisines_dict.get(c_slug, {}).get('name'))
+                   for c_slug, _ in site.get_neighbourhood_cuisines(slug)[:20]]
+            for slug in site.neighbourhoods_dict}
+
+    @staticmethod
+    def _templates_digest():
+        digest = hashlib.sha1()
+        for name in sorted(os.listdir(TEMPLATES_DIR)):
+            with open(os.path.join(TEMPLATES_DIR, name), 'rb') as f:
+                digest.update(name.encode('utf-8') + f.read())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _digest(*parts):
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def _row(self, position):
+        digest = self._rows.get(position)
+        if digest is None:
+            digest = self._rows[position] = self._digest(site.restaurants_data[position].to_dict())
+        return digest
+
+    def listing(self, ids, start, *context):
+        """Digest of one page of a listing plus whatever else the page shows"""
+        rows = [self._row(i) for i in ids[start:start + PER_PAGE]]
+        return self._digest(self.chrome, len(ids), rows, context)
+
+    def routes(self):
+        """Yield (path, digest) for every page the app serves"""
+        cuisines = site.cuisines_dict
+        neighbourhoods = site.neighbourhoods_dict
+        catalog = site.get_catalog()
+        top_cuisines = [(s, d['name']) for s, d in _top(catalog.cuisines, 20)]
+        top_neighbourhoods = [(s, d['name'], d['count']) for s, d in _top(catalog.neighbourhoods, 12)]
+
+        for path, start in _paginated('', len(site.score_order)):
+            yield path, self.listing(site.score_order, start, top_cuisines, top_neighbourhoods)
+
+        yield '/cuisines', self._digest(self.chrome, _top(catalog.cuisines))
+        yield '/neighbourhoods', self._digest(self.chrome, _top(catalog.neighbourhoods))
+        yield '/about', self._digest(self.chrome)
+
+        for slug, data in cuisines.items():
+            ids = site.cuisine_index.get(slug, [])
+            facets = site.facet_pills(f'/cuisine/{slug}', ('cuisine', slug), ids, {})
+            for path, start in _paginated(f'/cuisine/{slug}', len(ids)):
+                yield path, self.listing(ids, start, data['name'], top_cuisines, facets)
+
+        for slug, data in neighbourhoods.items():
+            pills = self.neighbourhood_pills.get(slug, [])
+            ids = site.neighbourhood_index.get(slug, [])
+            facets = site.facet_pills(f'/neighbourhood/{slug}', ('neighbourhood', slug), ids, {})
+            for path, start in _paginated(f'/neighbourhood/{slug}', len(ids)):
+                yield path, self.listing(ids, start, data['name'], pills, facets)
+
+        # Combination pages, the same set the sitemap lists
+        for slug, c_slug in sorted(site.neighbourhood_cuisine_index.keys()):
+            if slug in neighbourhoods and c_slug in cuisines:
+                pills = self.neighbourhood_pills.get(slug, [])
+                ids = site.neighbourhood_cuisine_index.get((slug, c_slug), [])
+                base = f'/neighbourhood/{slug}/cuisine/{c_slug}'
+                facets = site.facet_pills(base, ('pair', slug, c_slug), ids, {})
+                for path, start in _paginated(base, len(ids)):
+                    yield path, self.listing(ids, start, neighbourhoods[slug]['name'],
+                                             cuisines[c_slug]['name'], pills, facets)
+
+        # Restaurant pages show the restaurant and its recommendations
+        similar = site.dataset.similar
+        for position in site.score_order:
+            rows = [self._row(p) for p in similar.get(position)]
+            yield f'/restaurant/{site.restaurants_data.ids[position]}', self._digest(
+                self.chrome, self._row(position), rows)
+
+        sitemap = site.get_sitemap()
+        yield '/sitemap.xml', self._digest(sitemap.updated_at.date(), sitemap.shard_count)
+        for n in range(1, sitemap.shard_count + 1):
+            yield f'/sitemap-{n}.xml', self._digest(sitemap.shard(n))
+
+
+def output_file(out_dir, path):
+    """File a URL path is written to"""
+    if path.endswith('.xml'):
+        return os.path.join(out_dir, path.lstrip('/'))
+    return os.path.join(out_dir, path.strip('/'), 'index.html')
+
+
+def _init_worker(hybrid):
+    # Pages are written once, so there is no point filling the in-process page cache
+    site.page_cache.max_bytes = 0
+    site.app.jinja_env.globals['static_site'] = not hybrid
+
+def _write_if_changed(target, body):
+    # Overwriting a file forces a flush on most filesystems, and an unchanged
+    # mtime keeps sync tools and CDN uploads from re-sending the page
+    if os.path.exists(target):
+        with open(target, 'rb') as f:
+            if f.read() == body:
+                return
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(body)
+
+def render_batch(paths, out_dir):
+    """Render paths through the app and write them; returns paths that failed"""
+    client = site.app.test_client()
+    failed = []
+    for path in paths:
+        response = client.get(path)
+        if response.status_code != 200:
+            failed.append((path, response.status_code))
+            continue
+        _write_if_changed(output_file(out_dir, path), response.get_data())
+    return failed
+
+
+def freeze(out_dir, workers=None, force=False, hybrid=False):
+    """Render every changed page into out_dir; returns (rendered, removed, failed)
+
+    hybrid keeps the controls that need the app (see the module docstring).
+    """
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    manifest = {}
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    digests = dict(PageInputs(hybrid).routes())
+    todo = [path for path, digest in digests.items()
+            if manifest.get(path) != digest or not os.path.exists(output_file(out_dir, path))]
+
+    removed = [path for path in manifest if path not in digests]
+    for path in removed:
+        target = output_file(out_dir, path)
+        if os.path.exists(target):
+            os.remove(target)
+
+    failed = []
+    batches = [todo[i:i + BATCH_SIZE] for i in range(0, len(todo), BATCH_SIZE)]
+    if batches:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(hybrid,)) as pool:
+            for result in pool.map(render_batch, batches, [out_dir] * len(batches)):
+                failed.extend(result)
+
+    # Failed pages stay out of the manifest so the next run retries them
+    failed_paths = {path for path, _ in failed}
+    manifest = {path: digest for path, digest in digests.items() if path not in failed_paths}
+    os.makedirs(out_dir, exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+
+    shutil.copytree(STATIC_DIR, os.path.join(out_dir, 'static'), dirs_exist_ok=True)
+    return todo, removed, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pre-render the site to static HTML")
+    parser.add_argument('--out', default='build', help="output directory (default: build)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--force', action='store_true', help="re-render every page")
+    parser.add_argument('--hybrid', action='store_true',
+                        help="keep search, near-me and filter controls for a deploy that routes them to the app")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rendered, removed, failed = freeze(args.out, args.workers, args.force, args.hybrid)
+    print(f"Rendered {len(rendered)} pages, removed {len(removed)}, "
+          f"{len(failed)} failed in {time.perf_counter() - started:.1f}s")
+    for path, status in failed[:20]:
+        print(f"  {status} {path}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,328 @@
+"""
+Incremental rebuilds of processed data
+Every export row is fingerprinted. Rows whose fingerprint matches the last
+build reuse their processed record; only new or changed rows go through
+build_record. Cuisine/neighbourhood counts and the Julan's Pick ranking are
+patched with the delta instead of being recomputed, and the delta itself is
+written to a change manifest. The posting lists and facet codes are patched
+from the last snapshot too (patch_indexes). The search, spatial and
+similar-restaurant indexes, processed_data.json and the snapshot are still
+built and written in full, so a run is proportional to the delta in
+processing but not in output. When the full build dropped
+duplicates, the dropped rows are remembered and stay out, and new or changed
+rows are screened against the restaurants around them.
+"""
+import hashlib
+import json
+import math
+import os
+from array import array
+from datetime import datetime, timezone
+from heapq import merge
+
+import numpy as np
+
+from facets import FacetIndex, level_code
+from ingest import read_chunks, build_record, slugify, count_into, uncount_from, pick_count
+
+STATE_FILE = 'processed_state.json'
+CHANGES_FILE = 'processed_changes.json'
+
+# Export columns that feed a processed record; a change to any of them reprocesses the row
+SOURCE_COLUMNS = ('name', 'subtypes', 'city', 'rating', 'reviews', 'full_address', 'street',
+                  'phone', 'phone_1', 'site', 'photo', 'latitude', 'longitude')
+
+# Stable identifiers in Outscraper exports, in order of preference
+KEY_COLUMNS = ('place_id', 'google_id')
+
+
+def row_key(row):
+    """Identity of an export row that survives re-exports"""
+    for column in KEY_COLUMNS:
+        value = row.get(column)
+        if value is not None and value == value and str(value):
+            return str(value)
+    return f"{row.get('name')}|{row.get('full_address')}"
+
+def row_fingerprint(row):
+    """Digest of the values a processed record is built from"""
+    values = '\x1f'.join(str(row.get(column)) for column in SOURCE_COLUMNS)
+    return hashlib.blake2b(values.encode('utf-8'), digest_size=12).hexdigest()
+
+def iter_source_rows(path):
+    """Yield (position, key, fingerprint, row) for every row of an export"""
+    seen = {}
+    for chunk in read_chunks(path):
+        for position, row in zip(chunk.index, chunk.to_dict('records')):
+            key = row_key(row)
+            # Keep repeated keys distinct so no row is silently dropped
+            seen[key] = seen.get(key, 0) + 1
+            if seen[key] > 1:
+                key = f"{key}#{seen[key]}"
+            yield int(position), key, row_fingerprint(row), row
+
+def build_state(path, duplicates=None):
+    """Fingerprint state for a full build, where ids are export row positions
+
+    duplicates is the build's drop_duplicates report when duplicates were
+    looked for; the ids it dropped are kept so later runs leave them out.
+    """
+    rows = {key: [fingerprint, position] for position, key, fingerprint, _ in iter_source_rows(path)}
+    state = {'rows': rows, 'next_id': len(rows)}
+    if duplicates is not None:
+        state['dedup'] = True
+        state['dropped'] = sorted(entry['id'] for group in duplicates['groups'] for entry in group['dropped'])
+    return state
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(path, state):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, separators=(',', ':'))
+
+
+def _apply_counts(record, cuisines, neighbourhoods, deltas, sign):
+    for cuisine in record['cuisines']:
+        slug = slugify(cuisine)
+        if not slug:
+            continue
+        if sign > 0:
+            count_into(cuisines, slug, cuisine)
+        else:
+            uncount_from(cuisines, slug)
+        deltas['cuisines'][slug] = deltas['cuisines'].get(slug, 0) + sign
+    slug = slugify(record['city'])
+    if slug:
+        if sign > 0:
+            count_into(neighbourhoods, slug, record['city'])
+        else:
+            uncount_from(neighbourhoods, slug)
+        deltas['neighbourhoods'][slug] = deltas['neighbourhoods'].get(slug, 0) + sign
+
+
+def _screen_duplicates(records, fresh):
+    """Ids to drop so that fresh records and the records around them hold no duplicates
+
+    Only fresh records and the records near one (within a PHONE_RADIUS_M
+    cell of it) or sharing its phone number are compared, with the rules of
+    a full build (see dedup.py); each group keeps its best-scored record.
+    """
+    from dedup import METRES_PER_DEGREE, PHONE_RADIUS_M, find_duplicates, phone_key
+    from store import RestaurantStore
+
+    step = PHONE_RADIUS_M / METRES_PER_DEGREE
+
+    def cell(record):
+        lat, lon = record['latitude'], record['longitude']
+        if lat is None or lon is None or lat != lat or lon != lon:
+            return None
+        return math.floor(lat / step), math.floor(lon * math.cos(math.radians(lat)) / step)
+
+    cells, phones = set(), set()
+    for record in fresh.values():
+        key = cell(record)
+        if key is not None:
+            cells.update((key[0] + dy, key[1] + dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1))
+        phones.add(phone_key(record['phone']))
+    phones.discard(0)
+
+    candidates = list(fresh.values())
+    for record_id, record in records.items():
+        if record_id not in fresh and (cell(record) in cells or
+                                       (phones and phone_key(record['phone']) in phones)):
+            candidates.append(record)
+    if len(candidates) < 2:
+        return set()
+    # Best-first, so ties on score keep the earlier id as a full build does
+    candidates.sort(key=lambda record: (-record['score'], record['id']))
+    store = RestaurantStore.from_records(candidates)
+    groups, _ = find_duplicates(store)
+
+    dropped = set()
+    for kept, duplicates in groups.items():
+        group = [store.ids[position] for position in [kept] + duplicates]
+        if any(record_id in fresh for record_id in group):
+            dropped.update(store.ids[position] for position in duplicates)
+    return dropped
+
+
+def incremental_rebuild(source_path, previous_records, cuisines, neighbourhoods, state):
+    """Bring processed data up to date with an export, touching only what changed
+
+    previous_records are the records of the last build, best-first, and state
+    is the fingerprint state saved with it. Returns (records, cuisines,
+    neighbourhoods, state, changes); the count dicts are patched in place.
+    """
+    records = {record['id']: record for record in previous_records}
+    rows = state['rows']
+    next_id = state['next_id']
+    dedup = state.get('dedup', False)
+    dropped = set(state.get('dropped', ()))
+
+    added, changed, unchanged = [], [], 0
+    fresh = {}
+    seen = set()
+    for _, key, fingerprint, row in iter_source_rows(source_path):
+        seen.add(key)
+        entry = rows.get(key)
+        if entry is not None and (entry[1] in records or entry[1] in dropped):
+            if entry[0] == fingerprint:
+                unchanged += 1
+                continue
+            record_id = entry[1]
+            # A dropped duplicate that changed is screened again like a new row
+            if record_id in dropped:
+                dropped.discard(record_id)
+                added.append(key)
+            else:
+                changed.append(key)
+        else:
+            record_id = next_id
+            next_id += 1
+            added.append(key)
+        fresh[record_id] = build_record(record_id, row)
+        rows[key] = [fingerprint, record_id]
+
+    removed = [key for key in rows if key not in seen]
+
+    picks_before = {record['id'] for record in previous_records if record['julans_pick']}
+    deltas = {'cuisines': {}, 'neighbourhoods': {}}
+
+    for key in removed:
+        record_id = rows.pop(key)[1]
+        dropped.discard(record_id)
+        old = records.pop(record_id, None)
+        if old is not None:
+            _apply_counts(old, cuisines, neighbourhoods, deltas, -1)
+
+    # Fresh rows may duplicate a restaurant already listed, or be the better listing of one
+    duplicates = _screen_duplicates(records, fresh) if dedup and fresh else set()
+    for record_id in duplicates:
+        fresh.pop(record_id, None)
+        old = records.pop(record_id, None)
+        if old is not None:
+            _apply_counts(old, cuisines, neighbourhoods, deltas, -1)
+    dropped |= duplicates
+
+    for record_id, record in fresh.items():
+        old = records.get(record_id)
+        if old is not None:
+            _apply_counts(old, cuisines, neighbourhoods, deltas, -1)
+        records[record_id] = record
+        _apply_counts(record, cuisines, neighbourhoods, deltas, +1)
+
+    # Ranking of (-score, id): ascending order is best-first, ties by export position.
+    # previous_records are already in that order, so the untouched ones are kept as
+    # they are and the sorted fresh records are merged in with them in one pass
+    kept = ((-record['score'], record['id']) for record in previous_records
+            if record['id'] in records and record['id'] not in fresh)
+    ranking = list(merge(kept, sorted((-record['score'], record_id) for record_id, record in fresh.items())))
+
+    # Only records whose badge flips, or that were rebuilt, are updated
+    picks_after = {record_id for _, record_id in ranking[:pick_count(len(ranking))]}
+    for record_id in (picks_before ^ picks_after) | fresh.keys():
+        if record_id in records:
+            records[record_id]['julans_pick'] = record_id in picks_after
+
+    state = {'rows': rows, 'next_id': next_id}
+    if dedup:
+        state['dedup'] = True
+        state['dropped'] = sorted(dropped)
+    changes = {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'source': os.path.basename(source_path),
+        'unchanged': unchanged,
+        'added': [rows[key][1] for key in added if rows[key][1] not in duplicates],
+        'changed': [rows[key][1] for key in changed if rows[key][1] not in duplicates],
+        'removed': removed,
+        'duplicates_dropped': sorted(duplicates),
+        'picks_gained': sorted(picks_after - picks_before),
+        'picks_lost': sorted(picks_before - picks_after),
+        'cuisine_count_deltas': {k: v for k, v in deltas['cuisines'].items() if v},
+        'neighbourhood_count_deltas': {k: v for k, v in deltas['neighbourhoods'].items() if v},
+    }
+    return [records[record_id] for _, record_id in ranking], cuisines, neighbourhoods, state, changes
+
+
+def _slugs(store, position):
+    """Neighbourhood slug and distinct cuisine slugs of a restaurant, as posting_indexes reads them"""
+    city_slug = slugify(store.cities[store.city_codes[position]])
+    names = (store.cuisine_names[code] for code in store.cuisine_codes_at(position))
+    return city_slug, list(dict.fromkeys(slug for slug in map(slugify, names) if slug))
+
+def patch_indexes(snapshot, store, changes):
+    """Posting lists and facet codes of store, patched from the last build's snapshot
+
+    snapshot is load_snapshot() of the build incremental_rebuild patched,
+    store holds the records it returned (best-first) and changes is its
+    change manifest. Untouched restaurants keep their entries, moved to
+    their new positions; only added and changed rows are slugged, and only
+    they and restaurants whose Julan's Pick flipped are coded again.
+    Returns (indexes, facets), identical to what posting_indexes and
+    FacetIndex build from scratch.
+    """
+    old_ids = np.asarray(snapshot['restaurants'].ids, dtype='int64')
+    new_ids = np.asarray(store.ids, dtype='int64')
+    # Ids are export row numbers handed out from next_id, so a dense lookup stays small
+    lookup = np.full(max(old_ids.max(initial=-1), new_ids.max(initial=-1)) + 1, -1, dtype='int64')
+    lookup[new_ids] = np.arange(len(new_ids))
+
+    def positions_of(ids):
+        """New positions of the ids that are in store, and where they were found"""
+        ids = np.asarray(ids, dtype='int64')
+        positions = lookup[ids.clip(max=len(lookup) - 1)] if len(lookup) else np.full(len(ids), -1)
+        found = (ids < len(lookup)) & (positions >= 0)
+        return positions, found
+
+    # Old position -> new position, or -1 for rows removed, dropped or rebuilt
+    fresh_ids = changes['added'] + changes['changed']
+    moved, found = positions_of(old_ids)
+    remap = np.where(found & ~np.isin(old_ids, fresh_ids), moved, -1)
+    fresh = positions_of(fresh_ids)[0]
+
+    added = ({}, {}, {})
+    for position in fresh.tolist():
+        city_slug, cuisine_slugs = _slugs(store, position)
+        if city_slug:
+            added[1].setdefault(city_slug, []).append(position)
+        for cuisine_slug in cuisine_slugs:
+            added[0].setdefault(cuisine_slug, []).append(position)
+            if city_slug:
+                added[2].setdefault((city_slug, cuisine_slug), []).append(position)
+
+    def first_seen(item):
+        # posting_indexes adds keys in score order, and a restaurant's cuisines in listed order
+        key, ids = item
+        if isinstance(key, tuple):
+            key = key[1]
+        _, cuisine_slugs = _slugs(store, ids[0])
+        return ids[0], cuisine_slugs.index(key) if key in cuisine_slugs else 0
+
+    indexes = [array('i', range(len(store)))]
+    for name, additions in zip(('cuisine_index', 'neighbourhood_index', 'neighbourhood_cuisine_index'), added):
+        lists = {}
+        for key in dict.fromkeys([*snapshot[name], *additions]):
+            ids = remap[np.asarray(snapshot[name].get(key, ()), dtype='int64')]
+            ids = ids[ids >= 0]
+            if key in additions:
+                # Kept and fresh positions never overlap, so inserting keeps the list sorted
+                inserted = np.sort(additions[key])
+                ids = np.insert(ids, np.searchsorted(ids, inserted), inserted)
+            if len(ids):
+                lists[key] = array('i', ids.astype('int32').tobytes())
+        indexes.append(dict(sorted(lists.items(), key=first_seen)))
+
+    if snapshot['facets'] is None:
+        return tuple(indexes), FacetIndex(store)
+    kept = remap >= 0
+    codes = np.zeros(len(store), dtype='uint8')
+    codes[remap[kept]] = np.asarray(snapshot['facets'].codes)[kept]
+    flipped, found = positions_of(changes['picks_gained'] + changes['picks_lost'])
+    for position in set(fresh.tolist()) | set(flipped[found].tolist()):
+        codes[position] = level_code(store.rating[position], store.reviews[position], store.julans_pick[position])
+    return tuple(indexes), FacetIndex(store, array('B', codes.tobytes()))
@@ -0,0 +1,679 @@
+"""
+Turning a raw restaurant export into processed data
+Three interchangeable pipelines produce identical output:
+  - 'rows': the original row-by-row walk over the DataFrame
+  - 'vectorized': whole-column pandas string and numeric operations
+  - 'streaming': reads the export in chunks and never holds all of it in memory
+"""
+import heapq
+import os
+import re
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from slugs import slugify
+from store import RestaurantStore, RestaurantStoreBuilder, StringTable, parse_coordinate
+
+# Generic subtypes that don't describe a cuisine
+SKIP_TERMS = {'restaurant', 'bar', 'cafe', 'café', 'food', 'dining', 'establishment', 'grill'}
+
+# Suffixes stripped from a subtype, applied in this order
+SUFFIX_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r'\s+restaurant\s*$',
+    r'\s+takeaway\s*$',
+    r'\s+cafe\s*$',
+    r'\s+café\s*$',
+)]
+
+# Julan's Pick goes to the top 5% by score, capped at 500 restaurants
+PICK_SHARE = 20
+MAX_PICKS = 500
+
+# Which pipeline load_and_process_data uses for Excel input
+INGEST_MODE = os.environ.get('INGEST_MODE', 'vectorized')
+
+# Rows per chunk read by the streaming pipeline
+CHUNK_SIZE = int(os.environ.get('INGEST_CHUNK_SIZE', 10000))
+
+# Worker processes that ingest several exports at once (default: one per CPU)
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 0) or 0)
+
+# Whether to drop duplicate restaurants (see dedup.py): 'on', 'off', or
+# 'auto' to do so only when several exports are merged, as those overlap
+INGEST_DEDUP = os.environ.get('INGEST_DEDUP', 'auto')
+
+
+def extract_cuisines(subtypes_str):
+    """Extract cuisine types from subtypes string"""
+    if pd.isna(subtypes_str):
+        return ['Restaurant']
+
+    subtypes_str = str(subtypes_str)
+    parts = [p.strip() for p in subtypes_str.split(',')]
+
+    cuisines = []
+
+    for part in parts:
+        part_lower = part.lower()
+
+        # Skip generic terms
+        if part_lower in SKIP_TERMS:
+            continue
+
+        # Remove common suffixes
+        cuisine = part
+        for pattern in SUFFIX_PATTERNS:
+            cuisine = pattern.sub('', cuisine)
+        cuisine = cuisine.strip()
+
+        # Skip if it's just a generic term or too short
+        if not cuisine or len(cuisine) < 3 or cuisine.lower() in SKIP_TERMS:
+            continue
+
+        # Capitalize properly
+        if cuisine:
+            # Handle multi-word cuisines
+            words = cuisine.split()
+            if len(words) > 1:
+                cuisine = ' '.join([w.capitalize() for w in words])
+            else:
+                cuisine = cuisine.capitalize()
+
+            cuisines.append(cuisine)
+
+    # If no cuisines found, default to Restaurant
+    if not cuisines:
+        cuisines = ['Restaurant']
+
+    # Return unique cuisines (preserving order)
+    seen = set()
+    result = []
+    for c in cuisines:
+        c_lower = c.lower()
+        if c_lower not in seen:
+            seen.add(c_lower)
+            result.append(c)
+
+    return result
+
+def parse_rating_reviews(rating, reviews):
+    """Numeric rating and review count, both 0 when either can't be parsed"""
+    try:
+        rating = float(rating) if pd.notna(rating) else 0
+        reviews = int(float(reviews)) if pd.notna(reviews) else 0
+        # A literal 'nan' parses but would make the score unsortable
+        if rating != rating:
+            raise ValueError('rating is NaN')
+    except:
+        rating = 0
+        reviews = 0
+    return rating, reviews
+
+def pick_count(total):
+    """Number of restaurants that get the Julan's Pick badge"""
+    return min(max(1, total // PICK_SHARE), MAX_PICKS)
+
+def count_into(counts, slug, name, n=1):
+    """Add n to a {slug: {'name', 'count'}} tally, keeping the first name seen"""
+    if slug:
+        if slug not in counts:
+            counts[slug] = {'name': name, 'count': 0}
+        counts[slug]['count'] += n
+
+
+def uncount_from(counts, slug, n=1):
+    """Subtract n from a {slug: {'name', 'count'}} tally, dropping emptied entries"""
+    if slug in counts:
+        counts[slug]['count'] -= n
+        if counts[slug]['count'] <= 0:
+            del counts[slug]
+
+
+def build_record(idx, row):
+    """Turn one export row into a restaurant record"""
+    # Extract cuisine from subtypes
+    subtypes = row.get('subtypes', '')
+    cuisines = extract_cuisines(subtypes)
+    if not cuisines:
+        cuisines = ['Restaurant']
+
+    primary_cuisine = cuisines[0] if cuisines else 'Restaurant'
+
+    # Get city (neighbourhood)
+    city = str(row.get('city', 'London')).strip()
+    if not city or city == 'nan':
+        city = 'London'
+
+    # Get rating and reviews, converted to numeric with NaN handling
+    rating, reviews = parse_rating_reviews(row.get('rating', 0), row.get('reviews', 0))
+
+    # Calculate score for sorting (rating * reviews weight)
+    score = rating * (1 + reviews / 100)
+
+    return {
+        'id': idx,
+        'name': str(row.get('name', 'Unknown')),
+        'cuisines': cuisines,
+        'primary_cuisine': primary_cuisine,
+        'city': city,
+        'rating': rating,
+        'reviews': reviews,
+        'score': score,
+        'address': str(row.get('full_address', '')) or str(row.get('street', '')),
+        'phone': str(row.get('phone', '')) or str(row.get('phone_1', '')),
+        'website': str(row.get('site', '')) if pd.notna(row.get('site')) else '',
+        'photo': str(row.get('photo', '')) if pd.notna(row.get('photo')) else '',
+        'latitude': row.get('latitude'),
+        'longitude': row.get('longitude'),
+        'julans_pick': False  # We'll mark some manually or based on criteria
+    }
+
+def process_rows(df):
+    """Process the export one row at a time
+
+    Returns (store, cuisines_count, neighbourhoods_count).
+    """
+    restaurants = []
+    cuisines_count = {}
+    neighbourhoods_count = {}
+
+    for idx, row in df.iterrows():
+        restaurant = build_record(idx, row)
+        restaurants.append(restaurant)
+
+        # Count cuisines and neighbourhoods
+        for cuisine in restaurant['cuisines']:
+            count_into(cuisines_count, slugify(cuisine), cuisine)
+        count_into(neighbourhoods_count, slugify(restaurant['city']), restaurant['city'])
+
+    # Mark top restaurants as "Julan's Pick" (top 5% by score)
+    restaurants.sort(key=lambda x: x['score'], reverse=True)
+    for restaurant in restaurants[:pick_count(len(restaurants))]:
+        restaurant['julans_pick'] = True
+
+    return RestaurantStore.from_records(restaurants), cuisines_count, neighbourhoods_count
+
+
+def _column(df, name, default):
+    """A column of the export, or a constant column when the export lacks it"""
+    if name in df.columns:
+        return df[name].reset_index(drop=True)
+    return pd.Series([default] * len(df), dtype=object)
+
+def _text(series):
+    """str() of every value, matching the row pipeline (NaN becomes 'nan')"""
+    return series.astype(object).map(str)
+
+def _normalise_subtypes(parts):
+    """Map raw, stripped subtype parts to cuisine names (NaN where skipped)"""
+    unique = pd.Series(pd.unique(parts), dtype=object)
+    cuisine = unique.where(~unique.str.lower().isin(SKIP_TERMS))
+    for pattern in SUFFIX_PATTERNS:
+        cuisine = cuisine.str.replace(pattern, '', regex=True)
+    cuisine = cuisine.str.strip()
+    keep = (cuisine.str.len() >= 3) & ~cuisine.str.lower().isin(SKIP_TERMS)
+    cuisine = cuisine.where(keep)
+
+    # Capitalise word by word; split() also collapses inner whitespace
+    words = cuisine.dropna().str.split().explode().str.capitalize()
+    cuisine.loc[words.index.unique()] = words.groupby(level=0).agg(' '.join)
+    return parts.map(dict(zip(unique, cuisine)))
+
+def _cuisine_table(subtypes):
+    """Long (row, cuisine) table equivalent to extract_cuisines on every row"""
+    present = subtypes.notna()
+    parts = _text(subtypes[present]).str.split(',').explode().str.strip()
+    table = pd.DataFrame({'row': parts.index, 'cuisine': _normalise_subtypes(parts).to_numpy()})
+    table = table.dropna()
+    table = table[~table.assign(key=table['cuisine'].str.lower()).duplicated(['row', 'key'])]
+
+    # Rows left without a cuisine default to Restaurant
+    missing = np.setdiff1d(np.arange(len(subtypes)), table['row'].to_numpy())
+    table = pd.concat([table, pd.DataFrame({'row': missing, 'cuisine': 'Restaurant'})])
+    return table.sort_values('row', kind='stable').reset_index(drop=True)
+
+def _numeric_rating_reviews(df):
+    """Rating and review columns as arrays, matching parse_rating_reviews"""
+    rating = _column(df, 'rating', 0)
+    reviews = _column(df, 'reviews', 0)
+    numeric = pd.api.types.is_numeric_dtype(rating) and pd.api.types.is_numeric_dtype(reviews)
+    if numeric and np.isfinite(rating.dropna()).all() and np.isfinite(reviews.dropna()).all():
+        rating = rating.astype('float64').fillna(0.0).to_numpy()
+        reviews = np.trunc(reviews.astype('float64').fillna(0.0)).astype('int64').to_numpy()
+        return rating, reviews
+
+    # Mixed or unparseable values: fall back to the exact per-value rules
+    pairs = [parse_rating_reviews(r, v) for r, v in zip(rating, reviews)]
+    return (np.array([p[0] for p in pairs], dtype='float64'),
+            np.array([p[1] for p in pairs], dtype='int64'))
+
+def _tally(slugs, names):
+    """{slug: {'name', 'count'}} in first-seen order, skipping empty slugs"""
+    frame = pd.DataFrame({'slug': slugs, 'name': names})
+    frame = frame[frame['slug'] != '']
+    grouped = frame.groupby('slug', sort=False)['name']
+    names, sizes = grouped.first(), grouped.size()
+    return {slug: {'name': name, 'count': int(count)}
+            for slug, name, count in zip(names.index, names, sizes)}
+
+def _typed(typecode, values):
+    column = array(typecode)
+    column.frombytes(np.ascontiguousarray(values, dtype=np.dtype(typecode)).tobytes())
+    return column
+
+def process_dataframe_vectorized(df):
+    """Process the export with whole-column operations
+
+    Output is identical to process_rows: same records in the same order,
+    same counts in the same first-seen order.
+    """
+    n = len(df)
+    cuisines = _cuisine_table(_column(df, 'subtypes', ''))
+
+    city = _text(_column(df, 'city', 'London')).str.strip()
+    city = city.mask((city == '') | (city == 'nan'), 'London')
+
+    rating, reviews = _numeric_rating_reviews(df)
+    score = rating * (1 + reviews / 100)
+
+    # Counts follow the export's row order, like the row pipeline
+    cuisine_slugs = cuisines['cuisine'].map({c: slugify(c) for c in pd.unique(cuisines['cuisine'])})
+    cuisines_count = _tally(cuisine_slugs, cuisines['cuisine'])
+    city_slugs = city.map({c: slugify(c) for c in pd.unique(city)})
+    neighbourhoods_count = _tally(city_slugs, city)
+
+    # Rows are stored best-first; the stable sort keeps export order on ties
+    order = np.argsort(-score, kind='stable')
+    julans_pick = np.zeros(n, dtype='int8')
+    julans_pick[:pick_count(n)] = 1
+
+    def text_column(name, default):
+        return _text(_column(df, name, default)).to_numpy()[order]
+
+    def fallback_column(name, fallback):
+        primary = _text(_column(df, name, ''))
+        return primary.mask(primary == '', _text(_column(df, fallback, ''))).to_numpy()[order]
+
+    def optional_column(name):
+        values = _column(df, name, None)
+        return _text(values).mask(values.isna(), '').to_numpy()[order]
+
+    def coordinate_column(name):
+        values = _column(df, name, None)
+        if pd.api.types.is_numeric_dtype(values):
+            return values.astype('float64').to_numpy()[order]
+        return values.map(parse_coordinate).to_numpy(dtype='float64')[order]
+
+    # Dictionary-encode cities and cuisines in stored (score) order
+    rank = np.empty(n, dtype='int64')
+    rank[order] = np.arange(n)
+    cuisines = cuisines.assign(rank=rank[cuisines['row'].to_numpy()]).sort_values('rank', kind='stable')
+    cuisine_codes, cuisine_names = pd.factorize(cuisines['cuisine'])
+    cuisine_offsets = np.concatenate([[0], np.cumsum(np.bincount(cuisines['rank'], minlength=n))])
+    city_codes, cities = pd.factorize(city.to_numpy()[order])
+
+    store = RestaurantStore(
+        ids=_typed('q', np.asarray(df.index)[order]),
+        rating=_typed('d', rating[order]),
+        reviews=_typed('q', reviews[order]),
+        score=_typed('d', score[order]),
+        latitude=_typed('d', coordinate_column('latitude')),
+        longitude=_typed('d', coordinate_column('longitude')),
+        julans_pick=_typed('b', julans_pick),
+        city_codes=_typed('i', city_codes),
+        cities=list(cities),
+        cuisine_codes=_typed('i', cuisine_codes),
+        cuisine_offsets=_typed('q', cuisine_offsets),
+        cuisine_names=list(cuisine_names),
+        names=StringTable.from_strings(text_column('name', 'Unknown')),
+        addresses=StringTable.from_strings(fallback_column('full_address', 'street')),
+        phones=StringTable.from_strings(fallback_column('phone', 'phone_1')),
+        websites=StringTable.from_strings(optional_column('site')),
+        photos=StringTable.from_strings(optional_column('photo')),
+    )
+    return store, cuisines_count, neighbourhoods_count
+
+
+def _frame(rows, columns, start):
+    """DataFrame for a batch of raw rows, numbered from start like one big read"""
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+    frame.index = pd.RangeIndex(start, start + len(frame))
+    # Empty cells come back as None; read_excel would give NaN
+    return frame.mask(frame.isna())
+
+def read_chunks(path, chunk_size=None):
+    """Yield an export as DataFrames of at most chunk_size rows
+
+    Supports .xlsx (openpyxl read-only mode), .csv and .parquet (pyarrow).
+    Row labels continue across chunks, matching a single full read.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.csv':
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+    elif ext in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None) or ()
+            start = 0
+            while True:
+                batch = list(islice(rows, chunk_size))
+                if not batch:
+                    break
+                yield _frame(batch, header, start)
+                start += len(batch)
+        finally:
+            workbook.close()
+
+    elif ext == '.parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Reading .parquet exports requires pyarrow (pip install pyarrow)")
+        start = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            frame = batch.to_pandas()
+            frame.index = pd.RangeIndex(start, start + len(frame))
+            yield frame
+            start += len(frame)
+
+    else:
+        raise ValueError(f"Unsupported export format {ext!r}, expected .xlsx, .csv or .parquet")
+
+def iter_records(chunks):
+    """Generator of restaurant records from a stream of DataFrame chunks"""
+    for chunk in chunks:
+        for idx, row in chunk.iterrows():
+            yield build_record(idx, row)
+
+def process_stream(records):
+    """Build processed data from a stream of records in bounded working memory
+
+    Records go straight into the compact column store; counts are tallied as
+    they pass and Julan's Picks come from a running top-k heap, so nothing
+    beyond the output itself grows with the size of the export. Unlike the
+    other pipelines, the store keeps the rows in the order they arrived.
+    """
+    builder = RestaurantStoreBuilder()
+    cuisines_count = {}
+    neighbourhoods_count = {}
+    # Min-heap of (score, -position): earlier rows win ties, as in a stable sort
+    best = []
+
+    for record in records:
+        position = len(builder)
+        builder.append(record)
+
+        for cuisine in record['cuisines']:
+            count_into(cuisines_count, slugify(cuisine), cuisine)
+        count_into(neighbourhoods_count, slugify(record['city']), record['city'])
+
+        entry = (record['score'], -position)
+        if len(best) < MAX_PICKS:
+            heapq.heappush(best, entry)
+        elif entry > best[0]:
+            heapq.heapreplace(best, entry)
+
+    store = builder.build()
+    for _, position in heapq.nlargest(pick_count(len(store)), best):
+        store.julans_pick[-position] = 1
+
+    # Rows stay in arrival order. Listings rank them through a separate
+    # score-order permutation (dataset.compute_score_order), so the columns
+    # are never copied into best-first order
+    return store, cuisines_count, neighbourhoods_count
+
+
+PIPELINES = {
+    'rows': process_rows,
+    'vectorized': process_dataframe_vectorized,
+}
+
+def process_dataframe(df, mode=None):
+    """Process an export DataFrame with the configured pipeline"""
+    mode = mode or INGEST_MODE
+    if mode not in PIPELINES:
+        raise ValueError(f"Unknown ingest mode {mode!r}, expected one of {sorted(PIPELINES)}")
+    return PIPELINES[mode](df)
+
+def read_export(path):
+    """Read a whole export into one DataFrame"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return pd.read_csv(path)
+    if ext == '.parquet':
+        return pd.read_parquet(path)
+    return pd.read_excel(path)
+
+def process_file(path, mode=None):
+    """Process an export file with the configured pipeline
+
+    'streaming' reads the file chunk by chunk; the other modes read it whole.
+    """
+    mode = mode or INGEST_MODE
+    if mode == 'streaming':
+        return process_stream(iter_records(read_chunks(path)))
+    return process_dataframe(read_export(path), mode)
+
+def _gather_strings(tables, order, block_rows=65536):
+    """One StringTable holding the strings of several tables, in a position order
+
+    Bytes are gathered with numpy a block of rows at a time, which keeps the
+    index arrays small without a Python-level slice per string.
+    """
+    source = np.frombuffer(b''.join(table.blob for table in tables), dtype='uint8')
+    bases = np.cumsum([0] + [len(table.blob) for table in tables])
+    offsets = np.concatenate([[0]] + [np.asarray(table.offsets)[1:] + base
+                                      for table, base in zip(tables, bases)])
+    starts = offsets[:-1][order]
+    lengths = offsets[1:][order] - starts
+    new_offsets = np.concatenate([[0], np.cumsum(lengths)])
+    gathered = np.empty(new_offsets[-1], dtype='uint8')
+    for first in range(0, len(order), block_rows):
+        last = min(first + block_rows, len(order))
+        begin, end = new_offsets[first], new_offsets[last]
+        shift = starts[first:last] - (new_offsets[first:last] - begin)
+        gathered[begin:end] = source[np.repeat(shift, lengths[first:last]) + np.arange(end - begin)]
+    return StringTable(gathered.tobytes(), _typed('q', new_offsets))
+
+def _merged_codes(stores, codes_attr, names_attr):
+    """Codes of several stores' dictionary-encoded column over one shared dictionary"""
+    lookup = {}
+    codes = []
+    for store in stores:
+        remap = np.array([lookup.setdefault(name, len(lookup)) for name in getattr(store, names_attr)],
+                         dtype='int64')
+        codes.append(remap[np.asarray(getattr(store, codes_attr), dtype='int64')])
+    return np.concatenate(codes), list(lookup)
+
+def _combine(stores, ids, order):
+    """A store of the given rows of several stores, as positions into them stacked
+
+    ids are the stacked stores' ids; order must list rows best-first. Cities
+    and cuisines are re-encoded in stored order, as a single export's would
+    be, and Julan's Picks go to the top rows.
+    """
+    def stacked(name):
+        return np.concatenate([np.asarray(getattr(store, name)) for store in stores])
+
+    n = len(order)
+    city_codes, cities = _merged_codes(stores, 'city_codes', 'cities')
+    city_codes, city_uniques = pd.factorize(city_codes[order])
+
+    cuisine_codes, cuisine_names = _merged_codes(stores, 'cuisine_codes', 'cuisine_names')
+    counts = np.concatenate([np.diff(np.asarray(store.cuisine_offsets)) for store in stores])
+    row_starts = np.concatenate([[0], np.cumsum(counts)])[:-1]
+    cuisine_offsets = np.concatenate([[0], np.cumsum(counts[order])])
+    flat = np.repeat(row_starts[order] - cuisine_offsets[:-1], counts[order]) + np.arange(cuisine_offsets[-1])
+    cuisine_codes, cuisine_uniques = pd.factorize(cuisine_codes[flat])
+
+    julans_pick = np.zeros(n, dtype='int8')
+    julans_pick[:pick_count(n)] = 1
+
+    return RestaurantStore(
+        ids=_typed('q', ids[order]),
+        rating=_typed('d', stacked('rating')[order]),
+        reviews=_typed('q', stacked('reviews')[order]),
+        score=_typed('d', stacked('score')[order]),
+        latitude=_typed('d', stacked('latitude')[order]),
+        longitude=_typed('d', stacked('longitude')[order]),
+        julans_pick=_typed('b', julans_pick),
+        city_codes=_typed('i', city_codes),
+        cities=[cities[code] for code in city_uniques],
+        cuisine_codes=_typed('i', cuisine_codes),
+        cuisine_offsets=_typed('q', cuisine_offsets),
+        cuisine_names=[cuisine_names[code] for code in cuisine_uniques],
+        names=_gather_strings([s.names for s in stores], order),
+        addresses=_gather_strings([s.addresses for s in stores], order),
+        phones=_gather_strings([s.phones for s in stores], order),
+        websites=_gather_strings([s.websites for s in stores], order),
+        photos=_gather_strings([s.photos for s in stores], order),
+    )
+
+def merge_shards(shards):
+    """Merge processed exports as if their rows had come from one export
+
+    shards are (store, cuisines_count, neighbourhoods_count) results in export
+    order. Ids carry on from one export to the next, counts are summed in
+    first-seen order, rows are sorted best-first with earlier rows winning
+    ties, and Julan's Picks go to the top of all of them, so the result is
+    identical to process_dataframe_vectorized on the concatenated exports.
+    """
+    stores = [store for store, _, _ in shards]
+    cuisines_count = {}
+    neighbourhoods_count = {}
+    for _, cuisines, neighbourhoods in shards:
+        for slug, entry in cuisines.items():
+            count_into(cuisines_count, slug, entry['name'], entry['count'])
+        for slug, entry in neighbourhoods.items():
+            count_into(neighbourhoods_count, slug, entry['name'], entry['count'])
+
+    starts = np.cumsum([0] + [len(store) for store in stores])
+    ids = np.concatenate([np.asarray(store.ids) + start for store, start in zip(stores, starts)])
+    score = np.concatenate([np.asarray(store.score) for store in stores])
+    store = _combine(stores, ids, np.lexsort((ids, -score)))
+    return store, cuisines_count, neighbourhoods_count
+
+def process_files(paths, mode=None, workers=None):
+    """Process several exports (say, one per region) in parallel and merge them
+
+    Each export goes to its own worker process, up to workers (default:
+    INGEST_WORKERS, else one per CPU) at a time. Results are merged in the
+    order of paths, never in the order workers finish, so the output is the
+    same however the work was scheduled (see merge_shards).
+    """
+    paths = list(paths)
+    if not paths:
+        raise ValueError("No exports to process")
+    mode = mode or INGEST_MODE
+    if len(paths) == 1:
+        return process_file(paths[0], mode)
+    workers = min(workers or INGEST_WORKERS or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        shards = [process_file(path, mode) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            shards = list(pool.map(process_file, paths, [mode] * len(paths)))
+    return merge_shards(shards)
+
+def drop_duplicates(result):
+    """Remove likely duplicate restaurants from processed data (see dedup.py)
+
+    Each group of duplicates keeps its best-scored restaurant. Counts lose
+    the dropped rows and Julan's Picks are awarded again over the rest.
+    Returns (result, report), where the report lists every group with the
+    evidence that linked each dropped restaurant to it.
+    """
+    from dedup import find_duplicates
+
+    store, cuisines_count, neighbourhoods_count = result
+    groups, matches = find_duplicates(store)
+    evidence = {}
+    for i, j, distance, similarity, rule in matches:
+        for position in (i, j):
+            evidence.setdefault(position, {'matched': int(store.ids[i + j - position]),
+                                           'distance_m': distance,
+                                           'name_similarity': similarity, 'rule': rule})
+
+    def described(position):
+        restaurant = store[position]
+        return {'id': restaurant.id, 'name': restaurant.name, 'address': restaurant.address}
+
+    report = {'restaurants': len(store), 'dropped': 0, 'groups': []}
+    dropped = []
+    cuisines_count = {slug: dict(entry) for slug, entry in cuisines_count.items()}
+    neighbourhoods_count = {slug: dict(entry) for slug, entry in neighbourhoods_count.items()}
+    for kept, duplicates in groups.items():
+        report['groups'].append({'kept': described(kept),
+                                 'dropped': [dict(described(p), **evidence[p]) for p in duplicates]})
+        for position in duplicates:
+            restaurant = store[position]
+            for cuisine in restaurant.cuisines:
+                uncount_from(cuisines_count, slugify(cuisine))
+            uncount_from(neighbourhoods_count, slugify(restaurant.city))
+        dropped.extend(duplicates)
+    report['dropped'] = len(dropped)
+    if not dropped:
+        return result, report
+
+    # Streamed stores are in arrival order, so rank the rows kept best-first
+    ids = np.asarray(store.ids)
+    keep = np.setdiff1d(np.arange(len(store)), dropped)
+    keep = keep[np.lexsort((ids[keep], -np.asarray(store.score)[keep]))]
+    store = _combine([store], ids, keep)
+    return (store, cuisines_count, neighbourhoods_count), report
+
+def process_exports(paths, mode=None, workers=None, dedup=None):
+    """Process one or more exports into one dataset, dropping duplicates as configured
+
+    dedup is 'on', 'off' or 'auto' (default: INGEST_DEDUP); 'auto' drops
+    duplicates when several exports are merged. Returns (store,
+    cuisines_count, neighbourhoods_count, report), where report is
+    drop_duplicates' report or None when duplicates were not looked for.
+    """
+    paths = list(paths)
+    result = process_files(paths, mode, workers)
+    dedup = dedup or INGEST_DEDUP
+    if dedup not in ('on', 'off', 'auto'):
+        raise ValueError(f"Unknown dedup setting {dedup!r}, expected 'on', 'off' or 'auto'")
+    if dedup == 'off' or (dedup == 'auto' and len(paths) < 2):
+        return (*result, None)
+    result, report = drop_duplicates(result)
+    return (*result, report)
+
+def check_parity(df):
+    """Run both pipelines on df and describe every difference in their output"""
+    expected_store, expected_cuisines, expected_neighbourhoods = process_rows(df)
+    store, cuisines_count, neighbourhoods_count = process_dataframe_vectorized(df)
+
+    problems = []
+    if len(store) != len(expected_store):
+        problems.append(f"row count {len(store)} != {len(expected_store)}")
+    for got, expected in zip(store, expected_store):
+        got, expected = got.to_dict(), expected.to_dict()
+        if got != expected:
+            problems.append(f"restaurant {expected['id']}: {got} != {expected}")
+    for label, got, expected in (('cuisines', cuisines_count, expected_cuisines),
+                                 ('neighbourhoods', neighbourhoods_count, expected_neighbourhoods)):
+        if list(got.items()) != list(expected.items()):
+            problems.append(f"{label} counts differ")
+    return problems
+
+
+if __name__ == '__main__':
+    # python ingest.py [export.xlsx] -- check the vectorized pipeline against the row pipeline
+    path = sys.argv[1] if len(sys.argv) > 1 else 'OS-20251124200014m1e_restaurant.xlsx'
+    problems = check_parity(pd.read_excel(path))
+    for problem in problems[:20]:
+        print(problem)
+    print(f"{len(problems)} differences")
+    sys.exit(1 if problems else 0)
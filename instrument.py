@@ -0,0 +1,263 @@
+"""
+Opt-in request instrumentation
+With METRICS_ENABLED=1, functions wrapped with timed() record how long each
+request spent in them (data access, facet counting, template rendering...),
+reported per request in a Server-Timing header and aggregated with per-route
+latency histograms at /metrics in the Prometheus text format. Setting
+PROFILE_SLOW_MS samples the stacks of in-flight requests and writes a folded
+stack profile (flamegraph.pl / speedscope input) for any request slower than
+that many milliseconds. With both unset, timed() returns functions unchanged
+and no request hooks run.
+
+Metrics are per process: under a pre-forking server each worker reports its own.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from flask import g, has_request_context, request
+
+ENABLED = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+# Requests slower than this many milliseconds get a profile written (0 = off)
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 0) or 0)
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, as Prometheus expects"""
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for n, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.counts[n] += 1
+                break
+        self.sum += seconds
+        self.count += 1
+
+
+class Metrics:
+    """Request latencies per route and time spent per phase, for /metrics"""
+
+    def __init__(self):
+        self.requests = {}  # (route, method, status) -> count
+        self.latency = {}   # route -> Histogram
+        self.phases = {}    # phase -> [seconds, calls]
+        self.gauges = {}    # name -> (help, value), set outside requests
+        self._lock = threading.Lock()
+
+    def observe_request(self, route, method, status, seconds, phases):
+        with self._lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.latency.get(route)
+            if histogram is None:
+                histogram = self.latency[route] = Histogram()
+            histogram.observe(seconds)
+            for phase, (spent, calls) in phases.items():
+                total = self.phases.setdefault(phase, [0.0, 0])
+                total[0] += spent
+                total[1] += calls
+
+    def set_gauge(self, name, help_text, value):
+        self.gauges[name] = (help_text, value)
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of everything recorded, plus extra (name, help, value) gauges"""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            family('http_requests_total', 'counter', 'Requests served, by route, method and status.')
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{route="{_label(route)}",method="{method}",'
+                             f'status="{status}"}} {count}')
+
+            family('http_request_duration_seconds', 'histogram', 'Request latency by route.')
+            for route, histogram in sorted(self.latency.items()):
+                label = f'route="{_label(route)}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'http_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'http_request_duration_seconds_bucket{{{label},le="+Inf"}} {histogram.count}')
+                lines.append(f'http_request_duration_seconds_sum{{{label}}} {histogram.sum:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{{label}}} {histogram.count}')
+
+            family('request_phase_seconds_total', 'counter', 'Time spent in each instrumented phase.')
+            for phase, (spent, calls) in sorted(self.phases.items()):
+                lines.append(f'request_phase_seconds_total{{phase="{phase}"}} {spent:.6f}')
+            family('request_phase_calls_total', 'counter', 'Calls to each instrumented phase.')
+            for phase, (spent, calls) in sorted(self.phases.items()):
+                lines.append(f'request_phase_calls_total{{phase="{phase}"}} {calls}')
+
+        for name, (help_text, value) in sorted(self.gauges.items()):
+            family(name, 'gauge', help_text)
+            lines.append(f'{name} {value}')
+        for name, help_text, value in gauges:
+            kind = 'counter' if name.endswith('_total') else 'gauge'
+            family(name, kind, help_text)
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+metrics = Metrics()
+
+
+def timed(phase):
+    """Decorator recording the time spent in a function under phase for the current request"""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                add_phase(phase, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+def timed_gauge(name, help_text):
+    """Decorator setting a /metrics gauge to the duration of the latest call (used for data loads)"""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.set_gauge(name, help_text, f'{time.perf_counter() - started:.6f}')
+        return wrapper
+    return decorate
+
+def add_phase(phase, seconds):
+    if not has_request_context():
+        return
+    phases = g.setdefault('phases', {})
+    spent, calls = phases.get(phase, (0.0, 0))
+    phases[phase] = (spent + seconds, calls + 1)
+
+def note(name, description):
+    """Attach a description-only Server-Timing entry (e.g. cache;desc="hit") to the current request"""
+    if ENABLED and has_request_context():
+        g.setdefault('notes', []).append((name, description))
+
+
+def server_timing(phases, total, notes=()):
+    """Server-Timing header value for a request's phases, in milliseconds"""
+    entries = [f'{phase};dur={spent * 1000:.2f}' for phase, (spent, calls) in phases.items()]
+    entries.extend(f'{name};desc="{description}"' for name, description in notes)
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+
+def _fold(frame):
+    """One stack as root-first 'file:function' frames joined by ';'"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of in-flight requests, keeping profiles of slow ones"""
+
+    def __init__(self, threshold_ms, interval_ms=PROFILE_INTERVAL_MS, out_dir=PROFILE_DIR):
+        self.threshold_ms = threshold_ms
+        self.interval = interval_ms / 1000
+        self.out_dir = out_dir
+        self._active = {}  # thread id -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def begin(self):
+        """Start sampling the calling thread"""
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='slow-request-profiler', daemon=True)
+                self._thread.start()
+
+    def end(self, elapsed_ms, label):
+        """Stop sampling the calling thread; returns the profile's path if the request was slow"""
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if not samples or elapsed_ms < self.threshold_ms:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        slug = re.sub(r'[^\w-]+', '-', label).strip('-') or 'root'
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        path = os.path.join(self.out_dir, f'{stamp}-{slug[:60]}-{elapsed_ms:.0f}ms.folded')
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        return path
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_fold(frame)] += 1
+
+
+profiler = SlowRequestProfiler(PROFILE_SLOW_MS) if PROFILE_SLOW_MS > 0 else None
+
+
+def start_request():
+    """before_request hook"""
+    g.request_started = time.perf_counter()
+    if profiler is not None:
+        profiler.begin()
+
+def finish_request(response):
+    """after_request hook: record the request and add its Server-Timing header"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if ENABLED:
+        phases = g.pop('phases', {})
+        metrics.observe_request(route, request.method, response.status_code, elapsed, phases)
+        response.headers['Server-Timing'] = server_timing(phases, elapsed, g.pop('notes', ()))
+    if profiler is not None:
+        path = profiler.end(elapsed * 1000, request.path)
+        if path:
+            print(f"Slow request {request.method} {request.full_path.rstrip('?')} "
+                  f"took {elapsed * 1000:.0f}ms, profile written to {path}")
+    return response
+
+def abandon_request(error=None):
+    """teardown_request hook: stop sampling a request that never reached after_request"""
+    if profiler is not None and g.pop('request_started', None) is not None:
+        profiler.end(0, '')
@@ -0,0 +1,97 @@
+"""
+In-process cache of rendered pages
+Entries are evicted least-recently-used once the total size of cached bodies
+passes a byte budget, and the whole cache is dropped when a new data snapshot
+is loaded. Once a version is set, pages of any other version are neither
+served nor stored, so requests still finishing on replaced data can't evict
+the pages of the new data. VersionedCache holds any sized value (fragments.py
+caches rendered restaurant cards in one); PageCache holds whole page bodies.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class CachedPage:
+    """A rendered page body and its strong ETag"""
+    __slots__ = ('body', 'etag')
+
+    def __init__(self, body, version):
+        self.body = body
+        self.etag = f"{version}-{hashlib.sha1(body).hexdigest()[:16]}"
+
+
+class VersionedCache:
+    """Thread-safe LRU mapping of cache key -> sized value for one data version, with a memory cap"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(value):
+        return len(value)
+
+    def set_version(self, version):
+        """Start caching values of a new data version, dropping everything older"""
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.size = 0
+                self.version = version
+
+    def get(self, version, key):
+        with self._lock:
+            if self.version is None:
+                self.version = version
+            value = self._entries.get(key) if version == self.version else None
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, version, key, value):
+        """Cache value (if it fits and is of the current version) and return it"""
+        size = self._size(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            if self.version is None:
+                self.version = version
+            if version != self.version:
+                return value
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= self._size(old)
+            self._entries[key] = value
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= self._size(evicted)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PageCache(VersionedCache):
+    """VersionedCache of rendered page bodies, as CachedPage objects"""
+
+    @staticmethod
+    def _size(page):
+        return len(page.body)
+
+    def put(self, version, key, body):
+        return super().put(version, key, CachedPage(body, version))
@@ -0,0 +1,66 @@
+"""
+Background reloading of the served data
+A Reloader runs the app's reload function on its own daemon thread, so no
+request ever waits for a reload. A reload happens when one is requested
+(trigger(), safe to call from a signal handler) or, with polling enabled,
+when any watched file is replaced or modified. Reloads never overlap: a
+request that arrives during a reload starts another one afterwards.
+"""
+import os
+import threading
+import time
+import traceback
+
+# How often the reload thread checks for requests
+TICK_SECONDS = 0.5
+
+
+class Reloader:
+    """Runs reload() in the background on request or when watched files change"""
+
+    def __init__(self, reload, paths=(), poll_seconds=0):
+        self.reload = reload
+        self.paths = list(paths)
+        self.poll_seconds = poll_seconds
+        self._requested = False
+        self._thread = None
+
+    def start(self):
+        """Start the reload thread (idempotent)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='data-reloader', daemon=True)
+            self._thread.start()
+
+    def trigger(self):
+        """Ask for a reload; only sets a flag, so it's safe in signal handlers"""
+        self._requested = True
+
+    def _stamp(self):
+        stamps = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                stamps.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stamps.append(None)
+        return stamps
+
+    def _run(self):
+        last_stamp = self._stamp()
+        last_poll = time.monotonic()
+        while True:
+            time.sleep(TICK_SECONDS)
+            if self.poll_seconds and time.monotonic() - last_poll >= self.poll_seconds:
+                last_poll = time.monotonic()
+                stamp = self._stamp()
+                if stamp != last_stamp:
+                    last_stamp = stamp
+                    self._requested = True
+            if self._requested:
+                self._requested = False
+                try:
+                    self.reload()
+                except Exception as e:
+                    # Keep serving the current data; the next change or trigger retries
+                    print(f"Error reloading data: {e}")
+                    traceback.print_exc()
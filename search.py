@@ -0,0 +1,383 @@
+"""
+Full-text search and typeahead over restaurant names, addresses, cities and cuisines
+
+The index is a sorted vocabulary of terms, each with a posting list of
+restaurant ranks (places in the score order, best first). Typed prefixes
+become vocabulary ranges found by binary search; very short prefixes use
+precomputed posting lists capped to the best-scored restaurants, and words
+that match nothing fall back to trigram similarity for typo tolerance.
+
+Candidates are streamed best-score-first from the rarest query word, checked
+against the other words, and re-ranked by a blend of text relevance and
+score. Every array is flat, so the index is stored in the binary snapshot and
+memory-mapped back without rebuilding.
+
+Usage: python search.py [N]   (benchmark typeahead over N synthetic restaurants)
+"""
+import heapq
+import math
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+from store import StringTable
+
+# Relevance of a query word matching each field of a restaurant
+FIELD_WEIGHTS = {'name': 4.0, 'cuisine': 2.0, 'city': 2.0, 'address': 1.0}
+
+# Relevance multiplier for how a query word matched a term
+EXACT, PREFIX, FUZZY = 1.0, 0.7, 0.5
+
+# How much the (log-scaled) review score counts against text relevance
+SCORE_WEIGHT = 2.0
+
+# Prefixes up to this length get precomputed posting lists of their best PREFIX_CAP restaurants
+PREFIX_LENGTH = 3
+PREFIX_CAP = 256
+
+# Restaurants examined per query, best-scored first, before ranking stops
+CANDIDATE_BUDGET = 2000
+
+# Minimum trigram (Dice) similarity for a misspelt word to match a term
+FUZZY_THRESHOLD = 0.5
+FUZZY_TERMS = 3
+
+_WORD = re.compile(r'\w+')
+_LAST = chr(0x10FFFF)
+
+
+def tokenize(text):
+    """Lowercase, accent-stripped words of a string"""
+    if not text:
+        return []
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _WORD.findall(text)
+
+def trigrams(term):
+    padded = f' {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _flatten(keys, postings):
+    """Sorted keys as a StringTable plus (offsets, values) of their posting lists"""
+    offsets = array('q', [0])
+    values = array('i')
+    for key in keys:
+        values.extend(postings[key])
+        offsets.append(len(values))
+    return StringTable.from_strings(keys), offsets, values
+
+
+class SearchIndex:
+    """Inverted index over a RestaurantStore in a given score order"""
+
+    # Snapshot section name -> attribute
+    SECTIONS = (
+        ('search.terms.blob', 'B', 'terms.blob'),
+        ('search.terms.offsets', 'q', 'terms.offsets'),
+        ('search.postings.offsets', 'q', 'posting_offsets'),
+        ('search.postings.ranks', 'i', 'postings'),
+        ('search.prefixes.blob', 'B', 'prefixes.blob'),
+        ('search.prefixes.offsets', 'q', 'prefixes.offsets'),
+        ('search.prefix_postings.offsets', 'q', 'prefix_offsets'),
+        ('search.prefix_postings.ranks', 'i', 'prefix_postings'),
+        ('search.trigrams.blob', 'B', 'trigrams.blob'),
+        ('search.trigrams.offsets', 'q', 'trigrams.offsets'),
+        ('search.trigram_terms.offsets', 'q', 'trigram_offsets'),
+        ('search.trigram_terms.ids', 'i', 'trigram_terms'),
+    )
+
+    def __init__(self, store, order, terms, posting_offsets, postings, prefixes, prefix_offsets,
+                 prefix_postings, trigrams, trigram_offsets, trigram_terms):
+        self.store = store
+        self.order = order
+        self.terms = terms
+        self.posting_offsets = posting_offsets
+        self.postings = postings
+        self.prefixes = prefixes
+        self.prefix_offsets = prefix_offsets
+        self.prefix_postings = prefix_postings
+        self.trigrams = trigrams
+        self.trigram_offsets = trigram_offsets
+        self.trigram_terms = trigram_terms
+        top = store.score[order[0]] if len(order) else 0
+        self._score_scale = math.log1p(max(top, 0)) or 1.0
+        self._city_terms = [set(tokenize(city)) for city in store.cities]
+        self._cuisine_terms = [set(tokenize(cuisine)) for cuisine in store.cuisine_names]
+
+    @classmethod
+    def build(cls, store, order):
+        """Tokenize every restaurant; order is the score order postings follow"""
+        city_terms = [set(tokenize(city)) for city in store.cities]
+        cuisine_terms = [set(tokenize(cuisine)) for cuisine in store.cuisine_names]
+        names, addresses, city_codes = store.names, store.addresses, store.city_codes
+
+        postings = {}
+        for rank, position in enumerate(order):
+            words = set(tokenize(names[position]))
+            words.update(tokenize(addresses[position]))
+            words |= city_terms[city_codes[position]]
+            for code in store.cuisine_codes_at(position):
+                words |= cuisine_terms[code]
+            for word in words:
+                posting = postings.get(word)
+                if posting is None:
+                    posting = postings[word] = array('i')
+                posting.append(rank)
+
+        keys = sorted(postings)
+        terms, posting_offsets, flat = _flatten(keys, postings)
+
+        # Best PREFIX_CAP ranks of every short prefix, from the terms it covers
+        by_prefix = {}
+        for key in keys:
+            for length in range(1, min(PREFIX_LENGTH, len(key)) + 1):
+                by_prefix.setdefault(key[:length], []).append(postings[key])
+        prefix_postings = {}
+        for prefix, lists in by_prefix.items():
+            capped = array('i')
+            for rank in heapq.merge(*lists):
+                if not capped or capped[-1] != rank:
+                    capped.append(rank)
+                    if len(capped) == PREFIX_CAP:
+                        break
+            prefix_postings[prefix] = capped
+        prefixes, prefix_offsets, prefix_flat = _flatten(sorted(prefix_postings), prefix_postings)
+
+        by_trigram = {}
+        for n, key in enumerate(keys):
+            for gram in trigrams(key):
+                by_trigram.setdefault(gram, array('i')).append(n)
+        grams, trigram_offsets, trigram_flat = _flatten(sorted(by_trigram), by_trigram)
+
+        return cls(store, order, terms, posting_offsets, flat, prefixes, prefix_offsets,
+                   prefix_flat, grams, trigram_offsets, trigram_flat)
+
+    def sections(self):
+        """(name, typecode, data) sections for a binary snapshot"""
+        result = []
+        for name, typecode, attr in self.SECTIONS:
+            value = self
+            for part in attr.split('.'):
+                value = getattr(value, part)
+            result.append((name, typecode, value))
+        return result
+
+    @classmethod
+    def from_sections(cls, store, order, sections):
+        """Rebuild an index over memory-mapped snapshot sections"""
+        def table(prefix):
+            return StringTable(sections[f'{prefix}.blob'], sections[f'{prefix}.offsets'])
+        return cls(store, order, table('search.terms'),
+                   sections['search.postings.offsets'], sections['search.postings.ranks'],
+                   table('search.prefixes'),
+                   sections['search.prefix_postings.offsets'], sections['search.prefix_postings.ranks'],
+                   table('search.trigrams'),
+                   sections['search.trigram_terms.offsets'], sections['search.trigram_terms.ids'])
+
+    def _range(self, word):
+        """Vocabulary numbers [lo, hi) of terms starting with word"""
+        return bisect_left(self.terms, word), bisect_left(self.terms, word + _LAST)
+
+    def _fuzzy(self, word):
+        """Vocabulary numbers of the terms most similar to a misspelt word"""
+        grams = trigrams(word)
+        shared = {}
+        for gram in grams:
+            n = bisect_left(self.trigrams, gram)
+            if n < len(self.trigrams) and self.trigrams[n] == gram:
+                for term in self.trigram_terms[self.trigram_offsets[n]:self.trigram_offsets[n + 1]]:
+                    shared[term] = shared.get(term, 0) + 1
+        scored = []
+        for term, common in shared.items():
+            if 2 * common >= FUZZY_THRESHOLD * len(grams):
+                similarity = 2 * common / (len(grams) + len(trigrams(self.terms[term])))
+                if similarity >= FUZZY_THRESHOLD:
+                    scored.append((similarity, term))
+        return [term for _, term in heapq.nlargest(FUZZY_TERMS, scored)]
+
+    def _resolve(self, word):
+        """How a query word matches the vocabulary: (kind, lo, hi, terms, size)"""
+        lo, hi = self._range(word)
+        if hi > lo:
+            return 'range', lo, hi, None, self.posting_offsets[hi] - self.posting_offsets[lo]
+        if len(word) >= 4:
+            terms = self._fuzzy(word)
+            if terms:
+                size = sum(self.posting_offsets[t + 1] - self.posting_offsets[t] for t in terms)
+                return 'fuzzy', 0, 0, [self.terms[t] for t in terms], size
+        return None
+
+    def _postings(self, n):
+        return self.postings[self.posting_offsets[n]:self.posting_offsets[n + 1]]
+
+    def _candidates(self, word, match):
+        """Ranks of restaurants matching one query word, best-scored first"""
+        kind, lo, hi, terms, _ = match
+        if kind == 'fuzzy':
+            lists = [self._postings(bisect_left(self.terms, term)) for term in terms]
+        elif hi - lo == 1:
+            return iter(self._postings(lo))
+        elif len(word) <= PREFIX_LENGTH:
+            n = bisect_left(self.prefixes, word)
+            return iter(self.prefix_postings[self.prefix_offsets[n]:self.prefix_offsets[n + 1]])
+        else:
+            lists = [self._postings(n) for n in range(lo, hi)]
+        return self._unique(heapq.merge(*lists))
+
+    @staticmethod
+    def _unique(ranks):
+        last = -1
+        for rank in ranks:
+            if rank != last:
+                last = rank
+                yield rank
+
+    def _row_terms(self, position):
+        """{term: field weight} for one restaurant"""
+        store = self.store
+        weights = {}
+        for term in tokenize(store.addresses[position]):
+            weights[term] = FIELD_WEIGHTS['address']
+        for term in self._city_terms[store.city_codes[position]]:
+            weights[term] = max(weights.get(term, 0), FIELD_WEIGHTS['city'])
+        for code in store.cuisine_codes_at(position):
+            for term in self._cuisine_terms[code]:
+                weights[term] = max(weights.get(term, 0), FIELD_WEIGHTS['cuisine'])
+        for term in tokenize(store.names[position]):
+            weights[term] = FIELD_WEIGHTS['name']
+        return weights
+
+    @staticmethod
+    def _match_word(word, fuzzy, row):
+        """Best relevance of one query word against a restaurant's terms"""
+        best = 0.0
+        for term, weight in row.items():
+            if term == word:
+                factor = EXACT
+            elif term.startswith(word):
+                factor = PREFIX
+            elif fuzzy and term in fuzzy:
+                factor = FUZZY
+            else:
+                continue
+            best = max(best, weight * factor)
+        return best
+
+    def search(self, query, limit=20, budget=CANDIDATE_BUDGET):
+        """Best matches for a query as (position, relevance) pairs, best first
+
+        Every query word must match (the last one may be an unfinished
+        prefix). Up to budget restaurants are examined in score order.
+        """
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words or not len(self.order):
+            return []
+        matches = []
+        for word in words:
+            match = self._resolve(word)
+            if match is None:
+                return []
+            matches.append(match)
+
+        # Drive the search from the word with the fewest postings
+        driver = min(range(len(words)), key=lambda i: matches[i][4])
+        fuzzy = [set(match[3]) if match[0] == 'fuzzy' else None for match in matches]
+        full_name = ' '.join(words)
+        score = self.store.score
+        names = self.store.names
+
+        results = []
+        for examined, rank in enumerate(self._candidates(words[driver], matches[driver])):
+            if examined == budget:
+                break
+            position = self.order[rank]
+            row = self._row_terms(position)
+            relevance = 0.0
+            for word, similar in zip(words, fuzzy):
+                matched = self._match_word(word, similar, row)
+                if not matched:
+                    break
+                relevance += matched
+            else:
+                if ' '.join(tokenize(names[position])).startswith(full_name):
+                    relevance += FIELD_WEIGHTS['name']
+                relevance += SCORE_WEIGHT * math.log1p(max(score[position], 0)) / self._score_scale
+                results.append((-relevance, rank, position))
+        return [(position, -relevance) for relevance, _, position in heapq.nsmallest(limit, results)]
+
+
+class LabelIndex:
+    """Typeahead over ranked (slug, {'name', 'count'}) pairs such as the cuisine list"""
+
+    def __init__(self, ranked):
+        self.labels = [(slug, data['name'], tokenize(data['name'])) for slug, data in ranked]
+
+    def match(self, query, limit=5):
+        """(slug, name) of the most common labels matching every query word"""
+        words = tokenize(query)
+        if not words:
+            return []
+        found = []
+        for slug, name, terms in self.labels:
+            if all(any(term.startswith(word) for term in terms) for word in words):
+                found.append((slug, name))
+                if len(found) == limit:
+                    break
+        return found
+
+
+if __name__ == '__main__':
+    import random
+    import sys
+    import time
+    from store import RestaurantStore
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rnd = random.Random(7)
+    syllables = ['ba', 'ko', 'ri', 'sa', 'mo', 'lu', 'ta', 'ne', 'zi', 'po', 'ka', 'de', 'shi', 'ran', 'vel']
+    cities = ['Camden', 'Hackney', 'Islington', 'Soho', 'Brixton', 'Peckham', 'Shoreditch', 'Croydon']
+    cuisines = ['Indian restaurant', 'Italian restaurant', 'Chinese restaurant', 'Cafe', 'Pizza restaurant',
+                'Sushi restaurant', 'Thai restaurant', 'Bakery', 'Pub', 'Korean barbecue restaurant']
+    streets = ['High Street', 'Station Road', 'Church Lane', 'Market Square', 'King Street']
+
+    def word():
+        return ''.join(rnd.choice(syllables) for _ in range(rnd.randint(2, 3))).capitalize()
+
+    records = []
+    for i in range(count):
+        picked = rnd.sample(cuisines, rnd.randint(1, 2))
+        records.append({
+            'id': i, 'name': f"{word()} {rnd.choice(['Kitchen', 'House', 'Grill', 'Bar', word()])}",
+            'cuisines': picked, 'primary_cuisine': picked[0], 'city': rnd.choice(cities),
+            'rating': 3 + rnd.random() * 2, 'reviews': rnd.randint(0, 5000), 'score': 0,
+            'address': f"{rnd.randint(1, 300)} {rnd.choice(streets)}, London", 'phone': '',
+            'website': '', 'photo': '', 'latitude': None, 'longitude': None, 'julans_pick': False,
+        })
+        records[-1]['score'] = records[-1]['rating'] * records[-1]['reviews']
+    store = RestaurantStore.from_records(records)
+    order = array('i', sorted(range(count), key=store.score.__getitem__, reverse=True))
+
+    started = time.perf_counter()
+    index = SearchIndex.build(store, order)
+    print(f"{count} restaurants, {len(index.terms)} terms, built in {time.perf_counter() - started:.1f}s")
+
+    queries = ['k', 'ko', 'kor', 'kore', 'korean', 'korean ba', 'indian camden', 'pizza hig',
+               'ri', 'bakery soho', 'resturant', 'sa mo', 'grill brix', 'pub 12']
+    for typeahead in (True, False):
+        label = 'typeahead (8, budget 300)' if typeahead else 'search (20, budget 2000)'
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            for _ in range(5):
+                if typeahead:
+                    index.search(query, limit=8, budget=300)
+                else:
+                    index.search(query, limit=20)
+            timings.append((time.perf_counter() - started) * 1000 / 5)
+        timings.sort()
+        print(f"{label:<26} median {timings[len(timings) // 2]:6.2f} ms   worst {timings[-1]:6.2f} ms")
@@ -0,0 +1,279 @@
+"""
+"You might also like" recommendations
+Every restaurant's most similar restaurants are worked out once, when the data
+is processed, and kept as one fixed-width row of store positions per
+restaurant, so serving them is a slice of a flat array. Like the other
+indexes, the rows are written into the binary snapshot (sections()) and used
+straight from the mapped file (from_sections()).
+
+Recommendations come from within one cell's width of a restaurant, on a grid
+sized to the density of the data, so every candidate is in the same or a
+neighbouring cell. Similarity blends three things: how many cuisines two
+restaurants share (Jaccard overlap of their cuisine sets), how close they are
+(falling linearly to nothing at that reach) and how well the recommended
+restaurant scores (its place in the score order). Each cell's comparisons
+are a few numpy operations over its candidates: distances from projected
+coordinates and shared cuisines from a product of one-hot cuisine matrices.
+Restaurants without coordinates get no recommendations.
+
+Usage: python similar.py [N]   (benchmark against an exhaustive scan)
+"""
+import math
+from array import array
+from bisect import bisect_left
+
+# Recommendations kept per restaurant
+SIMILAR_COUNT = 8
+
+# Weights of shared cuisines, nearness and score in the similarity
+CUISINE_WEIGHT = 0.6
+DISTANCE_WEIGHT = 0.25
+SCORE_WEIGHT = 0.15
+
+# Average number of restaurants a grid cell is sized to hold, and the
+# smallest cell
+TARGET_PER_CELL = 24
+MIN_CELL_KM = 0.25
+
+# Restaurant pairs compared per numpy batch
+BATCH_PAIRS = 1 << 21
+
+KM_PER_DEGREE = math.pi * 6371.0088 / 180
+
+
+class _Scorer:
+    """Similarity of batches of restaurants to candidate restaurants, with numpy"""
+
+    def __init__(self, np, store, order):
+        self.np = np
+        n = len(store)
+        latitude = np.asarray(store.latitude, dtype='float64')
+        longitude = np.asarray(store.longitude, dtype='float64')
+        self.located = np.flatnonzero(~np.isnan(latitude) & ~np.isnan(longitude))
+        rank = np.empty(n, dtype='float64')
+        rank[np.asarray(order, dtype='int64')] = np.arange(n)
+        self.quality = (SCORE_WEIGHT * (1 - rank / max(1, n))).astype('float32')
+
+        # Equirectangular projection to km around the mean location, fine at
+        # the scale of a city
+        centre_lat, centre_lon = 0.0, 0.0
+        if len(self.located):
+            centre_lat = float(latitude[self.located].mean())
+            centre_lon = float(longitude[self.located].mean())
+        self.y = ((latitude - centre_lat) * KM_PER_DEGREE).astype('float32')
+        self.x = ((longitude - centre_lon) * KM_PER_DEGREE * math.cos(math.radians(centre_lat))).astype('float32')
+
+        self.offsets = np.asarray(store.cuisine_offsets, dtype='int64')
+        self.codes = np.asarray(store.cuisine_codes, dtype='int64')
+        self.width = max(1, len(store.cuisine_names))
+
+    def cuisines(self, positions):
+        """One-hot cuisine matrix (float32) of the restaurants at positions"""
+        np = self.np
+        starts = self.offsets[positions]
+        lengths = self.offsets[positions + 1] - starts
+        matrix = np.zeros((len(positions), self.width), dtype='float32')
+        total = int(lengths.sum())
+        if total:
+            rows = np.repeat(np.arange(len(positions)), lengths)
+            # Index of every cuisine code of every row in the flat codes array
+            flat = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            matrix[rows, self.codes[np.repeat(starts, lengths) + flat]] = 1
+        return matrix
+
+    def similarity(self, batch, columns, candidates, reach, candidate_cuisines=None):
+        """Matrix of similarities (float32) of each restaurant in batch to each candidate
+
+        columns[n] is the column of batch[n] among the candidates. Candidates
+        further than reach km away, and each restaurant itself, get -inf.
+        """
+        np = self.np
+        if candidate_cuisines is None:
+            candidate_cuisines = self.cuisines(candidates)
+        own = self.cuisines(batch)
+        # Jaccard overlap; restaurants without cuisines share nothing
+        shared = own @ candidate_cuisines.T
+        union = own.sum(axis=1)[:, None] + candidate_cuisines.sum(axis=1) - shared
+        np.maximum(union, 1, out=union)
+        similarity = np.divide(shared, union, out=shared)
+        similarity *= CUISINE_WEIGHT
+        similarity += self.quality[candidates]
+
+        dy = self.y[batch][:, None] - self.y[candidates]
+        km = self.x[batch][:, None] - self.x[candidates]
+        km *= km
+        dy *= dy
+        km += dy
+        np.sqrt(km, out=km)
+        far = km > reach
+        km *= -DISTANCE_WEIGHT / reach
+        km += DISTANCE_WEIGHT
+        similarity += km
+        similarity[far] = -np.inf
+        similarity[np.arange(len(batch)), columns] = -np.inf
+        return similarity
+
+    def best(self, similarity, candidates, top):
+        """Positions of the top most similar candidates of each row, most similar first
+
+        Rows with fewer than top candidates in reach are padded with -1.
+        """
+        np = self.np
+        best = np.argpartition(-similarity, top - 1, axis=1)[:, :top]
+        values = np.take_along_axis(similarity, best, axis=1)
+        positions = candidates[best]
+        # Equal similarities go to the earlier position
+        ranked = np.lexsort((positions, -values), axis=1)
+        positions = np.take_along_axis(positions, ranked, axis=1)
+        positions[np.take_along_axis(values, ranked, axis=1) == -np.inf] = -1
+        return positions
+
+
+class SimilarIndex:
+    """The SIMILAR_COUNT most similar restaurants of every restaurant in a store
+
+    ids holds one row of k store positions per restaurant, most similar
+    first, padded with -1; recommendations are at most reach km away. by_id
+    lists positions in ascending order of restaurant id, to find a restaurant
+    from its id by binary search.
+    """
+
+    def __init__(self, store, k, reach, ids, by_id):
+        self.store = store
+        self.k = k
+        self.reach = reach
+        self.ids = ids
+        self.by_id = by_id
+
+    @classmethod
+    def build(cls, store, order, k=SIMILAR_COUNT):
+        """Compute every restaurant's recommendations; order is the score order"""
+        # Only building needs numpy, so the app can serve a snapshot without it
+        import numpy as np
+
+        n = len(store)
+        by_id = np.argsort(np.asarray(store.ids, dtype='int64'), kind='stable').astype('int32')
+        neighbours = np.full((n, k), -1, dtype='int32')
+
+        scorer = _Scorer(np, store, order)
+        located, y, x = scorer.located, scorer.y, scorer.x
+        cell = 0.0
+        if len(located) > 1 and k > 0:
+            south, west = y[located].min(), x[located].min()
+            area = (max(y[located].max() - south, MIN_CELL_KM) *
+                    max(x[located].max() - west, MIN_CELL_KM))
+            cell = max(MIN_CELL_KM, math.sqrt(area * TARGET_PER_CELL / len(located)))
+
+            # Cell keys with a one-cell margin, so neighbouring keys never wrap a row
+            row = np.floor((y[located] - south) / cell).astype('int64') + 1
+            column = np.floor((x[located] - west) / cell).astype('int64') + 1
+            width = int(column.max()) + 2
+            keys = row * width + column
+            sort = np.argsort(keys, kind='stable')
+            members, keys = located[sort], keys[sort]
+            cells, starts = np.unique(keys, return_index=True)
+            ends = np.append(starts[1:], len(keys))
+            around = cells[:, None] + np.array([dy * width + dx for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+            found = np.minimum(np.searchsorted(cells, around), len(cells) - 1)
+            found = np.where(cells[found] == around, found, -1)
+
+            for c in range(len(cells)):
+                blocks = [f for f in found[c] if f >= 0]
+                candidates = np.concatenate([members[starts[f]:ends[f]] for f in blocks])
+                top = min(k, len(candidates) - 1)
+                if top <= 0:
+                    continue
+                candidate_cuisines = scorer.cuisines(candidates)
+                # The cell's own restaurants are one run of the candidates
+                first = sum(ends[f] - starts[f] for f in blocks[:blocks.index(c)])
+                step = max(1, BATCH_PAIRS // len(candidates))
+                for s in range(starts[c], ends[c], step):
+                    batch = members[s:min(s + step, ends[c])]
+                    columns = np.arange(len(batch)) + (first + s - starts[c])
+                    similarity = scorer.similarity(batch, columns, candidates, cell, candidate_cuisines)
+                    neighbours[batch, :top] = scorer.best(similarity, candidates, top)
+
+        return cls(store, k, cell, array('i', neighbours.tobytes()), array('i', by_id.tobytes()))
+
+    def sections(self):
+        """(name, typecode, data) sections for a binary snapshot"""
+        return [('similar.params', 'd', array('d', [self.k, self.reach])),
+                ('similar.ids', 'i', self.ids),
+                ('similar.by_id', 'i', self.by_id)]
+
+    @classmethod
+    def from_sections(cls, store, sections):
+        """Reopen an index over memory-mapped snapshot sections"""
+        k, reach = sections['similar.params']
+        return cls(store, int(k), reach, sections['similar.ids'], sections['similar.by_id'])
+
+    def get(self, position, limit=None):
+        """Positions of the restaurants most similar to the one at position"""
+        k = self.k
+        row = self.ids[position * k:position * k + (k if limit is None else min(k, limit))]
+        return [p for p in row if p >= 0]
+
+    def position_of(self, restaurant_id):
+        """Store position of the restaurant with an id, or None"""
+        ids = self.store.ids
+        n = bisect_left(self.by_id, restaurant_id, key=ids.__getitem__)
+        if n < len(self.by_id) and ids[self.by_id[n]] == restaurant_id:
+            return self.by_id[n]
+        return None
+
+
+if __name__ == '__main__':
+    import random
+    import sys
+    import time
+
+    import numpy as np
+    from store import RestaurantStoreBuilder
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rnd = random.Random(42)
+    cuisine_names = [f'Cuisine {n}' for n in range(40)]
+    weights = [1 / (n + 1) for n in range(len(cuisine_names))]
+    centres = [(51.513, -0.131), (51.539, -0.142), (51.524, -0.078), (51.462, -0.115),
+               (51.505, -0.023), (51.492, -0.224), (51.556, -0.280)]
+    builder = RestaurantStoreBuilder()
+    for i in range(count):
+        if rnd.random() < 0.7:
+            lat, lon = rnd.choice(centres)
+            lat, lon = rnd.gauss(lat, 0.02), rnd.gauss(lon, 0.03)
+        elif rnd.random() < 0.97:
+            lat, lon = 51.3 + rnd.random() * 0.4, -0.5 + rnd.random() * 0.6
+        else:
+            lat = lon = None
+        cuisines = list(dict.fromkeys(rnd.choices(cuisine_names, weights, k=rnd.randint(1, 4))))
+        builder.append({'id': i, 'name': f'Restaurant {i}', 'cuisines': cuisines, 'city': 'London',
+                        'rating': 4.0, 'reviews': 10, 'score': rnd.random(), 'latitude': lat,
+                        'longitude': lon})
+    store = builder.build()
+    order = array('i', sorted(range(count), key=store.score.__getitem__, reverse=True))
+
+    started = time.perf_counter()
+    index = SimilarIndex.build(store, order)
+    elapsed = time.perf_counter() - started
+    size = sum(len(data) * data.itemsize for _, _, data in index.sections())
+    print(f"{count} restaurants: {index.k} recommendations within {index.reach:.2f} km in {elapsed:.1f}s, "
+          f"{size / 2**20:.1f} MB in the snapshot")
+
+    # The same formula over every located restaurant, without the grid
+    scorer = _Scorer(np, store, order)
+    samples = np.array(sorted(rnd.sample(list(scorer.located), min(200, len(scorer.located)))))
+    candidates = scorer.located
+    exhaustive = np.concatenate([
+        scorer.best(scorer.similarity(samples[s:s + 8], np.searchsorted(candidates, samples[s:s + 8]),
+                                      candidates, index.reach), candidates, index.k)
+        for s in range(0, len(samples), 8)])
+    found = sum(len(set(index.get(int(p))) & set(row.tolist())) for p, row in zip(samples, exhaustive))
+    print(f"{found / np.count_nonzero(exhaustive >= 0):.1%} of the exhaustive scan's top {index.k} "
+          f"found for {len(samples)} restaurants")
+
+    mapped = SimilarIndex.from_sections(store, {name: memoryview(data) for name, _, data in index.sections()})
+    started = time.perf_counter()
+    lookups = [mapped.get(mapped.position_of(store.ids[int(p)])) for p in samples]
+    lookup_us = (time.perf_counter() - started) * 1e6 / len(samples)
+    assert lookups == [index.get(int(p)) for p in samples]
+    print(f"id lookup plus recommendations from the mapped index: {lookup_us:.1f} us")
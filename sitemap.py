@@ -0,0 +1,82 @@
+"""
+Sitemap generation
+URLs are computed once per data snapshot from the inverted indexes and split
+into shards below the sitemap protocol's 50,000-URL limit. /sitemap.xml is a
+sitemap index pointing at the shards; each document is streamed in batches.
+"""
+from xml.sax.saxutils import escape
+
+BASE_URL = 'https://www.londonfoodfindsuk.co.uk'
+
+# The protocol allows 50,000 URLs per file; stay comfortably below it
+MAX_URLS_PER_SHARD = 45000
+
+# URLs rendered per chunk of a streamed response
+_BATCH = 1000
+
+
+def build_urls(neighbourhoods, cuisines, neighbourhood_cuisine_index):
+    """Every sitemap entry as (path, changefreq, priority), in sitemap order"""
+    urls = [
+        ('/', 'daily', '1.0'),
+        ('/about', 'monthly', '0.7'),
+        ('/cuisines', 'weekly', '0.8'),
+        ('/neighbourhoods', 'weekly', '0.8'),
+    ]
+
+    # All neighbourhood pages
+    for slug in sorted(neighbourhoods):
+        urls.append((f'/neighbourhood/{slug}', 'weekly', '0.8'))
+
+    # All cuisine pages
+    for slug in sorted(cuisines):
+        urls.append((f'/cuisine/{slug}', 'weekly', '0.8'))
+
+    # Neighbourhood + cuisine combination pages, straight from the posting lists
+    for n_slug, c_slug in sorted(neighbourhood_cuisine_index.keys()):
+        if n_slug in neighbourhoods and c_slug in cuisines:
+            urls.append((f'/neighbourhood/{n_slug}/cuisine/{c_slug}', 'weekly', '0.7'))
+
+    return urls
+
+
+class Sitemap:
+    """Sitemap URLs for one data snapshot, split into shards"""
+
+    def __init__(self, version, updated_at, urls):
+        self.version = version
+        self.updated_at = updated_at
+        self.urls = urls
+        self.shard_count = max(1, -(-len(urls) // MAX_URLS_PER_SHARD))
+
+    def shard(self, n):
+        """URLs of 1-based shard n"""
+        start = (n - 1) * MAX_URLS_PER_SHARD
+        return self.urls[start:start + MAX_URLS_PER_SHARD]
+
+    def iter_index(self):
+        """Stream the <sitemapindex> document"""
+        lastmod = self.updated_at.strftime('%Y-%m-%d')
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        for n in range(1, self.shard_count + 1):
+            yield (f'    <sitemap>\n'
+                   f'        <loc>{BASE_URL}/sitemap-{n}.xml</loc>\n'
+                   f'        <lastmod>{lastmod}</lastmod>\n'
+                   f'    </sitemap>\n')
+        yield '</sitemapindex>'
+
+    def iter_shard(self, n):
+        """Stream the <urlset> document of shard n"""
+        urls = self.shard(n)
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        for start in range(0, len(urls), _BATCH):
+            yield ''.join(
+                f'    <url>\n'
+                f'        <loc>{BASE_URL}{escape(path)}</loc>\n'
+                f'        <changefreq>{changefreq}</changefreq>\n'
+                f'        <priority>{priority}</priority>\n'
+                f'    </url>\n'
+                for path, changefreq, priority in urls[start:start + _BATCH])
+        yield '</urlset>'
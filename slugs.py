@@ -0,0 +1,26 @@
+"""
+URL slugs for cuisine and neighbourhood names
+Kept apart from ingest.py so the app can build its indexes without importing
+pandas; missing values (None, NaN, pandas.NA) slugify to '' as pd.isna would
+have them.
+"""
+import re
+
+_SLUG_STRIP = re.compile(r'[^\w\s-]')
+_SLUG_DASHES = re.compile(r'[-\s]+')
+
+
+def _missing(value):
+    try:
+        return value is None or bool(value != value)
+    except TypeError:  # pandas.NA has no truth value
+        return True
+
+def slugify(text):
+    """Convert text to URL-friendly slug"""
+    if _missing(text) or not text:
+        return ""
+    text = str(text).lower()
+    text = _SLUG_STRIP.sub('', text)
+    text = _SLUG_DASHES.sub('-', text)
+    return text.strip('-')
@@ -0,0 +1,245 @@
+"""
+Binary, memory-mappable snapshot of processed restaurant data
+
+Layout (little-endian):
+    header    MAGIC, format version, section count
+    table     one entry per section: name, array typecode, byte offset, item count
+    sections  raw column data, each aligned to 8 bytes
+
+Numeric columns are fixed-width arrays and every free-text column is a UTF-8
+blob indexed by an offsets array, so loading is an mmap plus a small JSON
+metadata section; rows are decoded only when a page actually reads them.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime, timezone
+
+from facets import FacetIndex
+from store import RestaurantStore, StringTable, PostingIndex
+from search import SearchIndex
+from similar import SimilarIndex
+from spatial import SpatialIndex
+
+MAGIC = b'LFFSNAP\x00'
+# 2: the version digest covers section names and the metadata too
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct('<8sII')
+_ENTRY = struct.Struct('<48scxxxxxxxQQ')
+_NAME_SIZE = 48
+_ALIGN = 8
+
+# Fixed-width numeric columns of RestaurantStore and their array typecodes
+NUMERIC_COLUMNS = (
+    ('ids', 'q'),
+    ('rating', 'd'),
+    ('reviews', 'q'),
+    ('score', 'd'),
+    ('latitude', 'd'),
+    ('longitude', 'd'),
+    ('julans_pick', 'b'),
+    ('city_codes', 'i'),
+    ('cuisine_codes', 'i'),
+    ('cuisine_offsets', 'q'),
+)
+
+# String columns: section prefix -> RestaurantStore attribute
+STRING_COLUMNS = (
+    ('name', 'names'),
+    ('address', 'addresses'),
+    ('phone', 'phones'),
+    ('website', 'websites'),
+    ('photo', 'photos'),
+)
+
+# Posting-list indexes persisted alongside the rows
+INDEX_NAMES = ('cuisine_index', 'neighbourhood_index', 'neighbourhood_cuisine_index')
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is missing, truncated or of an unknown format"""
+
+
+def _as_bytes(data):
+    if isinstance(data, array):
+        return data.tobytes()
+    return bytes(data)
+
+
+def write_sections(path, sections):
+    """Write (name, typecode, data) sections to path
+
+    The file is written under a temporary name and renamed over path, so a
+    running app that has the old snapshot mapped keeps reading intact data.
+    """
+    if sys.byteorder != 'little':
+        raise SnapshotError('binary snapshots are only written on little-endian hosts')
+
+    payloads = []
+    for name, typecode, data in sections:
+        if len(name) > _NAME_SIZE:
+            raise SnapshotError(f'section name {name!r} is longer than {_NAME_SIZE} bytes')
+        raw = _as_bytes(data)
+        itemsize = array(typecode).itemsize
+        payloads.append((name.encode('ascii'), typecode.encode('ascii'), raw, len(raw) // itemsize))
+
+    offset = _HEADER.size + _ENTRY.size * len(payloads)
+    table = []
+    for name, typecode, raw, count in payloads:
+        offset += -offset % _ALIGN
+        table.append(_ENTRY.pack(name, typecode, offset, count))
+        offset += len(raw)
+
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(payloads)))
+        for entry in table:
+            f.write(entry)
+        for name, typecode, raw, count in payloads:
+            f.write(b'\x00' * (-f.tell() % _ALIGN))
+            f.write(raw)
+    os.replace(temp_path, path)
+
+
+def read_sections(path):
+    """Memory-map a snapshot file and return {name: memoryview} over its sections"""
+    if sys.byteorder != 'little':
+        raise SnapshotError('binary snapshots can only be read on little-endian hosts')
+
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise SnapshotError(f'{path} is empty')
+
+    buffer = memoryview(mm)
+    if len(buffer) < _HEADER.size:
+        raise SnapshotError(f'{path} is truncated')
+    magic, version, count = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise SnapshotError(f'{path} is not a restaurant snapshot')
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f'{path} has format version {version}, expected {FORMAT_VERSION}')
+
+    sections = {}
+    try:
+        for n in range(count):
+            name, typecode, offset, items = _ENTRY.unpack_from(buffer, _HEADER.size + n * _ENTRY.size)
+            typecode = typecode.decode('ascii')
+            size = array(typecode).itemsize * items
+            if offset + size > len(buffer):
+                raise SnapshotError(f'{path} is truncated')
+            view = buffer[offset:offset + size]
+            sections[name.rstrip(b'\x00').decode('ascii')] = view if typecode == 'B' else view.cast(typecode)
+    except (struct.error, UnicodeDecodeError, ValueError) as e:
+        raise SnapshotError(f'{path} has a corrupt section table: {e}')
+    return sections
+
+
+def save_snapshot(path, store, score_order, indexes, cuisines, neighbourhoods, search=None,
+                  spatial=None, facets=None, created_at=None, similar=None):
+    """Write processed data and its indexes as a binary snapshot
+
+    indexes maps each name in INDEX_NAMES to a dict of key -> id array;
+    search, spatial, facets and similar are optional SearchIndex,
+    SpatialIndex, FacetIndex and SimilarIndex objects built over the same
+    store and score order. created_at
+    (default: now) is recorded as when the data was produced.
+    Returns the metadata that was written.
+    """
+    sections = [(column, typecode, getattr(store, column)) for column, typecode in NUMERIC_COLUMNS]
+    for prefix, attr in STRING_COLUMNS:
+        table = getattr(store, attr)
+        sections.append((f'{prefix}.blob', 'B', table.blob))
+        sections.append((f'{prefix}.offsets', 'q', table.offsets))
+    sections.append(('score_order', 'i', array('i', score_order)))
+
+    index_keys = {}
+    for name in INDEX_NAMES:
+        flat = PostingIndex.from_dict(indexes[name])
+        index_keys[name] = [list(key) if isinstance(key, tuple) else key for key in flat.keys()]
+        sections.append((f'{name}.offsets', 'q', flat.offsets))
+        sections.append((f'{name}.ids', 'i', flat.ids))
+    for derived in (search, spatial, facets, similar):
+        if derived is not None:
+            sections.extend(derived.sections())
+
+    # The content digest doubles as the snapshot version. It covers every
+    # section's name and data and the metadata except created_at, so the same
+    # data always gets the same version; the metadata is written last, with
+    # the digest it records left out.
+    meta = {
+        'created_at': (created_at or datetime.now(timezone.utc)).isoformat(timespec='seconds'),
+        'count': len(store),
+        'cities': store.cities,
+        'cuisine_names': store.cuisine_names,
+        'cuisines': cuisines,
+        'neighbourhoods': neighbourhoods,
+        'index_keys': index_keys,
+    }
+    digest = hashlib.sha1()
+    for name, typecode, data in sections:
+        digest.update(f'{name}:{typecode}:'.encode('ascii'))
+        digest.update(_as_bytes(data))
+    content = {key: value for key, value in meta.items() if key != 'created_at'}
+    digest.update(json.dumps(content, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    meta['version'] = digest.hexdigest()[:16]
+    sections.append(('meta', 'B', json.dumps(meta, ensure_ascii=False).encode('utf-8')))
+
+    write_sections(path, sections)
+    return meta
+
+
+def load_snapshot(path):
+    """Memory-map a binary snapshot written by save_snapshot
+
+    Returns a dict with 'restaurants' (a RestaurantStore over the mapped
+    columns), 'cuisines', 'neighbourhoods', 'score_order', the posting-list
+    indexes keyed by INDEX_NAMES, 'search', 'spatial', 'facets' and 'similar'
+    (each None for snapshots written without one) and 'version'.
+    """
+    sections = read_sections(path)
+    try:
+        meta = json.loads(str(sections['meta'], 'utf-8'))
+        columns = {column: sections[column] for column, _ in NUMERIC_COLUMNS}
+        strings = {attr: StringTable(sections[f'{prefix}.blob'], sections[f'{prefix}.offsets'])
+                   for prefix, attr in STRING_COLUMNS}
+        store = RestaurantStore(cities=meta['cities'], cuisine_names=meta['cuisine_names'],
+                                **columns, **strings)
+        if len(store) != meta['count']:
+            raise SnapshotError(f'{path} row count does not match its metadata')
+
+        result = {
+            'restaurants': store,
+            'cuisines': meta['cuisines'],
+            'neighbourhoods': meta['neighbourhoods'],
+            'score_order': sections['score_order'],
+            'version': meta['version'],
+            'created_at': meta['created_at'],
+        }
+        for name in INDEX_NAMES:
+            keys = [tuple(key) if isinstance(key, list) else key for key in meta['index_keys'][name]]
+            result[name] = PostingIndex(keys, sections[f'{name}.offsets'], sections[f'{name}.ids'])
+        result['search'] = None
+        if 'search.terms.blob' in sections:
+            result['search'] = SearchIndex.from_sections(store, sections['score_order'], sections)
+        result['spatial'] = None
+        if 'spatial.params' in sections:
+            result['spatial'] = SpatialIndex.from_sections(store.latitude, store.longitude,
+                                                           sections['score_order'], sections)
+        result['facets'] = None
+        if 'facets.codes' in sections:
+            result['facets'] = FacetIndex.from_sections(store, sections)
+        result['similar'] = None
+        if 'similar.params' in sections:
+            result['similar'] = SimilarIndex.from_sections(store, sections)
+    except KeyError as e:
+        raise SnapshotError(f'{path} is missing section {e}')
+    except (UnicodeDecodeError, ValueError, TypeError) as e:
+        raise SnapshotError(f'{path} has corrupt metadata: {e}')
+    return result
@@ -46,6 +46,56 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
+    // Search typeahead
+    const searchForm = document.querySelector('.nav-search');
+    if (searchForm) {
+        const input = searchForm.querySelector('input');
+        const box = searchForm.querySelector('.search-suggestions');
+        let timer = null;
+        let latest = '';
+
+        const escapeHtml = text => String(text).replace(/[&<>"']/g, ch => ({
+            '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+        })[ch]);
+
+        const render = data => {
+            const links = [];
+            data.cuisines.forEach(c => links.push(`<a href="${c.url}">${escapeHtml(c.name)}<small>Cuisine</small></a>`));
+            data.neighbourhoods.forEach(n => links.push(`<a href="${n.url}">${escapeHtml(n.name)}<small>Area</small></a>`));
+            data.restaurants.forEach(r => links.push(
+                `<a href="/search?q=${encodeURIComponent(r.name)}">${escapeHtml(r.name)}<small>${escapeHtml(r.city)}</small></a>`));
+            box.innerHTML = links.join('');
+            box.hidden = links.length === 0;
+        };
+
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            const query = input.value.trim();
+            if (!query) {
+                box.hidden = true;
+                return;
+            }
+            timer = setTimeout(function() {
+                latest = query;
+                fetch('/api/suggest?q=' + encodeURIComponent(query))
+                    .then(response => response.json())
+                    .then(data => {
+                        // Ignore answers to queries the user has already typed past
+                        if (data.query === latest) {
+                            render(data);
+                        }
+                    })
+                    .catch(() => { box.hidden = true; });
+            }, 120);
+        });
+
+        document.addEventListener('click', function(event) {
+            if (!searchForm.contains(event.target)) {
+                box.hidden = true;
+            }
+        });
+    }
+
     // Handle image loading errors
     const restaurantImages = document.querySelectorAll('.restaurant-image img');
     restaurantImages.forEach(img => {
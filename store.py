@@ -0,0 +1,367 @@
+"""
+Compact columnar storage for processed restaurant data
+Numeric fields live in typed arrays, cities and cuisines are dictionary-encoded,
+and free-text fields are packed into one UTF-8 blob per column
+"""
+import math
+from array import array
+from itertools import accumulate
+
+# Free-text columns kept in packed string tables
+STRING_FIELDS = ('name', 'address', 'phone', 'website', 'photo')
+
+# Keys of a restaurant record, in the order processed_data.json has always used
+RECORD_FIELDS = ('id', 'name', 'cuisines', 'primary_cuisine', 'city', 'rating', 'reviews',
+                 'score', 'address', 'phone', 'website', 'photo', 'latitude', 'longitude',
+                 'julans_pick')
+
+
+class StringTable:
+    """Immutable sequence of strings stored as one UTF-8 blob plus an offsets array"""
+    __slots__ = ('blob', 'offsets')
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        """Pack an iterable of strings"""
+        encoded = [text.encode('utf-8') for text in strings]
+        offsets = array('q', [0])
+        offsets.extend(accumulate(map(len, encoded)))
+        return cls(b''.join(encoded), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self):
+        return len(self.blob) + self.offsets.itemsize * len(self.offsets)
+
+
+class StringTableBuilder:
+    """Accumulates strings into a StringTable"""
+
+    def __init__(self):
+        self.blob = bytearray()
+        self.offsets = array('q', [0])
+
+    def append(self, text):
+        self.blob += text.encode('utf-8')
+        self.offsets.append(len(self.blob))
+
+    def build(self):
+        return StringTable(bytes(self.blob), self.offsets)
+
+
+def parse_coordinate(value):
+    """Coordinates as floats, with NaN standing in for missing values"""
+    try:
+        return float(value) if value is not None else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class Restaurant:
+    """Lightweight read-only view of one row of a RestaurantStore
+
+    Supports both attribute access (templates) and item access (r['score'])
+    so it is a drop-in replacement for the old per-restaurant dicts.
+    """
+    __slots__ = ('_store', '_pos')
+
+    def __init__(self, store, pos):
+        self._store = store
+        self._pos = pos
+
+    @property
+    def position(self):
+        return self._pos
+
+    @property
+    def id(self):
+        return self._store.ids[self._pos]
+
+    @property
+    def name(self):
+        return self._store.names[self._pos]
+
+    @property
+    def cuisines(self):
+        store = self._store
+        codes = store.cuisine_codes[store.cuisine_offsets[self._pos]:store.cuisine_offsets[self._pos + 1]]
+        return [store.cuisine_names[c] for c in codes]
+
+    @property
+    def primary_cuisine(self):
+        store = self._store
+        return store.cuisine_names[store.cuisine_codes[store.cuisine_offsets[self._pos]]]
+
+    @property
+    def city(self):
+        return self._store.cities[self._store.city_codes[self._pos]]
+
+    @property
+    def rating(self):
+        return self._store.rating[self._pos]
+
+    @property
+    def reviews(self):
+        return self._store.reviews[self._pos]
+
+    @property
+    def score(self):
+        return self._store.score[self._pos]
+
+    @property
+    def address(self):
+        return self._store.addresses[self._pos]
+
+    @property
+    def phone(self):
+        return self._store.phones[self._pos]
+
+    @property
+    def website(self):
+        return self._store.websites[self._pos]
+
+    @property
+    def photo(self):
+        return self._store.photos[self._pos]
+
+    @property
+    def latitude(self):
+        value = self._store.latitude[self._pos]
+        return None if math.isnan(value) else value
+
+    @property
+    def longitude(self):
+        value = self._store.longitude[self._pos]
+        return None if math.isnan(value) else value
+
+    @property
+    def julans_pick(self):
+        return bool(self._store.julans_pick[self._pos])
+
+    def __getitem__(self, key):
+        if key not in RECORD_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in RECORD_FIELDS else default
+
+    def keys(self):
+        return RECORD_FIELDS
+
+    def to_dict(self):
+        """Plain dict in the processed_data.json record layout"""
+        return {key: getattr(self, key) for key in RECORD_FIELDS}
+
+    def __repr__(self):
+        return f"<Restaurant {self.id} {self.name!r}>"
+
+
+class RestaurantStore:
+    """Column-oriented, read-only collection of restaurants
+
+    Indexing returns Restaurant row views; positions are stable for the
+    lifetime of the store and are what the inverted indexes refer to.
+    """
+
+    def __init__(self, ids, rating, reviews, score, latitude, longitude, julans_pick,
+                 city_codes, cities, cuisine_codes, cuisine_offsets, cuisine_names,
+                 names, addresses, phones, websites, photos):
+        self.ids = ids
+        self.rating = rating
+        self.reviews = reviews
+        self.score = score
+        self.latitude = latitude
+        self.longitude = longitude
+        self.julans_pick = julans_pick
+        self.city_codes = city_codes
+        self.cities = cities
+        self.cuisine_codes = cuisine_codes
+        self.cuisine_offsets = cuisine_offsets
+        self.cuisine_names = cuisine_names
+        self.names = names
+        self.addresses = addresses
+        self.phones = phones
+        self.websites = websites
+        self.photos = photos
+
+    @classmethod
+    def from_records(cls, records):
+        """Build a store from an iterable of restaurant dicts"""
+        builder = RestaurantStoreBuilder()
+        for record in records:
+            builder.append(record)
+        return builder.build()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, pos):
+        if pos < 0:
+            pos += len(self.ids)
+        if not 0 <= pos < len(self.ids):
+            raise IndexError('restaurant position out of range')
+        return Restaurant(self, pos)
+
+    def __iter__(self):
+        for pos in range(len(self.ids)):
+            yield Restaurant(self, pos)
+
+    def cuisine_codes_at(self, pos):
+        """Dictionary codes of the cuisines of the restaurant at a position"""
+        return self.cuisine_codes[self.cuisine_offsets[pos]:self.cuisine_offsets[pos + 1]]
+
+    def to_records(self):
+        return [row.to_dict() for row in self]
+
+    def reordered(self, order):
+        """Copy of the store with its rows rearranged into the given position order"""
+        def take(column):
+            typecode = getattr(column, 'typecode', None) or column.format
+            return array(typecode, (column[i] for i in order))
+
+        cuisine_codes = array('i')
+        cuisine_offsets = array('q', [0])
+        for i in order:
+            cuisine_codes.extend(self.cuisine_codes_at(i))
+            cuisine_offsets.append(len(cuisine_codes))
+
+        def take_strings(table):
+            return StringTable.from_strings(table[i] for i in order)
+
+        return RestaurantStore(take(self.ids), take(self.rating), take(self.reviews),
+                               take(self.score), take(self.latitude), take(self.longitude),
+                               take(self.julans_pick), take(self.city_codes), list(self.cities),
+                               cuisine_codes, cuisine_offsets, list(self.cuisine_names),
+                               take_strings(self.names), take_strings(self.addresses),
+                               take_strings(self.phones), take_strings(self.websites),
+                               take_strings(self.photos))
+
+    def nbytes(self):
+        """Approximate memory held by the columns and dictionaries"""
+        total = 0
+        for column in (self.ids, self.rating, self.reviews, self.score, self.latitude,
+                       self.longitude, self.julans_pick, self.city_codes,
+                       self.cuisine_codes, self.cuisine_offsets):
+            total += column.itemsize * len(column)
+        for table in (self.names, self.addresses, self.phones, self.websites, self.photos):
+            total += table.nbytes()
+        total += sum(len(s.encode('utf-8')) for s in self.cities)
+        total += sum(len(s.encode('utf-8')) for s in self.cuisine_names)
+        return total
+
+
+class RestaurantStoreBuilder:
+    """Appends restaurant records one at a time into growing columns"""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.rating = array('d')
+        self.reviews = array('q')
+        self.score = array('d')
+        self.latitude = array('d')
+        self.longitude = array('d')
+        self.julans_pick = array('b')
+        self.city_codes = array('i')
+        self.cuisine_codes = array('i')
+        self.cuisine_offsets = array('q', [0])
+        self.cities = []
+        self.cuisine_names = []
+        self._city_lookup = {}
+        self._cuisine_lookup = {}
+        self.strings = {field: StringTableBuilder() for field in STRING_FIELDS}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _code(self, lookup, values, text):
+        code = lookup.get(text)
+        if code is None:
+            code = lookup[text] = len(values)
+            values.append(text)
+        return code
+
+    def append(self, record):
+        self.ids.append(int(record['id']))
+        self.rating.append(float(record['rating']))
+        self.reviews.append(int(record['reviews']))
+        self.score.append(float(record['score']))
+        self.latitude.append(parse_coordinate(record.get('latitude')))
+        self.longitude.append(parse_coordinate(record.get('longitude')))
+        self.julans_pick.append(1 if record.get('julans_pick') else 0)
+        self.city_codes.append(self._code(self._city_lookup, self.cities, record['city']))
+        for cuisine in record['cuisines']:
+            self.cuisine_codes.append(self._code(self._cuisine_lookup, self.cuisine_names, cuisine))
+        self.cuisine_offsets.append(len(self.cuisine_codes))
+        for field in STRING_FIELDS:
+            self.strings[field].append(record.get(field) or '')
+
+    def build(self):
+        strings = {field: builder.build() for field, builder in self.strings.items()}
+        return RestaurantStore(self.ids, self.rating, self.reviews, self.score,
+                               self.latitude, self.longitude, self.julans_pick,
+                               self.city_codes, self.cities, self.cuisine_codes,
+                               self.cuisine_offsets, self.cuisine_names,
+                               strings['name'], strings['address'], strings['phone'],
+                               strings['website'], strings['photo'])
+
+
+class PostingIndex:
+    """Read-only mapping of key -> ids, stored as slices of one flat ids array
+
+    This is the shape posting lists take inside a binary snapshot; slices are
+    taken lazily, so a memory-mapped index costs nothing until a key is used.
+    """
+
+    def __init__(self, keys, offsets, ids):
+        self._slots = {key: n for n, key in enumerate(keys)}
+        self.offsets = offsets
+        self.ids = ids
+
+    @classmethod
+    def from_dict(cls, postings):
+        """Flatten a dict of key -> id arrays"""
+        offsets = array('q', [0])
+        ids = array('i')
+        for values in postings.values():
+            ids.extend(values)
+            offsets.append(len(ids))
+        return cls(list(postings), offsets, ids)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def __getitem__(self, key):
+        n = self._slots[key]
+        return self.ids[self.offsets[n]:self.offsets[n + 1]]
+
+    def get(self, key, default=None):
+        n = self._slots.get(key)
+        if n is None:
+            return default
+        return self.ids[self.offsets[n]:self.offsets[n + 1]]
+
+    def keys(self):
+        return self._slots.keys()
+
+    def items(self):
+        for key in self._slots:
+            yield key, self[key]
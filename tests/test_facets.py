@@ -0,0 +1,63 @@
+"""Checkpointed facet pages must match a plain filtered slice of the posting list"""
+import os
+import random
+import sys
+from array import array
+from itertools import product
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from facets import BLOCK, RATING_STEPS, REVIEW_STEPS, FacetIndex
+
+# Every combination of the offered filters, the unfiltered listing included
+FILTERS = [dict(f for f in (('rating', rating), ('reviews', reviews), ('pick', pick)) if f[1])
+           for rating, reviews, pick in product((None,) + RATING_STEPS, (None,) + REVIEW_STEPS, (False, True))]
+
+PAGE = 12
+
+
+def fixture_store(size=20 * BLOCK, seed=42):
+    """Restaurants with ratings and review counts spread across every facet level"""
+    rng = random.Random(seed)
+    return SimpleNamespace(
+        rating=[rng.choice((3.2, 4.0, 4.2, 4.5, 4.8)) for _ in range(size)],
+        reviews=[rng.choice((5, 100, 250, 500, 800, 1000, 4000)) for _ in range(size)],
+        julans_pick=[rng.random() < 0.5 for _ in range(size)],
+    )
+
+
+def fixture_lists(store):
+    """A full listing and a sparser one, both in a shuffled (non-positional) order"""
+    rng = random.Random(7)
+    everything = list(range(len(store.rating)))
+    rng.shuffle(everything)
+    return {('all',): array('i', everything), ('some',): array('i', everything[::3])}
+
+
+def naive(store, ids, filters):
+    return [i for i in ids
+            if store.rating[i] >= filters.get('rating', 0)
+            and store.reviews[i] >= filters.get('reviews', 0)
+            and (store.julans_pick[i] or not filters.get('pick'))]
+
+
+def test_page_matches_filtered_slice():
+    store = fixture_store()
+    facets = FacetIndex(store)
+    for key, ids in fixture_lists(store).items():
+        for filters in FILTERS:
+            expected = naive(store, ids, filters)
+            starts = {0, BLOCK - 1, BLOCK, len(expected) - 1, len(expected), len(expected) + PAGE}
+            for start in sorted(s for s in starts if s >= 0):
+                want = expected[start:start + PAGE]
+                assert facets.page(ids, filters, start, PAGE) == want, (key, filters, start)
+                assert facets.page(ids, filters, start, PAGE, key) == want, (key, filters, start)
+
+
+def test_count_matches_filtered_list():
+    store = fixture_store()
+    facets = FacetIndex(store)
+    for key, ids in fixture_lists(store).items():
+        for filters in FILTERS:
+            assert facets.count(key, ids, filters) == len(naive(store, ids, filters)), (key, filters)
@@ -0,0 +1,98 @@
+"""Incremental rebuilds of deduplicated data must keep duplicates out like a full build"""
+import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import incremental
+from ingest import process_exports
+
+COLUMNS = ['name', 'subtypes', 'city', 'rating', 'reviews', 'full_address', 'street',
+           'phone', 'phone_1', 'site', 'photo', 'latitude', 'longitude', 'place_id']
+
+ROWS = [
+    # name, subtypes, city, rating, reviews, full_address, phone, lat, lng, place_id
+    ('Sabai Thai', 'Thai restaurant', 'Soho', 4.6, 300, '1 Dean St, London W1D 3RB', '020 7000 0001',
+     51.51300, -0.13100, 'p0'),
+    # The same venue listed twice: same phone and address, 10 m away, fewer reviews
+    ('Sabai Thai Restaurant', 'Thai restaurant', 'Soho', 4.2, 40, '1 Dean St, London W1D 3RB', '020 7000 0001',
+     51.51309, -0.13100, 'p1'),
+    ('The Crown', 'Pub', 'Camden', 4.1, 80, '2 High St, London NW1 7JE', '020 7000 0002',
+     51.54100, -0.14200, 'p2'),
+    ('Curry House', 'Indian restaurant', 'Shoreditch', 4.5, 900, '3 Brick Ln, London E1 6PU', '020 7000 0003',
+     51.52100, -0.07200, 'p3'),
+    ('Noodle Bar', 'Noodle shop', 'Shoreditch', 4.8, 640, '9 Old St, London EC1V 9HL', '020 7000 0004',
+     51.52600, -0.08700, 'p4'),
+    ('Grill Stop', 'Grill', 'Camden', 3.9, 12, '6 Camden Rd, London NW1 9DP', '020 7000 0005',
+     51.55200, -0.13900, 'p5'),
+]
+
+
+def write_export(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for name, subtypes, city, rating, reviews, address, phone, lat, lng, place_id in rows:
+            writer.writerow([name, subtypes, city, rating, reviews, address, address.split(',')[0],
+                             phone, '', '', '', lat, lng, place_id])
+    return str(path)
+
+
+def full_build(path):
+    """Records (best-first), counts and state of a full build with duplicates dropped"""
+    store, cuisines, neighbourhoods, report = process_exports([path], dedup='on')
+    records = sorted(store.to_records(), key=lambda record: (-record['score'], record['id']))
+    return records, cuisines, neighbourhoods, incremental.build_state(path, report)
+
+
+def test_full_build_remembers_dropped_rows(tmp_path):
+    path = write_export(tmp_path / 'export.csv', ROWS)
+    records, cuisines, neighbourhoods, state = full_build(path)
+    assert sorted(record['id'] for record in records) == [0, 2, 3, 4, 5]
+    assert state['dedup'] is True
+    assert state['dropped'] == [1]
+
+    # The same export again: nothing is rebuilt and the dropped row stays out
+    records, cuisines, neighbourhoods, state, changes = incremental.incremental_rebuild(
+        path, records, cuisines, neighbourhoods, state)
+    assert sorted(record['id'] for record in records) == [0, 2, 3, 4, 5]
+    assert changes['unchanged'] == len(ROWS)
+    assert changes['added'] == changes['changed'] == changes['duplicates_dropped'] == []
+    assert state['dropped'] == [1]
+
+
+def test_changed_and_new_duplicates_stay_out(tmp_path):
+    records, cuisines, neighbourhoods, state = full_build(write_export(tmp_path / 'export.csv', ROWS))
+
+    rows = list(ROWS)
+    # The dropped listing changes but still duplicates Sabai Thai
+    rows[1] = rows[1][:4] + (45,) + rows[1][5:]
+    # A new listing of Curry House, a few metres from it and less reviewed
+    rows.append(('Curry House Ltd', 'Indian restaurant', 'Shoreditch', 4.3, 15, '3 Brick Ln, London E1 6PU',
+                 '020 7000 0003', 51.52103, -0.07201, 'p6'))
+    records, cuisines, neighbourhoods, state, changes = incremental.incremental_rebuild(
+        write_export(tmp_path / 'changed.csv', rows), records, cuisines, neighbourhoods, state)
+
+    assert sorted(record['id'] for record in records) == [0, 2, 3, 4, 5]
+    assert 'Curry House Ltd' not in [record['name'] for record in records]
+    assert state['dropped'] == [1, 6]
+    assert changes['duplicates_dropped'] == [1, 6]
+    assert changes['added'] == changes['changed'] == []
+    assert cuisines['indian']['count'] == 1
+
+
+def test_changed_dropped_row_that_is_no_longer_a_duplicate_returns(tmp_path):
+    records, cuisines, neighbourhoods, state = full_build(write_export(tmp_path / 'export.csv', ROWS))
+
+    rows = list(ROWS)
+    # The venue moved across town under a new name and number
+    rows[1] = ('Sabai Kitchen', 'Thai restaurant', 'Camden', 4.2, 40, '40 Parkway, London NW1 7AH',
+               '020 7000 0009', 51.53800, -0.14700, 'p1')
+    records, cuisines, neighbourhoods, state, changes = incremental.incremental_rebuild(
+        write_export(tmp_path / 'changed.csv', rows), records, cuisines, neighbourhoods, state)
+
+    assert sorted(record['id'] for record in records) == [0, 1, 2, 3, 4, 5]
+    assert state['dropped'] == []
+    assert changes['duplicates_dropped'] == []
+    assert changes['added'] == [1]
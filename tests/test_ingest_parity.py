@@ -0,0 +1,74 @@
+"""The ingest pipelines must agree record for record on awkward export rows"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest
+from dataset import compute_score_order
+
+COLUMNS = ['name', 'subtypes', 'city', 'rating', 'reviews', 'full_address', 'street',
+           'phone', 'phone_1', 'site', 'photo', 'latitude', 'longitude', 'place_id']
+
+ROWS = [
+    # name, subtypes, city, rating, reviews, full_address, street, phone, phone_1, site, photo, lat, lng, place_id
+    ('Sabai', 'Thai restaurant, Noodle takeaway', 'Soho', 4.6, 120, '1 Dean St', '', '020 1', '',
+     'https://sabai.example', '', 51.51, -0.13, 'p1'),
+    ('The Crown', 'Bar, Restaurant', 'Camden', 4.1, 80, '', '2 High St', '', '020 2',
+     np.nan, np.nan, 51.54, -0.14, 'p2'),
+    ('Curry House', 'Indian takeaway, indian restaurant', np.nan, 4.6, 120, '3 Brick Ln', '', '020 3', '',
+     '', 'https://photo.example/3.jpg', 51.52, -0.07, 'p3'),
+    ('Cafe Nero', 'Café, Italian café', 'Soho', 'nan', 'nan', '4 Old Compton St', '', '', '',
+     '', '', 51.513, -0.131, 'p4'),
+    ('Mystery', np.nan, '', np.nan, np.nan, '', '', '', '',
+     '', '', np.nan, np.nan, 'p5'),
+    ('Grill Stop', 'Grill, Food, Dining', 'Camden', '3.9', '12', '6 Camden Rd', '', '020 6', '',
+     '', '', '51.55', '-0.14', 'p6'),
+]
+
+
+def fixture_frame():
+    return pd.DataFrame.from_records(ROWS, columns=COLUMNS)
+
+
+def test_vectorized_matches_rows():
+    assert ingest.check_parity(fixture_frame()) == []
+
+
+def test_streaming_matches_rows():
+    df = fixture_frame()
+    expected, expected_cuisines, expected_neighbourhoods = ingest.process_rows(df)
+    store, cuisines_count, neighbourhoods_count = ingest.process_stream(ingest.iter_records([df]))
+    # Streamed rows stay in arrival order; the score order ranks them like the others
+    assert [r.id for r in store] == sorted(r.id for r in store)
+    assert [store[i].to_dict() for i in compute_score_order(store)] == [r.to_dict() for r in expected]
+    assert list(cuisines_count.items()) == list(expected_cuisines.items())
+    assert list(neighbourhoods_count.items()) == list(expected_neighbourhoods.items())
+
+
+def test_awkward_rows():
+    store, cuisines_count, neighbourhoods_count = ingest.process_rows(fixture_frame())
+    by_name = {r.name: r.to_dict() for r in store}
+
+    # Suffixes are stripped and the same cuisine is only listed once
+    assert by_name['Sabai']['cuisines'] == ['Thai', 'Noodle']
+    assert by_name['Curry House']['cuisines'] == ['Indian']
+    assert by_name['Cafe Nero']['cuisines'] == ['Italian']
+    # Only skip terms, or no subtypes at all, falls back to Restaurant
+    assert by_name['The Crown']['cuisines'] == ['Restaurant']
+    assert by_name['Grill Stop']['cuisines'] == ['Restaurant']
+    assert by_name['Mystery']['cuisines'] == ['Restaurant']
+
+    # A literal 'nan' rating parses as no rating rather than NaN
+    assert by_name['Cafe Nero']['rating'] == 0.0
+    assert by_name['Cafe Nero']['reviews'] == 0
+    assert by_name['Mystery']['city'] == 'London'
+    assert by_name['Curry House']['city'] == 'London'
+
+    # Ties keep export order
+    names = [r.name for r in store]
+    assert names.index('Sabai') < names.index('Curry House')
+    assert 'london' in neighbourhoods_count and 'indian' in cuisines_count
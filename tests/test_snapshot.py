@@ -0,0 +1,97 @@
+"""A saved snapshot must map back to the same store, indexes and version"""
+import os
+import sys
+from array import array
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset import posting_indexes
+from facets import FacetIndex
+from search import SearchIndex
+from similar import SimilarIndex
+from snapshot import INDEX_NAMES, NUMERIC_COLUMNS, STRING_COLUMNS, load_snapshot, save_snapshot
+from spatial import SpatialIndex
+from store import RestaurantStore
+
+RECORDS = [
+    # id, name, city, cuisines, rating, reviews, score, lat, lng, pick
+    (11, 'Sabai', 'Soho', ['Thai', 'Noodles'], 4.6, 120, 246.0, 51.513, -0.131, True),
+    (7, 'The Crown', 'Camden', ['Pub'], 4.1, 80, 181.0, 51.541, -0.142, False),
+    (23, 'Curry House', 'Shoreditch', ['Indian'], 4.6, 1200, 276.0, 51.521, -0.072, True),
+    (5, 'Café Nero', 'Soho', ['Café', 'Italian'], 4.0, 30, 150.0, 51.514, -0.130, False),
+    (42, 'Mystery', '', [], 0.0, 0, 0.0, None, None, False),
+    (3, 'Grill Stop', 'Camden', ['Grill', 'Pub'], 3.9, 12, 120.0, 51.552, -0.141, False),
+    (19, 'Noodle Bar', 'Shoreditch', ['Noodles', 'Thai'], 4.8, 640, 290.0, 51.524, -0.077, False),
+]
+
+CREATED_AT = datetime(2025, 11, 24, 20, 0, tzinfo=timezone.utc)
+
+
+def fixture_store():
+    return RestaurantStore.from_records([
+        {'id': id, 'name': name, 'city': city, 'cuisines': cuisines, 'rating': rating, 'reviews': reviews,
+         'score': score, 'latitude': lat, 'longitude': lng, 'julans_pick': pick,
+         'address': f'{id} High St', 'phone': '', 'website': f'https://{id}.example', 'photo': ''}
+        for id, name, city, cuisines, rating, reviews, score, lat, lng, pick in RECORDS])
+
+
+def save(path, store, facets=None, created_at=CREATED_AT):
+    order, by_cuisine, by_neighbourhood, by_pair = posting_indexes(store)
+    indexes = dict(zip(INDEX_NAMES, (by_cuisine, by_neighbourhood, by_pair)))
+    derived = {
+        'search': SearchIndex.build(store, order),
+        'spatial': SpatialIndex(store.latitude, store.longitude, order),
+        'facets': facets or FacetIndex(store),
+        'similar': SimilarIndex.build(store, order),
+    }
+    meta = save_snapshot(str(path), store, order, indexes, {'thai': 2}, {'soho': 2},
+                         created_at=created_at, **derived)
+    return meta, order, indexes, derived
+
+
+def section_bytes(index):
+    return {name: bytes(memoryview(data).cast('B')) for name, _, data in index.sections()}
+
+
+def test_round_trip(tmp_path):
+    store = fixture_store()
+    meta, order, indexes, derived = save(tmp_path / 'data.bin', store)
+    loaded = load_snapshot(str(tmp_path / 'data.bin'))
+
+    restored = loaded['restaurants']
+    for column, _ in NUMERIC_COLUMNS:
+        # NaN coordinates of the unlocated restaurant compare by their bytes
+        assert bytes(memoryview(getattr(restored, column)).cast('B')) == getattr(store, column).tobytes(), column
+    for _, attr in STRING_COLUMNS:
+        assert list(getattr(restored, attr)) == list(getattr(store, attr)), attr
+    assert restored.cities == store.cities and restored.cuisine_names == store.cuisine_names
+    assert list(loaded['score_order']) == list(order)
+    assert (loaded['cuisines'], loaded['neighbourhoods']) == ({'thai': 2}, {'soho': 2})
+
+    for name in INDEX_NAMES:
+        assert list(loaded[name]) == list(indexes[name]), name
+        for key, ids in indexes[name].items():
+            assert list(loaded[name][key]) == list(ids), (name, key)
+
+    for name, index in derived.items():
+        assert loaded[name] is not None, name
+        assert section_bytes(loaded[name]) == section_bytes(index), name
+
+    assert loaded['version'] == meta['version']
+    assert loaded['created_at'] == CREATED_AT.isoformat(timespec='seconds')
+
+
+def test_version_is_a_content_digest(tmp_path):
+    store = fixture_store()
+    version = save(tmp_path / 'a.bin', store)[0]['version']
+    # Only the content counts, not when it was produced
+    later = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    assert save(tmp_path / 'b.bin', store, created_at=later)[0]['version'] == version
+
+    # A single changed facet code is a different snapshot
+    codes = array('B', FacetIndex(store).codes)
+    codes[0] ^= 1
+    changed = save(tmp_path / 'c.bin', store, facets=FacetIndex(store, codes))[0]['version']
+    assert changed != version
+    assert load_snapshot(str(tmp_path / 'c.bin'))['version'] == changed
@@ -0,0 +1,79 @@
+"""Spatial index queries must return what a linear scan of the score order returns"""
+import math
+import os
+import random
+import sys
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spatial import SpatialIndex, brute_nearest, brute_within
+
+# Wide radii cover most of the data, so within() walks the global score order
+RADII = (0.3, 1.0, 5.0, 25.0, 100.0, 1000.0)
+LIMITS = (1, 12, 500)
+
+
+def fixture_points(count=4000, seed=42):
+    """Clustered London coordinates, a few unlocated, ranked in a shuffled score order"""
+    rng = random.Random(seed)
+    centres = [(51.51, -0.13), (51.54, -0.08), (51.46, -0.19)]
+    latitude, longitude = array('d'), array('d')
+    for n in range(count):
+        if n % 97 == 0:
+            latitude.append(math.nan)
+            longitude.append(math.nan)
+        elif rng.random() < 0.7:
+            lat, lon = rng.choice(centres)
+            latitude.append(rng.gauss(lat, 0.02))
+            longitude.append(rng.gauss(lon, 0.03))
+        else:
+            latitude.append(51.3 + rng.random() * 0.4)
+            longitude.append(-0.5 + rng.random() * 0.6)
+    order = list(range(count))
+    rng.shuffle(order)
+    return latitude, longitude, array('i', order)
+
+
+def query_points(seed=7):
+    rng = random.Random(seed)
+    points = [(51.3 + rng.random() * 0.4, -0.5 + rng.random() * 0.6) for _ in range(15)]
+    # South of the data, where the grid's density estimate expects restaurants
+    points += [(50.6 + rng.random() * 0.35, -0.5 + rng.random() * 0.6) for _ in range(5)]
+    return points
+
+
+def positions(results):
+    return [position for position, _ in results]
+
+
+def test_within_matches_scan():
+    latitude, longitude, order = fixture_points()
+    index = SpatialIndex(latitude, longitude, order)
+    for lat, lon in query_points():
+        for radius in RADII:
+            for limit in LIMITS:
+                got = index.within(lat, lon, radius, limit)
+                want = brute_within(latitude, longitude, order, lat, lon, radius, limit)
+                assert positions(got) == positions(want), (lat, lon, radius, limit)
+
+
+def test_within_empty_area():
+    latitude, longitude, order = fixture_points()
+    index = SpatialIndex(latitude, longitude, order)
+    # Paris: nothing within any radius short of the Channel crossing
+    for radius in (0.3, 5.0, 100.0):
+        assert index.within(48.8566, 2.3522, radius, 12) == []
+    assert brute_within(latitude, longitude, order, 48.8566, 2.3522, 100.0, 12) == []
+
+
+def test_nearest_matches_scan():
+    latitude, longitude, order = fixture_points()
+    index = SpatialIndex(latitude, longitude, order)
+    # Paris is far from every cell, so the ring search has to cross empty ground
+    for lat, lon in query_points() + [(48.8566, 2.3522)]:
+        for k in LIMITS:
+            got = index.nearest(lat, lon, k)
+            want = brute_nearest(latitude, longitude, order, lat, lon, k)
+            assert positions(got) == positions(want), (lat, lon, k)
+            assert all(abs(a - b) < 1e-9 for (_, a), (_, b) in zip(got, want))